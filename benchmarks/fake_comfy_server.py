@@ -0,0 +1,394 @@
+"""
+A stand-in for the ComfyUI server to benchmark the worker without a GPU.
+
+It implements the parts of the ComfyUI API the worker talks to: /prompt, /ws,
+/interrupt, /queue, /history, /view and /object_info. Queued prompts are
+"executed" one at a time by walking their nodes in dependency order, sleeping for a
+configurable time per node and sending the same websocket messages ComfyUI would,
+including step progress, binary preview frames and SaveImageWebsocket outputs.
+Like ComfyUI, nodes whose inputs are the same as in the previous prompt are
+reported as cached and not executed again.
+
+Usage:
+    python -m benchmarks.fake_comfy_server --port 8188 --node-latency KSamplerAdvanced=800
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+from aiohttp import web
+from pydantic import BaseModel
+
+from comfy.graph import canonical_hash, is_link, topological_order
+
+logger = logging.getLogger(__name__)
+
+# Binary frame header values used by ComfyUI
+PREVIEW_IMAGE_EVENT = 1
+JPEG_FORMAT = 1
+PNG_FORMAT = 2
+
+WEBSOCKET_OUTPUT_CLASSES = {"SaveImageWebsocket"}
+FILE_OUTPUT_CLASSES = {"SaveImage", "PreviewImage"}
+
+
+class FakeComfyConfig(BaseModel):
+    """Behaviour of the fake server."""
+
+    # Milliseconds spent in each node, by class_type
+    node_latency_ms: Dict[str, float] = {}
+    default_node_latency_ms: float = 5.0
+    # Nodes with a `steps` input send one progress message per step
+    preview_frames: bool = True
+    preview_size: int = 16 * 1024
+    output_size: int = 1024 * 1024
+    max_history: int = 1000
+    # Skip the nodes executed with the same inputs by the previous prompt
+    cache_outputs: bool = True
+
+
+class FakeComfyServer:
+    def __init__(self, config: FakeComfyConfig = None):
+        self.config = config if config is not None else FakeComfyConfig()
+        self.clients: Dict[str, web.WebSocketResponse] = {}
+        self.queue: "OrderedDict[str, dict]" = OrderedDict()
+        self.running: Optional[dict] = None
+        self.history: "OrderedDict[str, dict]" = OrderedDict()
+        self.files: Dict[str, bytes] = {}
+        self._queue_event = asyncio.Event()
+        self._interrupted = False
+        self._number = 0
+        self._worker: Optional[asyncio.Task] = None
+        # Signatures of the nodes of the previous prompt, see _signatures
+        self._cached: Set[str] = set()
+        # Random payloads are generated once, the content doesn't matter
+        self._preview = os.urandom(self.config.preview_size)
+        self._output = os.urandom(self.config.output_size)
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=1024**3)
+        # add_get also answers HEAD, used by the readiness check
+        app.router.add_get("/", self.handle_root)
+        app.router.add_get("/ws", self.handle_ws)
+        app.router.add_post("/prompt", self.handle_prompt)
+        app.router.add_post("/interrupt", self.handle_interrupt)
+        app.router.add_get("/queue", self.handle_get_queue)
+        app.router.add_post("/queue", self.handle_post_queue)
+        app.router.add_get("/history", self.handle_history)
+        app.router.add_get("/history/{prompt_id}", self.handle_history)
+        app.router.add_get("/view", self.handle_view)
+        app.router.add_get("/object_info", self.handle_object_info)
+        app.on_startup.append(self._start_worker)
+        app.on_cleanup.append(self._stop_worker)
+        return app
+
+    async def _start_worker(self, app) -> None:
+        self._worker = asyncio.create_task(self._run_queue())
+
+    async def _stop_worker(self, app) -> None:
+        if self._worker:
+            self._worker.cancel()
+
+    async def handle_root(self, request: web.Request) -> web.Response:
+        return web.Response(text="fake comfyui")
+
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        client_id = request.query.get("clientId") or uuid.uuid4().hex
+        self.clients[client_id] = ws
+        await ws.send_json(
+            {
+                "type": "status",
+                "data": {
+                    "status": {"exec_info": {"queue_remaining": len(self.queue)}},
+                    "sid": client_id,
+                },
+            }
+        )
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            if self.clients.get(client_id) is ws:
+                del self.clients[client_id]
+        return ws
+
+    async def handle_prompt(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        prompt = data.get("prompt")
+        if not isinstance(prompt, dict) or not prompt:
+            return web.json_response(
+                {"error": "No prompt provided", "node_errors": {}}, status=400
+            )
+        try:
+            order = topological_order(prompt)
+        except ValueError as e:
+            return web.json_response({"error": str(e), "node_errors": {}}, status=400)
+
+        prompt_id = data.get("prompt_id") or str(uuid.uuid4())
+        self._number += 1
+        self.queue[prompt_id] = {
+            "prompt_id": prompt_id,
+            "number": self._number,
+            "prompt": prompt,
+            "order": order,
+            "client_id": data.get("client_id"),
+        }
+        self._queue_event.set()
+        return web.json_response(
+            {"prompt_id": prompt_id, "number": self._number, "node_errors": {}}
+        )
+
+    async def handle_interrupt(self, request: web.Request) -> web.Response:
+        data = await request.json() if request.can_read_body else {}
+        prompt_id = data.get("prompt_id")
+        if self.running and prompt_id in (None, self.running["prompt_id"]):
+            self._interrupted = True
+        return web.Response()
+
+    def _queue_item(self, job: dict) -> list:
+        return [job["number"], job["prompt_id"], job["prompt"], {}, []]
+
+    async def handle_get_queue(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "queue_running": [self._queue_item(self.running)]
+                if self.running
+                else [],
+                "queue_pending": [self._queue_item(job) for job in self.queue.values()],
+            }
+        )
+
+    async def handle_post_queue(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        if data.get("clear"):
+            self.queue.clear()
+        for prompt_id in data.get("delete", []):
+            self.queue.pop(prompt_id, None)
+        return web.Response()
+
+    async def handle_history(self, request: web.Request) -> web.Response:
+        prompt_id = request.match_info.get("prompt_id")
+        if prompt_id:
+            entry = self.history.get(prompt_id)
+            return web.json_response({prompt_id: entry} if entry else {})
+        return web.json_response(dict(self.history))
+
+    async def handle_view(self, request: web.Request) -> web.Response:
+        content = self.files.get(request.query.get("filename", ""))
+        if content is None:
+            return web.Response(status=404)
+        return web.Response(body=content, content_type="image/png")
+
+    async def handle_object_info(self, request: web.Request) -> web.Response:
+        return web.json_response({})
+
+    async def _send(self, client_id: Optional[str], message_type: str, data: dict):
+        ws = self.clients.get(client_id)
+        if ws is not None and not ws.closed:
+            await ws.send_str(json.dumps({"type": message_type, "data": data}))
+
+    async def _send_image(self, client_id: Optional[str], image_format: int, image):
+        ws = self.clients.get(client_id)
+        if ws is not None and not ws.closed:
+            header = struct.pack(">II", PREVIEW_IMAGE_EVENT, image_format)
+            await ws.send_bytes(header + image)
+
+    async def _run_queue(self) -> None:
+        while True:
+            if not self.queue:
+                self._queue_event.clear()
+                await self._queue_event.wait()
+                continue
+            _, job = self.queue.popitem(last=False)
+            self.running = job
+            self._interrupted = False
+            try:
+                await self._execute(job)
+            except Exception as e:
+                logger.error(f"Fake execution failed: {e}")
+            finally:
+                self.running = None
+
+    @staticmethod
+    def _signatures(prompt: Dict, order: List[str]) -> Dict[str, str]:
+        """Hash of each node's class and inputs, links replaced by the signature of
+        the node they come from, like the cache keys of ComfyUI."""
+        signatures = {}
+        for node_id in order:
+            node = prompt[node_id]
+            inputs = {
+                name: [signatures[value[0]], value[1]] if is_link(value) else value
+                for name, value in node.get("inputs", {}).items()
+            }
+            signatures[node_id] = canonical_hash([node.get("class_type"), inputs])
+        return signatures
+
+    async def _execute(self, job: dict) -> None:
+        prompt_id = job["prompt_id"]
+        client_id = job["client_id"]
+        prompt = job["prompt"]
+        started_at = time.time()
+        outputs = {}
+        signatures = self._signatures(prompt, job["order"])
+        cached = (
+            [node_id for node_id in job["order"] if signatures[node_id] in self._cached]
+            if self.config.cache_outputs
+            else []
+        )
+
+        await self._send(
+            client_id,
+            "execution_start",
+            {"prompt_id": prompt_id, "timestamp": int(started_at * 1000)},
+        )
+        await self._send(
+            client_id, "execution_cached", {"nodes": cached, "prompt_id": prompt_id}
+        )
+        for node_id in job["order"]:
+            if node_id in cached:
+                continue
+            node = prompt[node_id]
+            class_type = node.get("class_type", "")
+            await self._send(
+                client_id,
+                "executing",
+                {"node": node_id, "display_node": node_id, "prompt_id": prompt_id},
+            )
+            latency = (
+                self.config.node_latency_ms.get(
+                    class_type, self.config.default_node_latency_ms
+                )
+                / 1000
+            )
+            steps = node.get("inputs", {}).get("steps")
+            if isinstance(steps, int) and steps > 0:
+                for step in range(steps):
+                    await asyncio.sleep(latency / steps)
+                    if self._interrupted:
+                        break
+                    await self._send(
+                        client_id,
+                        "progress",
+                        {
+                            "value": step + 1,
+                            "max": steps,
+                            "prompt_id": prompt_id,
+                            "node": node_id,
+                        },
+                    )
+                    if self.config.preview_frames:
+                        await self._send_image(client_id, JPEG_FORMAT, self._preview)
+            else:
+                await asyncio.sleep(latency)
+
+            if self._interrupted:
+                await self._send(
+                    client_id,
+                    "execution_interrupted",
+                    {
+                        "prompt_id": prompt_id,
+                        "node_id": node_id,
+                        "node_type": class_type,
+                        "executed": [],
+                    },
+                )
+                return
+
+            if class_type in WEBSOCKET_OUTPUT_CLASSES:
+                await self._send_image(client_id, PNG_FORMAT, self._output)
+            elif class_type in FILE_OUTPUT_CLASSES:
+                filename = f"{prompt_id}_{node_id}.png"
+                self.files[filename] = self._output
+                output = {
+                    "images": [
+                        {"filename": filename, "subfolder": "", "type": "output"}
+                    ]
+                }
+                outputs[node_id] = output
+                await self._send(
+                    client_id,
+                    "executed",
+                    {"node": node_id, "output": output, "prompt_id": prompt_id},
+                )
+
+        self._cached = set(signatures.values())
+        await self._send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+        await self._send(
+            client_id,
+            "execution_success",
+            {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)},
+        )
+        self.history[prompt_id] = {
+            "prompt": [job["number"], prompt_id, prompt, {}, []],
+            "outputs": outputs,
+            "status": {"status_str": "success", "completed": True},
+        }
+        while len(self.history) > self.config.max_history:
+            self.history.popitem(last=False)
+
+
+async def start_fake_server(
+    config: FakeComfyConfig = None, host: str = "127.0.0.1", port: int = 8188
+) -> web.AppRunner:
+    """Start the fake server on the running event loop. Stop it with runner.cleanup()."""
+    runner = web.AppRunner(FakeComfyServer(config).create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    # Same banner as ComfyUI, so ComfyServer.wait_until_ready can detect it
+    print(f"To see the GUI go to: http://{host}:{port}", flush=True)
+    return runner
+
+
+def parse_latencies(values) -> Dict[str, float]:
+    latencies = {}
+    for value in values or []:
+        class_type, milliseconds = value.split("=")
+        latencies[class_type] = float(milliseconds)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument(
+        "--node-latency",
+        action="append",
+        metavar="CLASS_TYPE=MS",
+        help="Time spent in nodes of a class, can be repeated",
+    )
+    parser.add_argument("--default-node-latency", type=float, default=5.0)
+    parser.add_argument("--output-size", type=int, default=1024 * 1024)
+    parser.add_argument("--preview-size", type=int, default=16 * 1024)
+    parser.add_argument("--no-previews", action="store_true")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Execute every node of every prompt"
+    )
+    args = parser.parse_args()
+
+    config = FakeComfyConfig(
+        node_latency_ms=parse_latencies(args.node_latency),
+        default_node_latency_ms=args.default_node_latency,
+        output_size=args.output_size,
+        preview_size=args.preview_size,
+        preview_frames=not args.no_previews,
+        cache_outputs=not args.no_cache,
+    )
+    logging.basicConfig(level=logging.INFO)
+    app = FakeComfyServer(config).create_app()
+    print(f"To see the GUI go to: http://{args.host}:{args.port}", flush=True)
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
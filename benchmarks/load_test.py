@@ -0,0 +1,169 @@
+"""
+Load generator for the worker orchestration.
+
+Drives either ComfyServer.execute or the HTTP routes of the API gateway at a fixed
+concurrency and reports throughput and latency percentiles. Together with the fake
+server this measures the overhead of the worker itself without a GPU.
+
+Usage:
+    # Against an in-process fake ComfyUI
+    python -m benchmarks.load_test --fake --requests 200 --concurrency 8
+
+    # Against a running ComfyUI or fake server
+    python -m benchmarks.load_test --port 8188 --requests 50 --concurrency 4
+
+    # Against the deployed FastAPI gateway
+    python -m benchmarks.load_test --url https://<app>.modal.run/infer_sync
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import math
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List
+
+import aiohttp
+
+from comfy.config import ComfyConfig
+from comfy.models import ExecutionData
+from comfy.server import ComfyServer
+from .fake_comfy_server import FakeComfyConfig, parse_latencies, start_fake_server
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    return ordered[max(0, math.ceil(len(ordered) * p / 100) - 1)]
+
+
+async def run_load(
+    send: Callable[[int], Awaitable[None]], requests: int, concurrency: int
+) -> Dict:
+    """Call `send` `requests` times with at most `concurrency` calls in flight."""
+    latencies: List[float] = []
+    errors: List[str] = []
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            started_at = time.perf_counter()
+            try:
+                await send(index)
+                latencies.append((time.perf_counter() - started_at) * 1000)
+            except Exception as e:
+                errors.append(str(e))
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started_at
+
+    ordered = sorted(latencies)
+    report = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0,
+    }
+    if ordered:
+        report.update(
+            {f"latency_p{p}_ms": round(percentile(ordered, p), 2) for p in (50, 95, 99)}
+        )
+        report["latency_max_ms"] = round(ordered[-1], 2)
+    if errors:
+        report["first_error"] = errors[0]
+    return report
+
+
+def load_prompt(path: str) -> Dict:
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def vary_prompt(prompt: Dict, index: int, text_path: str) -> Dict:
+    """Return a copy of the prompt with a different text input per request."""
+    prompt = copy.deepcopy(prompt)
+    node_id, _, input_name = text_path.split(".")
+    prompt[node_id]["inputs"][input_name] = f"load test request {index}"
+    return prompt
+
+
+async def benchmark_server(args) -> Dict:
+    runner = None
+    if args.fake:
+        runner = await start_fake_server(
+            FakeComfyConfig(
+                node_latency_ms=parse_latencies(args.node_latency),
+                default_node_latency_ms=args.default_node_latency,
+                output_size=args.output_size,
+                cache_outputs=not args.no_cache,
+            ),
+            port=args.port,
+        )
+    server = ComfyServer(ComfyConfig(SERVER_PORT=args.port))
+    prompt = load_prompt(args.prompt)
+
+    async def send(index: int):
+        await server.execute(
+            ExecutionData(
+                prompt=vary_prompt(prompt, index, args.text_path),
+                process_id=str(uuid.uuid4()),
+            )
+        )
+
+    try:
+        return await run_load(send, args.requests, args.concurrency)
+    finally:
+        await server.close()
+        if runner:
+            await runner.cleanup()
+
+
+async def benchmark_http(args) -> Dict:
+    async with aiohttp.ClientSession() as session:
+
+        async def send(index: int):
+            payload = {"prompt": f"load test request {index}"}
+            async with session.post(args.url, json=payload) as response:
+                await response.read()
+                if response.status >= 400:
+                    raise Exception(f"HTTP {response.status}")
+
+        return await run_load(send, args.requests, args.concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--url", help="Gateway route to POST to instead of ComfyUI")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--fake", action="store_true", help="Start a fake ComfyUI")
+    parser.add_argument("--prompt", default="prompt.json")
+    parser.add_argument(
+        "--text-path",
+        default="6.inputs.text",
+        help="Input that is changed for every request",
+    )
+    parser.add_argument("--node-latency", action="append", metavar="CLASS_TYPE=MS")
+    parser.add_argument("--default-node-latency", type=float, default=5.0)
+    parser.add_argument("--output-size", type=int, default=1024 * 1024)
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Make the fake ComfyUI execute every node of every prompt",
+    )
+    args = parser.parse_args()
+
+    benchmark = benchmark_http if args.url else benchmark_server
+    report = asyncio.run(benchmark(args))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
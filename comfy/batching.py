@@ -0,0 +1,364 @@
+"""
+Batching of concurrent executions of the same workflow into one prompt.
+
+Requests rendered from the same template differ in their literals only, such as
+the text of a CLIPTextEncode or the seed of a KSampler. Each request of a batch
+gets its own branch of one combined prompt, with its node ids prefixed by its
+position in the batch (see combine_prompts). Identical nodes of the branches,
+such as the loaders, the negative prompt or the empty latent, are then merged
+into one (see merge_duplicates), so they run once for the whole batch. Each
+branch keeps its own conditioning and seed: a request gets the images it would
+have gotten alone, and the images of its output nodes are routed back to it by
+their node id.
+
+Stock ComfyUI samples a latent batch with one conditioning and one seed, so the
+samplers of requests with different inputs still run one after another. What a
+batch saves is the queueing of one prompt per request and the nodes they share.
+"""
+
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from .binary_frames import PreviewFilter
+from lib.exceptions import ExecutionError
+from .callback_dispatcher import invoke
+from .graph import canonical_hash, is_link, iter_links, topological_order
+from .graph_optimizer import merge_duplicates
+from .models import ExecutionCallbacks, ExecutionData, ExecutionResult
+from .server import ComfyServer
+
+logger = logging.getLogger(__name__)
+
+# Separates the position of a request in its batch from its own node ids
+BRANCH_SEPARATOR = ":"
+
+
+def batch_key(prompt: Dict[str, Dict]) -> Optional[str]:
+    """Key of the prompts that can share a batch with this one, the ones with the
+    same nodes and links whatever their literals. None if it can't be batched."""
+    try:
+        topological_order(prompt)
+    except ValueError:
+        # Left for ComfyUI to report
+        return None
+    return canonical_hash(
+        {
+            node_id: [node.get("class_type"), sorted(iter_links(node))]
+            for node_id, node in prompt.items()
+        }
+    )
+
+
+def branch_id(index: int, node_id: str) -> str:
+    return f"{index}{BRANCH_SEPARATOR}{node_id}"
+
+
+def split_branch_id(node_id: Optional[str]) -> Tuple[Optional[int], Optional[str]]:
+    """Position of the request and its own id for a node id of a combined prompt,
+    (None, node_id) for ids that aren't."""
+    index, separator, own_id = (node_id or "").partition(BRANCH_SEPARATOR)
+    if not separator or not index.isdigit():
+        return None, node_id
+    return int(index), own_id
+
+
+def combine_prompts(
+    prompts: List[Dict[str, Dict]],
+) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+    """
+    One prompt running every given prompt in its own branch, with the identical
+    nodes of the branches merged. Returns it with the id of the node each merged
+    node was merged into.
+
+    Raises:
+        ValueError: If a prompt contains a cycle
+    """
+    branches = {}
+    # Branches don't link to each other, so one after the other is topological and
+    # the nodes of the first request are the ones kept
+    order = []
+    for index, prompt in enumerate(prompts):
+        order.extend(branch_id(index, node_id) for node_id in topological_order(prompt))
+        for node_id, node in prompt.items():
+            inputs = {
+                name: [branch_id(index, value[0]), value[1]]
+                if is_link(value)
+                else value
+                for name, value in node.get("inputs", {}).items()
+            }
+            branches[branch_id(index, node_id)] = {**node, "inputs": inputs}
+    return merge_duplicates(branches, order)
+
+
+def node_owners(merged: Dict[str, str]) -> Dict[str, List[int]]:
+    """Positions of the requests each node of a combined prompt runs for, for the
+    nodes other branches were merged into."""
+    owners: Dict[str, List[int]] = defaultdict(list)
+    for merged_id, kept_id in merged.items():
+        if not owners[kept_id]:
+            owners[kept_id].append(split_branch_id(kept_id)[0])
+        owners[kept_id].append(split_branch_id(merged_id)[0])
+    return dict(owners)
+
+
+def owned_by(node_id: Optional[str], index: int, owners: Dict[str, List[int]]) -> bool:
+    """Whether a node of a combined prompt runs for request `index`. Ids that aren't
+    of a branch are about the whole prompt."""
+    if node_id in owners:
+        return index in owners[node_id]
+    owner, _ = split_branch_id(node_id)
+    return owner is None or owner == index
+
+
+def unbranch_message(
+    msg: Any, index: int, owners: Dict[str, List[int]]
+) -> Optional[Any]:
+    """
+    A websocket message of a combined prompt as request `index` would have gotten
+    it alone, None if it is about nodes of other requests only. Messages about no
+    node, such as execution_start, go to every request.
+    """
+    if not isinstance(msg, dict):
+        return msg
+    msg = dict(msg)
+    for key in ("node", "display_node"):
+        if msg.get(key) is None:
+            continue
+        if not owned_by(msg[key], index, owners):
+            return None
+        msg[key] = split_branch_id(msg[key])[1]
+    if isinstance(msg.get("nodes"), list):
+        msg["nodes"] = [
+            split_branch_id(node_id)[1]
+            for node_id in msg["nodes"]
+            if owned_by(node_id, index, owners)
+        ]
+    return msg
+
+
+@dataclass
+class _BatchedRequest:
+    data: ExecutionData
+    callbacks: ExecutionCallbacks
+    future: asyncio.Future
+    cancelled: bool = False
+
+
+@dataclass
+class _Batch:
+    requests: List[_BatchedRequest] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+    task: Optional[asyncio.Task] = None
+
+
+class ExecutionBatcher:
+    """Runs concurrent executions of the same workflow as one prompt.
+
+    Executions whose prompts have the same nodes and links (see batch_key) and that
+    arrive within BATCH_MAX_WAIT_MS of each other are executed together, up to
+    BATCH_MAX_SIZE of them per prompt. Images, previews and websocket messages
+    go to the request whose branch they come from, under its own node ids.
+    Start and done are called for every request, progress is the one of the
+    whole batch. With a batch size of 1 executions are passed straight to the
+    server.
+    """
+
+    def __init__(
+        self,
+        server: ComfyServer,
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[int] = None,
+    ):
+        self.server = server
+        self.max_batch_size = (
+            max_batch_size
+            if max_batch_size is not None
+            else server.config.BATCH_MAX_SIZE
+        )
+        self.max_wait_ms = (
+            max_wait_ms if max_wait_ms is not None else server.config.BATCH_MAX_WAIT_MS
+        )
+        self._pending: Dict[str, _Batch] = {}
+
+    async def execute(
+        self,
+        data: ExecutionData,
+        callbacks: ExecutionCallbacks = ExecutionCallbacks(),
+    ) -> ExecutionResult:
+        """Execute a prompt, possibly as part of a batch. Same contract as
+        ComfyServer.execute, the result tells how many requests shared the prompt."""
+        key = batch_key(data.prompt) if self.max_batch_size > 1 else None
+        if key is None:
+            return await self.server.execute(data, callbacks)
+
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch()
+            batch.timer = loop.call_later(self.max_wait_ms / 1000, self._flush, key)
+        request = _BatchedRequest(data, callbacks, loop.create_future())
+        batch.requests.append(request)
+        if len(batch.requests) >= self.max_batch_size:
+            self._flush(key)
+
+        try:
+            # The batch runs until its last request expires, each request gives up
+            # at its own timeout
+            return await asyncio.wait_for(
+                asyncio.shield(request.future), self.server.remaining_time(data)
+            )
+        except asyncio.TimeoutError:
+            self._leave(key, batch, request)
+            raise ExecutionError("Execution timed out")
+        except asyncio.CancelledError:
+            self._leave(key, batch, request)
+            raise
+
+    def _leave(self, key: str, batch: _Batch, request: _BatchedRequest) -> None:
+        request.cancelled = True
+        if batch.task is None:
+            batch.requests.remove(request)
+            if not batch.requests and self._pending.get(key) is batch:
+                batch.timer.cancel()
+                del self._pending[key]
+        elif all(r.cancelled for r in batch.requests):
+            # Nobody waits for the batch anymore, free the GPU
+            batch.task.cancel()
+
+    def _flush(self, key: str) -> None:
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        batch.task = asyncio.create_task(self._run(batch))
+
+    async def _run(self, batch: _Batch) -> None:
+        requests = batch.requests
+        try:
+            if len(requests) == 1:
+                results = [
+                    await self.server.execute(requests[0].data, requests[0].callbacks)
+                ]
+            else:
+                results = await self._run_batch(requests)
+        except asyncio.CancelledError:
+            for request in requests:
+                request.future.cancel()
+            raise
+        except Exception as e:
+            for request in requests:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        for request, result in zip(requests, results):
+            if not request.future.done():
+                request.future.set_result(result)
+
+    async def _run_batch(
+        self, requests: List[_BatchedRequest]
+    ) -> List[ExecutionResult]:
+        prompt, merged = combine_prompts([request.data.prompt for request in requests])
+        logger.info(
+            f"Executing {len(requests)} requests as one prompt, "
+            f"{len(merged)} of their nodes merged"
+        )
+        data = ExecutionData(
+            prompt=prompt,
+            process_id=requests[0].data.process_id,
+            deadline=self._batch_deadline(requests),
+            previews="all"
+            if any(request.data.previews != "none" for request in requests)
+            else "none",
+            progress_interval=requests[0].data.progress_interval,
+            progress_min_delta=requests[0].data.progress_min_delta,
+        )
+        result = await self.server.execute(
+            data, self._split_callbacks(requests, node_owners(merged))
+        )
+        return [
+            result.model_copy(update={"batch_size": len(requests)}) for _ in requests
+        ]
+
+    def _batch_deadline(self, requests: List[_BatchedRequest]) -> Optional[float]:
+        """The batch runs until the last of its requests expires."""
+        now = time.time()
+        expiries = []
+        for request in requests:
+            remaining = self.server.remaining_time(request.data)
+            if remaining is None:
+                return None
+            expiries.append(now + remaining)
+        return max(expiries)
+
+    def _split_callbacks(
+        self, requests: List[_BatchedRequest], owners: Dict[str, List[int]]
+    ) -> ExecutionCallbacks:
+        """Callbacks for the batch that forward to the callbacks of its requests,
+        `owners` tells which requests the merged nodes run for."""
+        # The batch sends every preview, each request filters its own
+        previews = [
+            PreviewFilter(request.data.previews, request.data.preview_interval)
+            for request in requests
+        ]
+
+        async def forward(name, *args):
+            for request in requests:
+                callback = getattr(request.callbacks, name)
+                if callback:
+                    await invoke(callback, *args)
+
+        def for_each_request(name):
+            async def callback(msg):
+                for request in requests:
+                    handler = getattr(request.callbacks, name)
+                    if handler:
+                        await invoke(
+                            handler, {**msg, "process_id": request.data.process_id}
+                        )
+
+            return callback
+
+        async def on_output(node, image, image_format):
+            index, own_id = split_branch_id(node)
+            if index is None or index >= len(requests):
+                logger.warning(f"Dropping an output image of unknown node {node}")
+                return
+            callback = requests[index].callbacks.on_output
+            if callback:
+                await invoke(callback, own_id, image, image_format)
+
+        async def on_preview(node, image, image_format):
+            # A preview of a merged node is one of every request it runs for
+            own_id = split_branch_id(node)[1]
+            for index, request in enumerate(requests):
+                if (
+                    request.callbacks.on_preview
+                    and owned_by(node, index, owners)
+                    and previews[index].accept()
+                ):
+                    await invoke(
+                        request.callbacks.on_preview, own_id, image, image_format
+                    )
+
+        async def on_ws_message(message_type, msg):
+            for index, request in enumerate(requests):
+                if request.callbacks.on_ws_message is None:
+                    continue
+                own_msg = unbranch_message(msg, index, owners)
+                if own_msg is not None:
+                    await invoke(request.callbacks.on_ws_message, message_type, own_msg)
+
+        return ExecutionCallbacks(
+            on_error=lambda msg: forward("on_error", msg),
+            on_done=for_each_request("on_done"),
+            on_start=for_each_request("on_start"),
+            on_progress=lambda event, msg, sid: forward("on_progress", event, msg, sid),
+            on_output=on_output,
+            on_preview=on_preview,
+            on_ws_message=on_ws_message,
+        )
@@ -0,0 +1,121 @@
+"""
+Decoding of the binary websocket frames sent by ComfyUI.
+
+Every binary frame starts with a 4-byte big-endian event type. Image events follow
+it with a 4-byte image format and the encoded image, or with the length of a JSON
+metadata block, the metadata and the image. Both step previews and the results of
+SaveImageWebsocket nodes are sent as image events, so they are told apart by the
+class_type of the node that sent them.
+"""
+
+import json
+import struct
+import time
+from typing import Dict, Literal, Optional
+
+# Binary event types of ComfyUI (server.BinaryEventTypes)
+PREVIEW_IMAGE = 1
+TEXT = 3
+PREVIEW_IMAGE_WITH_METADATA = 4
+
+IMAGE_FORMATS = {1: "jpeg", 2: "png", 3: "webp"}
+
+# Nodes whose images are results sent over the websocket instead of saved to disk
+OUTPUT_NODE_CLASSES = {"SaveImageWebsocket"}
+
+HEADER = struct.Struct(">II")
+EVENT = struct.Struct(">I")
+
+PreviewMode = Literal["all", "throttle", "none"]
+
+
+class ImageFrame:
+    """An image sent over the websocket, the image is a view on the received frame."""
+
+    __slots__ = ("node", "image_format", "image", "is_output")
+
+    def __init__(
+        self,
+        node: Optional[str],
+        image_format: str,
+        image: memoryview,
+        is_output: bool,
+    ):
+        self.node = node
+        self.image_format = image_format
+        self.image = image
+        self.is_output = is_output
+
+
+def frame_event(data: bytes) -> Optional[int]:
+    """Event type of a binary frame."""
+    if len(data) < EVENT.size:
+        return None
+    return EVENT.unpack_from(data)[0]
+
+
+def decode_image_frame(
+    data: bytes, current_node: Optional[str], class_types: Dict[str, str]
+) -> Optional[ImageFrame]:
+    """
+    Decode an image frame without copying the image.
+
+    Args:
+        data: The binary frame as received
+        current_node: The node ComfyUI is executing, which sent frames without metadata
+        class_types: class_type by node id of the prompt
+
+    Returns:
+        The decoded frame, or None for frames that don't carry an image
+    """
+    if len(data) < HEADER.size:
+        return None
+    event, value = HEADER.unpack_from(data)
+    view = memoryview(data)
+
+    if event == PREVIEW_IMAGE:
+        node = current_node
+        image_format = IMAGE_FORMATS.get(value, "unknown")
+        image = view[HEADER.size :]
+    elif event == PREVIEW_IMAGE_WITH_METADATA:
+        metadata_end = HEADER.size + value
+        if metadata_end > len(data):
+            return None
+        try:
+            metadata = json.loads(bytes(view[HEADER.size : metadata_end]))
+        except ValueError:
+            return None
+        if not isinstance(metadata, dict):
+            return None
+        node = metadata.get("node_id", current_node)
+        image_format = metadata.get("image_type", "unknown").split("/")[-1]
+        image = view[metadata_end:]
+    else:
+        return None
+
+    is_output = class_types.get(node) in OUTPUT_NODE_CLASSES
+    return ImageFrame(node, image_format, image, is_output)
+
+
+class PreviewFilter:
+    """Decides which preview frames of a request are passed on."""
+
+    def __init__(self, mode: PreviewMode = "none", interval: float = 1.0):
+        self.mode = mode
+        self.interval = interval
+        self._last_sent_at: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "none"
+
+    def accept(self) -> bool:
+        if self.mode == "all":
+            return True
+        if self.mode == "none":
+            return False
+        now = time.monotonic()
+        if self._last_sent_at is not None and now - self._last_sent_at < self.interval:
+            return False
+        self._last_sent_at = now
+        return True
@@ -0,0 +1,169 @@
+import asyncio
+import inspect
+import logging
+from collections import deque
+from typing import Callable, Deque, Dict, Literal, Optional
+
+from .models import ExecutionCallbacks
+
+logger = logging.getLogger(__name__)
+
+CallbackOverflow = Literal["coalesce", "drop"]
+
+CALLBACK_NAMES = (
+    "on_error",
+    "on_done",
+    "on_progress",
+    "on_start",
+    "on_output",
+    "on_preview",
+    "on_ws_message",
+)
+
+
+async def invoke(callback: Callable, *args) -> None:
+    """Call a callback and await it if it is a coroutine function."""
+    result = callback(*args)
+    if inspect.isawaitable(result):
+        await result
+
+
+class _Event:
+    __slots__ = ("callback", "args", "key")
+
+    def __init__(self, callback: Callable, args: tuple, key: Optional[str]):
+        self.callback = callback
+        self.args = args
+        self.key = key
+
+
+class CallbackDispatcher:
+    """Runs the callbacks of a job on their own task, behind a bounded queue.
+
+    The monitoring loop only appends events to the queue, so a slow callback (a
+    remote websocket, a coroutine doing I/O) never holds back the consumption of
+    ComfyUI messages. Callbacks may be plain functions or coroutine functions and
+    run one at a time in the order of their events.
+
+    When the consumer falls `max_size` events behind:
+    - Previews and websocket messages other than progress are dropped
+    - Progress events are dropped with the "drop" policy. With "coalesce" they
+      replace the progress event of the same kind still in the queue, so at most
+      one of each kind waits and the consumer always sees the latest progress
+    - Start, outputs, errors and completion are always delivered. A job has one
+      of each, plus one output per output node, so the queue stays bounded by
+      `max_size` plus those
+
+    Dropped events are counted in `dropped`.
+    """
+
+    def __init__(
+        self,
+        callbacks: ExecutionCallbacks,
+        max_size: int = 256,
+        overflow: CallbackOverflow = "coalesce",
+    ):
+        self.target = callbacks
+        self.max_size = max_size
+        self.overflow = overflow
+        self.dropped = 0
+        self.coalesced = 0
+        self._events: Deque[_Event] = deque()
+        # Progress events still in the queue, by kind, for coalescing
+        self._pending_progress: Dict[str, _Event] = {}
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.create_task(self._consume())
+
+    @property
+    def callbacks(self) -> ExecutionCallbacks:
+        """Callbacks that enqueue events instead of running the target callbacks."""
+        wrapped = {}
+        for name in CALLBACK_NAMES:
+            callback = getattr(self.target, name)
+            if callback is not None:
+                wrapped[name] = self._enqueuer(name, callback)
+        return ExecutionCallbacks(**wrapped)
+
+    def _enqueuer(self, name: str, callback: Callable) -> Callable:
+        if name == "on_preview":
+            return lambda *args: self._put(callback, args, droppable=True)
+        if name == "on_progress":
+            return lambda *args: self._put(callback, args, key="on_progress")
+        if name == "on_ws_message":
+
+            def on_ws_message(message_type, data):
+                if message_type == "progress":
+                    self._put(callback, (message_type, data), key="on_ws_message")
+                else:
+                    self._put(callback, (message_type, data), droppable=True)
+
+            return on_ws_message
+        return lambda *args: self._put(callback, args)
+
+    def _put(
+        self,
+        callback: Callable,
+        args: tuple,
+        key: Optional[str] = None,
+        droppable: bool = False,
+    ) -> None:
+        if self._closed:
+            return
+        if len(self._events) >= self.max_size:
+            if droppable or (key is not None and self.overflow == "drop"):
+                self.dropped += 1
+                return
+            pending = self._pending_progress.get(key) if key is not None else None
+            if pending is not None:
+                pending.args = args
+                self.coalesced += 1
+                return
+
+        event = _Event(callback, args, key)
+        self._events.append(event)
+        if key is not None:
+            self._pending_progress[key] = event
+        self._wakeup.set()
+
+    async def _consume(self) -> None:
+        while True:
+            while not self._events:
+                if self._closed:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            event = self._events.popleft()
+            if event.key is not None and self._pending_progress.get(event.key) is event:
+                del self._pending_progress[event.key]
+            try:
+                await invoke(event.callback, *event.args)
+            except Exception as e:
+                logger.error(f"Error in execution callback: {e}")
+
+    async def close(self, timeout: Optional[float] = None, drain: bool = True) -> None:
+        """
+        Stop accepting events and wait for the queued ones to be delivered.
+
+        Args:
+            timeout: Seconds to wait for the queue to drain before giving up
+            drain: Deliver the queued events, or discard them right away
+        """
+        self._closed = True
+        self._wakeup.set()
+        if not drain:
+            self._events.clear()
+            self._task.cancel()
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            logger.error(
+                f"Dropped {len(self._events)} callback events after {timeout}s"
+            )
+            self._task.cancel()
+        if self.dropped or self.coalesced:
+            logger.info(
+                f"Callback consumer fell behind: dropped {self.dropped} and "
+                f"coalesced {self.coalesced} events"
+            )
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from lib.exceptions import ComfyAPIError
+from .config import ComfyConfig
+
+logger = logging.getLogger(__name__)
+
+# Status codes that are worth retrying on requests that are safe to repeat
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+
+class ComfyClient:
+    """Async client for the ComfyUI HTTP API.
+
+    All requests go through one pooled aiohttp session so connections to the
+    ComfyUI server are kept alive between jobs and the event loop never blocks.
+    Idempotent requests are retried on connection errors and gateway errors,
+    requests with side effects are only retried when the connection could not
+    be established at all.
+    """
+
+    def __init__(self, config: ComfyConfig):
+        self.config = config
+        self.base_url = f"http://{config.SERVER_HOST}:{config.SERVER_PORT}"
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The shared aiohttp session, created on first use inside the event loop."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.config.HTTP_POOL_SIZE,
+                    keepalive_timeout=self.config.HTTP_KEEPALIVE_TIMEOUT,
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    total=self.config.HTTP_TIMEOUT,
+                    connect=self.config.HTTP_CONNECT_TIMEOUT,
+                ),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        idempotent: bool = True,
+        raw: bool = False,
+        max_retries: Optional[int] = None,
+        **kwargs,
+    ) -> Any:
+        """Send a request, retrying according to the configured policy.
+
+        Args:
+            method: HTTP method
+            path: Path on the ComfyUI server
+            idempotent: Whether the request can safely be sent more than once
+            raw: Return the response body as bytes instead of decoding JSON
+            max_retries: Overrides the configured number of retries
+            **kwargs: Passed through to aiohttp
+
+        Raises:
+            ComfyAPIError: If ComfyUI responds with an error status
+            aiohttp.ClientError: If the request fails after all retries
+        """
+        if max_retries is None:
+            max_retries = self.config.HTTP_MAX_RETRIES
+        attempt = 0
+        while True:
+            try:
+                async with self.session.request(
+                    method, f"{self.base_url}{path}", **kwargs
+                ) as response:
+                    if response.status >= 400:
+                        body = await response.text()
+                        if (
+                            idempotent
+                            and response.status in RETRYABLE_STATUS_CODES
+                            and attempt < max_retries
+                        ):
+                            raise _RetryableStatus(response.status)
+                        raise ComfyAPIError(
+                            f"{method} {path} failed with status {response.status}",
+                            status=response.status,
+                            body=body,
+                        )
+                    if raw:
+                        return await response.read()
+                    if response.content_type == "application/json":
+                        return await response.json()
+                    return await response.text()
+            except (
+                aiohttp.ClientConnectorError,
+                aiohttp.ClientOSError,
+                aiohttp.ServerDisconnectedError,
+                asyncio.TimeoutError,
+                _RetryableStatus,
+            ) as e:
+                connection_failed = isinstance(e, aiohttp.ClientConnectorError)
+                if attempt >= max_retries or not (idempotent or connection_failed):
+                    raise
+                delay = self.config.HTTP_RETRY_BACKOFF * (2**attempt)
+                logger.warning(
+                    f"{method} {path} failed ({e!r}), retrying in {delay:.2f}s"
+                )
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def queue_prompt(self, data: Dict) -> Dict:
+        """POST /prompt. Returns the response containing the prompt_id.
+
+        Raises:
+            ValueError: If ComfyUI rejects the prompt
+        """
+        try:
+            return await self._request("POST", "/prompt", idempotent=False, json=data)
+        except ComfyAPIError as e:
+            if e.status == 400:
+                error_data = json.loads(e.body or "{}")
+                raise ValueError(
+                    f"Comfy error: {error_data.get('error', 'Unknown error')}, Node errors: {error_data.get('node_errors', {})}"
+                )
+            raise
+
+    async def interrupt(self, prompt_id: Optional[str] = None) -> None:
+        """POST /interrupt. Newer ComfyUI versions only interrupt the given prompt."""
+        data = {"prompt_id": prompt_id} if prompt_id else {}
+        await self._request("POST", "/interrupt", json=data)
+
+    async def get_queue(self) -> Dict:
+        """GET /queue. Returns the running and pending prompts."""
+        return await self._request("GET", "/queue")
+
+    async def delete_from_queue(self, prompt_ids: List[str]) -> None:
+        """POST /queue with a delete request for pending prompts."""
+        await self._request("POST", "/queue", json={"delete": prompt_ids})
+
+    async def clear_queue(self) -> None:
+        """POST /queue with a clear request for all pending prompts."""
+        await self._request("POST", "/queue", json={"clear": True})
+
+    async def get_history(
+        self, prompt_id: Optional[str] = None, max_items: Optional[int] = None
+    ) -> Dict:
+        """GET /history or /history/{prompt_id}."""
+        path = f"/history/{prompt_id}" if prompt_id else "/history"
+        params = {"max_items": max_items} if max_items else None
+        return await self._request("GET", path, params=params)
+
+    async def view(
+        self, filename: str, subfolder: str = "", folder_type: str = "output"
+    ) -> bytes:
+        """GET /view. Returns the raw bytes of an output, input or temp file."""
+        return await self._request(
+            "GET",
+            "/view",
+            raw=True,
+            params={"filename": filename, "subfolder": subfolder, "type": folder_type},
+        )
+
+    async def upload_image(
+        self,
+        image: bytes,
+        filename: str,
+        subfolder: str = "",
+        folder_type: str = "input",
+        overwrite: bool = False,
+    ) -> Dict:
+        """POST /upload/image. Returns the name and subfolder ComfyUI stored it as."""
+        form = aiohttp.FormData()
+        form.add_field("image", image, filename=filename)
+        form.add_field("subfolder", subfolder)
+        form.add_field("type", folder_type)
+        form.add_field("overwrite", "true" if overwrite else "false")
+        # Form data can only be sent once, so uploads are never retried
+        return await self._request(
+            "POST", "/upload/image", idempotent=False, max_retries=0, data=form
+        )
+
+    async def get_object_info(self, node_class: Optional[str] = None) -> Dict:
+        """GET /object_info or /object_info/{node_class}."""
+        path = f"/object_info/{node_class}" if node_class else "/object_info"
+        return await self._request("GET", path)
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"status {status}")
+        self.status = status
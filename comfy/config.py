@@ -1,4 +1,145 @@
-from pydantic import BaseModel
+from enum import Enum
+from typing import Dict, List, Literal, Optional, Union
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+
+class VramMode(str, Enum):
+    """How ComfyUI keeps models in VRAM, from most to least resident."""
+
+    GPU_ONLY = "gpu-only"
+    HIGH = "highvram"
+    NORMAL = "normalvram"
+    LOW = "lowvram"
+    NONE = "novram"
+    CPU = "cpu"
+
+
+class CacheMode(str, Enum):
+    """How ComfyUI caches node outputs between prompts."""
+
+    CLASSIC = "classic"
+    LRU = "lru"
+    NONE = "none"
+
+
+class PreviewMethod(str, Enum):
+    NONE = "none"
+    AUTO = "auto"
+    LATENT2RGB = "latent2rgb"
+    TAESD = "taesd"
+
+
+class AttentionBackend(str, Enum):
+    PYTORCH = "pytorch"
+    SPLIT = "split"
+    QUAD = "quad"
+    SAGE = "sage"
+    FLASH = "flash"
+
+
+ATTENTION_FLAGS = {
+    AttentionBackend.PYTORCH: "--use-pytorch-cross-attention",
+    AttentionBackend.SPLIT: "--use-split-cross-attention",
+    AttentionBackend.QUAD: "--use-quad-cross-attention",
+    AttentionBackend.SAGE: "--use-sage-attention",
+    AttentionBackend.FLASH: "--use-flash-attention",
+}
+
+
+class ComfyPerformanceProfile(BaseModel):
+    """Performance flags and environment of the ComfyUI process.
+
+    Unset fields leave ComfyUI's own defaults in place, so an empty profile starts
+    ComfyUI exactly like `python main.py`.
+    """
+
+    vram_mode: Optional[VramMode] = None
+    # GB of VRAM left free for other software, e.g. custom nodes allocating outside ComfyUI
+    reserve_vram: Optional[float] = Field(default=None, ge=0)
+    cache_mode: Optional[CacheMode] = None
+    # Node results kept by the LRU cache
+    cache_size: Optional[int] = Field(default=None, ge=1)
+    preview_method: Optional[PreviewMethod] = None
+    # True enables every untested optimization, a list only the named ones
+    fast: Union[bool, List[str]] = False
+    attention: Optional[AttentionBackend] = None
+    disable_smart_memory: bool = False
+    # Any other ComfyUI arguments, appended as is
+    extra_args: List[str] = []
+    # Set on the ComfyUI process, e.g. OMP_NUM_THREADS or PYTORCH_CUDA_ALLOC_CONF
+    env: Dict[str, str] = {}
+
+    @model_validator(mode="after")
+    def check_cache_size(self) -> "ComfyPerformanceProfile":
+        if self.cache_mode == CacheMode.LRU and self.cache_size is None:
+            raise ValueError("cache_size is required with the lru cache mode")
+        if self.cache_size is not None and self.cache_mode != CacheMode.LRU:
+            raise ValueError("cache_size only applies to the lru cache mode")
+        return self
+
+    def to_args(self) -> List[str]:
+        """ComfyUI command line arguments of the profile."""
+        args = []
+        if self.vram_mode is not None:
+            args.append(f"--{self.vram_mode.value}")
+        if self.reserve_vram is not None:
+            args.extend(["--reserve-vram", str(self.reserve_vram)])
+        if self.cache_mode == CacheMode.LRU:
+            args.extend(["--cache-lru", str(self.cache_size)])
+        elif self.cache_mode is not None:
+            args.append(f"--cache-{self.cache_mode.value}")
+        if self.preview_method is not None:
+            args.extend(["--preview-method", self.preview_method.value])
+        if self.fast is True:
+            args.append("--fast")
+        elif self.fast:
+            args.extend(["--fast", *self.fast])
+        if self.attention is not None:
+            args.append(ATTENTION_FLAGS[self.attention])
+        if self.disable_smart_memory:
+            args.append("--disable-smart-memory")
+        return args + self.extra_args
+
+    @classmethod
+    def preset(cls, name: str) -> "ComfyPerformanceProfile":
+        """Return a copy of a named preset from PERFORMANCE_PRESETS."""
+        if name not in PERFORMANCE_PRESETS:
+            raise ValueError(
+                f"Unknown performance preset {name}, "
+                f"expected one of {', '.join(PERFORMANCE_PRESETS)}"
+            )
+        return PERFORMANCE_PRESETS[name].model_copy(deep=True)
+
+
+PERFORMANCE_PRESETS: Dict[str, ComfyPerformanceProfile] = {
+    # ComfyUI's own defaults
+    "default": ComfyPerformanceProfile(),
+    # Many requests of the same workflows: keep models resident, keep intermediate
+    # results of recent prompts and skip previews nobody watches
+    "throughput": ComfyPerformanceProfile(
+        vram_mode=VramMode.HIGH,
+        cache_mode=CacheMode.LRU,
+        cache_size=64,
+        preview_method=PreviewMethod.NONE,
+        fast=True,
+        attention=AttentionBackend.PYTORCH,
+        env={"PYTORCH_CUDA_ALLOC_CONF": "expandable_segments:True"},
+    ),
+    # Shortest time per request: everything stays on the GPU and previews are off,
+    # ComfyUI's classic cache keeps the outputs of the last prompt
+    "low_latency": ComfyPerformanceProfile(
+        vram_mode=VramMode.GPU_ONLY,
+        preview_method=PreviewMethod.NONE,
+        fast=True,
+        attention=AttentionBackend.PYTORCH,
+        env={"PYTORCH_CUDA_ALLOC_CONF": "expandable_segments:True"},
+    ),
+    # Progress previews for UIs, models are offloaded under memory pressure
+    "interactive": ComfyPerformanceProfile(
+        vram_mode=VramMode.NORMAL,
+        preview_method=PreviewMethod.LATENT2RGB,
+    ),
+}
 
 
 class ComfyConfig(BaseModel):
@@ -9,11 +150,120 @@ class ComfyConfig(BaseModel):
     SERVER_PORT: int = 8188
     SERVER_HOST: str = "127.0.0.1"
     SERVER_TIMEOUT: int = 120
-    SERVER_CHECK_DELAY: float = 2.0
+    # Readiness polling backs off from the min delay up to SERVER_CHECK_DELAY
+    SERVER_CHECK_DELAY: float = 0.5
+    SERVER_CHECK_MIN_DELAY: float = 0.005
+
+    # HTTP client settings for the ComfyUI API
+    HTTP_TIMEOUT: float = 30.0
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP_MAX_RETRIES: int = 2
+    HTTP_RETRY_BACKOFF: float = 0.1
+    HTTP_POOL_SIZE: int = 32
+    HTTP_KEEPALIVE_TIMEOUT: float = 60.0
+
+    # Default execution timeout in seconds, None means executions are unbounded
+    EXECUTION_TIMEOUT: Optional[float] = None
+    # Seconds to wait for ComfyUI to stop an interrupted prompt
+    CANCEL_GRACE_PERIOD: float = 10.0
+
+    # on_progress is called at most once per interval, when the percentage moved by
+    # at least the delta, plus once at the start and once at the end of a job
+    PROGRESS_MIN_INTERVAL: float = 0.5
+    PROGRESS_MIN_DELTA: float = 1.0
 
+    # Events a slow callback consumer may fall behind before previews and websocket
+    # messages are dropped and progress is coalesced ("coalesce") or dropped
+    # ("drop"). Start, output, error and done events are always queued, a job has
+    # a fixed number of them
+    CALLBACK_QUEUE_SIZE: int = 256
+    CALLBACK_OVERFLOW: Literal["coalesce", "drop"] = "coalesce"
+    # Seconds to wait for the callbacks of a finished execution
+    CALLBACK_DRAIN_TIMEOUT: float = 30.0
+
+    # Executions of the same workflow that arrive within BATCH_MAX_WAIT_MS run as
+    # one prompt of up to BATCH_MAX_SIZE of them, see comfy/batching.py. 1 turns
+    # batching off
+    BATCH_MAX_SIZE: int = 4
+    BATCH_MAX_WAIT_MS: int = 20
+
+    # Result cache for deterministic prompts, the disk tier is off without a dir
+    RESULT_CACHE_MEMORY_BYTES: int = 256 * 1024 * 1024
+    RESULT_CACHE_DISK_BYTES: int = 10 * 1024 * 1024 * 1024
+    RESULT_CACHE_TTL: Optional[float] = 24 * 60 * 60
+    RESULT_CACHE_DIR: Optional[str] = None
+
+    # Input files of requests, written to ComfyUI's input folder ("filesystem") or
+    # uploaded through /upload/image ("http") when ComfyUI runs elsewhere.
+    # Images larger than INPUT_MAX_SIDE pixels are downscaled, None keeps them as is
+    INPUT_UPLOAD: Literal["filesystem", "http"] = "filesystem"
+    INPUT_WORKERS: int = 4
+    INPUT_MAX_BYTES: int = 50 * 1024 * 1024
+    INPUT_MAX_SIDE: Optional[int] = None
+    INPUT_DOWNLOAD_TIMEOUT: float = 60.0
+    # URLs are fetched over http(s) from public addresses only, so a request can't
+    # reach the metadata service or other hosts of the private network. True
+    # lifts the address check, e.g. for images served inside a VPC
+    INPUT_ALLOW_PRIVATE_URLS: bool = False
+    # Directory of the files media inputs may name by path, e.g. uploads staged by
+    # the gateway on a shared volume. Path inputs are rejected without it
+    INPUT_STAGING_DIR: Optional[str] = None
+
+    # Host memory cache of the state dicts of the experimental server. Without
+    # MODEL_CACHE_BYTES the budget is a share of the container's memory limit. It
+    # only bounds the models loaded with MODEL_LOAD_MODE="read": mapped models live
+    # in the page cache, are reported as mapped_bytes and are never evicted
+    MODEL_CACHE_BYTES: Optional[int] = None
+    MODEL_CACHE_MEMORY_SHARE: float = 0.5
+    MODEL_CACHE_POLICY: Literal["lru", "lfu"] = "lru"
+    # How models are loaded to the CPU, see comfy/model_loading.py. "mmap" shares
+    # the pages with the page cache, "read" keeps the weights in a memory snapshot
+    MODEL_LOAD_MODE: Literal["mmap", "read"] = "mmap"
+    # Models preloaded at once, and whether mapped models are read through the page
+    # cache while preloading instead of on first use
+    PRELOAD_CONCURRENCY: int = 4
+    PRELOAD_WARM_PAGE_CACHE: bool = True
+    # Prompt structures the in-process server remembers as validated, so prompts of
+    # the same template only revalidate the nodes whose inputs changed. 0 disables
+    VALIDATION_CACHE_SIZE: int = 64
+
+    # ComfyUI performance flags, a ComfyPerformanceProfile or the name of a preset
+    PERFORMANCE_PROFILE: ComfyPerformanceProfile = Field(
+        default_factory=ComfyPerformanceProfile
+    )
+
+    # Shorthands for PERFORMANCE_PROFILE.vram_mode, kept for existing configs
     GPU_ONLY: bool = False
     HIGH_VRAM: bool = False
     CPU_ONLY: bool = False
 
+    @field_validator("PERFORMANCE_PROFILE", mode="before")
+    @classmethod
+    def resolve_preset(cls, value):
+        if isinstance(value, str):
+            return ComfyPerformanceProfile.preset(value)
+        return value
+
+    @model_validator(mode="after")
+    def apply_vram_flags(self) -> "ComfyConfig":
+        flags = {
+            "GPU_ONLY": (self.GPU_ONLY, VramMode.GPU_ONLY),
+            "HIGH_VRAM": (self.HIGH_VRAM, VramMode.HIGH),
+            "CPU_ONLY": (self.CPU_ONLY, VramMode.CPU),
+        }
+        enabled = [name for name, (value, _) in flags.items() if value]
+        if len(enabled) > 1:
+            raise ValueError("GPU_ONLY, HIGH_VRAM and CPU_ONLY are mutually exclusive")
+        if enabled:
+            mode = flags[enabled[0]][1]
+            profile = self.PERFORMANCE_PROFILE
+            if profile.vram_mode not in (None, mode):
+                raise ValueError(
+                    f"{enabled[0]} conflicts with the {profile.vram_mode.value} "
+                    "vram mode of the performance profile"
+                )
+            self.PERFORMANCE_PROFILE = profile.model_copy(update={"vram_mode": mode})
+        return self
+
     class Config:
         env_prefix = "COMFY_"
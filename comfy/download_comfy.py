@@ -122,8 +122,8 @@ def download_comfy(snapshot_path: str):
         json_data = file.read()
 
     data = json.loads(json_data)
-    config = ComfyConfig()
-    config.CPU_ONLY = True
+    # Set at construction, the flag is mapped to the performance profile then
+    config = ComfyConfig(CPU_ONLY=True)
 
     comfyui_repo_url = config.COMFYUI_REPO
     comfyui_path = config.COMFYUI_PATH
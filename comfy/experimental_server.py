@@ -1,19 +1,33 @@
 """
 This module is a modified version of the ComfyUI server.
-It executes comfy workflows in the main thread by overriding some parts of Comfy
-and using a global executor. This is experimental and may not work for all workflows.
+It executes comfy workflows in-process by overriding some parts of Comfy and using a
+global executor. This is experimental and may not work for all workflows.
 
 It allows:
 - Loading models to the CPU and leverage modal's snapshotting feature to reduce cold start times.
-- Running workflows in the main thread without initializing the comfyui server routes and queue.
+- Running workflows in-process without initializing the comfyui server routes and queue.
+
+Workflows run one at a time on a dedicated executor thread, fed by a job queue, like
+the prompt worker of ComfyUI. The event loop stays free while a workflow runs, so
+concurrent inputs are queued and their pre- and post-processing overlaps with the
+execution of other jobs.
 
 Limitations:
-- Since we don't initialize the comfyui server routes and queue, we don't have access to the UI or the queue.
-So make sure you set allow_concurrent_inputs to 1 in your modal app.
+- Since we don't initialize the comfyui server routes and queue, we don't have access to the UI.
 """
 
+import queue
+import threading
 import time
-from .models import ExecutionData, ExecutionCallbacks
+from .callback_dispatcher import CallbackDispatcher
+from .config import ComfyConfig
+from .job_progress import ComfyJobProgress, ComfyStatusLog, ProgressEmitter
+from .model_cache import ModelCache, memory_limit_bytes
+from .model_loading import load_state_dict
+from .models import ExecutionData, ExecutionCallbacks, PreloadReport
+from .preload import PreloadScheduler
+from .validation_cache import PromptValidationCache, partial_validator
+from ..lib.exceptions import ExecutionError
 from ..lib.utils import check_disk_speed
 from typing import Dict, List, Optional, Callable
 import os
@@ -23,7 +37,9 @@ from ..lib.logger import logger
 
 class DummyServer:
     """
-    Overrides the ComfyUI server to be able to run in the main thread.
+    Overrides the ComfyUI server so its PromptExecutor can run without the server
+    routes and queue. Messages of the executor are passed to `on_send_sync`, which
+    is called on the executor thread.
     """
 
     def __new__(cls):
@@ -87,7 +103,12 @@ class CustomPromptExecutor:
 
 
 class ExperimentalComfyServer:
-    """Experimental ComfyUI server that runs workflows in the main thread.
+    """Experimental ComfyUI server that runs workflows in-process.
+
+    Executions are put on a job queue and run one at a time by a dedicated executor
+    thread, the caller awaits the result on its event loop. Messages of the running
+    job are posted back to the loop of its caller. Cancelling drops a queued job or
+    interrupts the running one.
 
     Features:
     - Executes workflows without starting separate server process
@@ -127,19 +148,35 @@ class ExperimentalComfyServer:
             torch.cuda.is_available = original_is_available
             torch.cuda.current_device = original_current_device
 
-    def __init__(self, config=None, preload_models: List[str] = []):
+    def __init__(self, config=None, preload_models: List[str] = [], executor=None):
         """Initialize experimental server.
 
         Args:
-            config: Compatibility with regular server (not used)
+            config: Optional ComfyConfig for the model cache, the preload, progress
+                and callback settings
             preload_models: List of model paths to preload to CPU
+            executor: Optional PromptExecutor to run workflows with. If None,
+                ComfyUI and its custom nodes are loaded to create one
         """
         with self.force_cpu_during_snapshot():
             logger.info("Initializing experimental server")
+            self.config = config if config is not None else ComfyConfig()
             self.preload_models = preload_models
             self.initialized = False
-            self.model_cache = {}
-            self.executor = None
+            self.model_cache = self._create_model_cache()
+            self.preload_report: Optional[PreloadReport] = None
+            self.validation_cache = PromptValidationCache(
+                self.config.VALIDATION_CACHE_SIZE
+            )
+            self.executor = executor
+            # Jobs waiting for the executor thread, None stops it
+            self._jobs: "queue.Queue[Optional[_Job]]" = queue.Queue()
+            self._worker: Optional[threading.Thread] = None
+            self._running_job: Optional[_Job] = None
+            # Guards the cancelled flag of jobs against the running job changing
+            self._jobs_lock = threading.Lock()
+            if executor is not None:
+                return
 
             # Set up ComfyUI environment overrides
             self._override_comfy(preload_models)
@@ -149,6 +186,20 @@ class ExperimentalComfyServer:
                 f"Disk speeds - Read: {read_speed:.2f} MB/s, Write: {write_speed:.2f} MB/s"
             )
 
+    def _create_model_cache(self) -> ModelCache:
+        max_bytes = self.config.MODEL_CACHE_BYTES
+        if max_bytes is None:
+            max_bytes = int(memory_limit_bytes() * self.config.MODEL_CACHE_MEMORY_SHARE)
+        logger.info(
+            f"Model cache budget: {max_bytes / 1024**3:.2f} GB "
+            f"({self.config.MODEL_CACHE_POLICY})"
+        )
+        return ModelCache(max_bytes, self.config.MODEL_CACHE_POLICY)
+
+    def model_cache_stats(self) -> Dict:
+        """Hits, misses, evictions and resident bytes of the model cache"""
+        return self.model_cache.stats()
+
     def start(self):
         """Compatibility method - initialization happens in constructor"""
         pass
@@ -168,13 +219,27 @@ class ExperimentalComfyServer:
 
             self.initialized = True
 
+    @property
+    def pending_jobs(self) -> int:
+        """Jobs queued behind the running one"""
+        return self._jobs.qsize()
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(
+                target=self._run_jobs, name="comfy-executor", daemon=True
+            )
+            self._worker.start()
+
     async def execute(
         self, data: ExecutionData, callbacks: ExecutionCallbacks = ExecutionCallbacks()
     ):
-        import execution
-        import torch
+        """Queue a workflow on the executor thread and wait for its result.
 
-        """Execute a workflow directly in the main thread.
+        Messages of the execution are handed to the event loop of the caller and
+        the callbacks run there, behind a CallbackDispatcher. Cancelling the call
+        drops a queued job, or interrupts a running one through ComfyUI's
+        interrupt flag.
 
         Args:
             data: Execution data containing prompt and process ID
@@ -184,77 +249,204 @@ class ExperimentalComfyServer:
             Execution result dictionary
 
         Raises:
-            Exception: If execution fails
+            ExecutionError: If the prompt is invalid or the execution fails
         """
         # Initialize GPU components if needed
         self.model_load_override_with_gpu()
+        self._ensure_worker()
+
+        loop = asyncio.get_running_loop()
+        dispatcher = CallbackDispatcher(
+            callbacks, self.config.CALLBACK_QUEUE_SIZE, self.config.CALLBACK_OVERFLOW
+        )
+        wrapped = dispatcher.callbacks
+        comfy_job = ComfyJobProgress(data.prompt)
+        progress = ProgressEmitter(
+            wrapped.on_progress,
+            data.progress_interval
+            if data.progress_interval is not None
+            else self.config.PROGRESS_MIN_INTERVAL,
+            data.progress_min_delta
+            if data.progress_min_delta is not None
+            else self.config.PROGRESS_MIN_DELTA,
+        )
+
+        def on_message(event_type: str, msg: dict):
+            # Runs on the event loop, see _Job.post
+            if event_type == "execution_error":
+                wrapped.on_error and wrapped.on_error(msg)
+                return
+            if event_type == "execution_success":
+                wrapped.on_done and wrapped.on_done(msg)
+                return
+            if event_type not in self.MSG_TYPES_TO_PROCESS:
+                return
+            if wrapped.on_ws_message:
+                wrapped.on_ws_message(event_type, msg)
+            if event_type == "execution_start" and wrapped.on_start:
+                wrapped.on_start({"process_id": data.process_id})
+            comfy_job.add_status_log(
+                ComfyStatusLog(msg.get("prompt_id")).from_comfy_message(msg)
+            )
+            if event_type == "executing" and msg.get("node") is None:
+                comfy_job.finish()
+            if event_type in ("progress", "executing"):
+                progress.update(comfy_job)
 
-        result_future = asyncio.Future()
-        result_data = {"process_id": data.process_id}
-
+        job = _Job(data, loop, on_message)
+        self._jobs.put(job)
         try:
-            # Set up execution callbacks
-            def on_error(error_data: Dict):
-                callbacks.on_error and callbacks.on_error(error_data)
-                result_future.set_exception(Exception(str(error_data)))
-
-            def on_done(msg: Dict):
-                callbacks.on_done and callbacks.on_done(msg)
-                result_future.set_result(result_data)
-
-            def on_ws_message(event_type: str, msg: dict, sid=None):
-                if event_type in self.MSG_TYPES_TO_PROCESS and callbacks.on_ws_message:
-                    callbacks.on_ws_message(event_type, msg)
-
-            # Configure executor callbacks
-            self.executor.on_error = on_error
-            self.executor.on_done = on_done
-            self.executor.server.on_send_sync = on_ws_message
-
-            start_time = time.time()
-            is_valid, error, outputs_to_execute, node_errors = (
-                execution.validate_prompt(
-                    data.prompt,
-                )
+            return await job.future
+        except asyncio.CancelledError:
+            self._cancel(job)
+            raise
+        finally:
+            progress.close()
+            await dispatcher.close(
+                self.config.CALLBACK_DRAIN_TIMEOUT, drain=not job.cancelled
             )
-            validate_time = time.time() - start_time
-            logger.info(f"Validation took {validate_time:.2f} seconds")
 
-            if not is_valid:
-                raise Exception(error)
+    def _cancel(self, job: "_Job") -> None:
+        with self._jobs_lock:
+            job.cancelled = True
+            running = self._running_job is job
+        if running:
+            import nodes
+
+            # The executor checks the flag between nodes and sampler steps. It is
+            # reset when the prompt starts, _send_sync sets it again then
+            nodes.interrupt_processing(True)
+            logger.info(f"Interrupted prompt {job.data.process_id}")
+        else:
+            logger.info(f"Removed prompt {job.data.process_id} from the queue")
+
+    async def close(self) -> None:
+        """Stop the executor thread once the queued jobs are done"""
+        if self._worker is not None and self._worker.is_alive():
+            self._jobs.put(None)
+            await asyncio.to_thread(self._worker.join)
+
+    def _run_jobs(self) -> None:
+        """Loop of the executor thread"""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            # A job is either dropped here or seen as running by _cancel
+            with self._jobs_lock:
+                if job.cancelled:
+                    continue
+                self._running_job = job
+            try:
+                job.resolve(self._execute_job(job))
+            except Exception as e:
+                job.fail(e)
+            finally:
+                with self._jobs_lock:
+                    self._running_job = None
 
-            # Execute workflow with CUDA optimizations
-            with (
-                torch.inference_mode(),
-                torch.autocast(device_type="cuda", enabled=False),
-            ):
-                self.executor.execute(
-                    prompt=data.prompt,
-                    prompt_id=data.process_id,
-                    extra_data={"client_id": data.process_id},
-                    execute_outputs=outputs_to_execute,
-                )
+    def _execute_job(self, job: "_Job") -> Dict:
+        import execution
+        import torch
 
-            return await result_future
+        data = job.data
+        self.executor.server.on_send_sync = lambda event_type, msg, sid=None: (
+            self._send_sync(job, event_type, msg)
+        )
 
-        except Exception as e:
-            result_future.set_exception(e)
-            raise
+        start_time = time.time()
+        hits = self.validation_cache.hits
+        is_valid, error, outputs_to_execute, node_errors = (
+            self.validation_cache.validate(
+                data.prompt, execution.validate_prompt, partial_validator(execution)
+            )
+        )
+        validate_time = time.time() - start_time
+        cached = " (cached structure)" if self.validation_cache.hits > hits else ""
+        logger.info(f"Validation took {validate_time:.2f} seconds{cached}")
+
+        if not is_valid:
+            raise ExecutionError(str(error), {"node_errors": node_errors})
+        if job.cancelled:
+            # Cancelled while validating, the interrupt flag would be reset by
+            # execute() before any node checks it
+            raise ExecutionError("Execution was interrupted")
+
+        # Execute workflow with CUDA optimizations. Inference mode is per thread,
+        # so it is entered on the executor thread
+        with (
+            torch.inference_mode(),
+            torch.autocast(device_type="cuda", enabled=False),
+        ):
+            self.executor.execute(
+                prompt=data.prompt,
+                prompt_id=data.process_id,
+                extra_data={"client_id": data.process_id},
+                execute_outputs=outputs_to_execute,
+            )
+
+        if job.cancelled:
+            raise ExecutionError("Execution was interrupted")
+        if not getattr(self.executor, "success", True):
+            raise ExecutionError(self._last_error_message())
+        return {"process_id": data.process_id}
+
+    def _send_sync(self, job: "_Job", event_type: str, msg: dict) -> None:
+        """Messages of the executor, on the executor thread."""
+        if event_type == "execution_start" and job.cancelled:
+            import nodes
+
+            # execute() clears the interrupt flag right before this message, a
+            # cancel that came in between must set it again
+            nodes.interrupt_processing(True)
+        job.post(event_type, msg)
+
+    def _last_error_message(self) -> str:
+        for event_type, msg in reversed(getattr(self.executor, "status_messages", [])):
+            if event_type == "execution_error":
+                return msg.get("exception_message", "Unknown execution error")
+        return "Unknown execution error"
 
     def _patch_model_loading(self, comfy_utils):
         """Override ComfyUI's model loading to use CPU cache"""
         original_load = comfy_utils.load_torch_file
 
-        def cached_load(path, *args, **kwargs):
-            filename = os.path.basename(path)
-            for model_key, state_dict in self.model_cache.items():
-                if filename in str(model_key):
-                    logger.info(f"Using cached model {model_key}")
-                    return state_dict
-            return original_load(path, *args, **kwargs)
+        def cached_load(path, safe_load=False, device=None, **kwargs):
+            # Only plain loads to the CPU are cached, like the preloaded models
+            if kwargs.get("return_metadata") or (
+                device is not None and str(device) != "cpu"
+            ):
+                return original_load(path, safe_load=safe_load, device=device, **kwargs)
+            state_dict = self.model_cache.get(path)
+            if state_dict is not None:
+                logger.info(f"Using cached model {path}")
+            else:
+                state_dict = self._load_state_dict(path)
+                if state_dict is None:
+                    return original_load(
+                        path, safe_load=safe_load, device=device, **kwargs
+                    )
+            # ComfyUI renames and pops keys of the dicts it loads, the tensors are
+            # shared but the cached dict must stay intact
+            return dict(state_dict)
 
         comfy_utils.load_torch_file = cached_load
 
+    def _load_state_dict(self, path: str) -> Optional[Dict]:
+        """Load a model to the CPU and cache it, None if ComfyUI has to load it"""
+        mode = self.config.MODEL_LOAD_MODE
+        if mode == "read" and os.path.getsize(path) > self.model_cache.free_bytes():
+            # Reading would evict models for one that can't be kept, or exceed
+            # the memory limit while ComfyUI's own loader streams it
+            return None
+        try:
+            state_dict = load_state_dict(path, mode)
+        except Exception as e:
+            logger.warning(f"Falling back to ComfyUI's loader for {path}: {e}")
+            return None
+        self.model_cache.put(path, state_dict, mapped=mode == "mmap")
+        return state_dict
+
     def _override_comfy(self, preload_models: List[str] = []):
         import sys
 
@@ -263,6 +455,9 @@ class ExperimentalComfyServer:
 
         sys.path.append("/root/ComfyUI")
 
+        # Models are read on a thread pool while ComfyUI and custom nodes import
+        preload = self._preload_models_to_cpu(preload_models)
+
         import nodes
 
         # Initialize executor and components
@@ -272,8 +467,8 @@ class ExperimentalComfyServer:
         init_time = time.time() * 1000 - start_time
         logger.info(f"Node initialization took {init_time:.2f} ms")
 
-        # Initialize custom nodes
-        self._preload_models_to_cpu(preload_models)
+        self.preload_report = preload.wait()
+        logger.info(f"Preloaded models to CPU memory: {self.model_cache.stats()}")
 
     def _setup_folder_paths(self):
         """
@@ -283,35 +478,91 @@ class ExperimentalComfyServer:
 
         pass
 
-    def _preload_models_to_cpu(self, model_paths: List[str] = []):
-        """Preload models into CPU memory with disk speed monitoring"""
-        import safetensors.torch
-        import time
+    def _preload_models_to_cpu(self, model_paths: List[str] = []) -> PreloadScheduler:
+        """Start preloading models into CPU memory, wait() on the result for the report
 
-        logger.info("Preloading models to CPU memory...")
+        Up to PRELOAD_CONCURRENCY files are loaded at once. With the "mmap"
+        MODEL_LOAD_MODE the files are mapped, and read through the page cache when
+        PRELOAD_WARM_PAGE_CACHE is set, so their pages are shared with it. With
+        "read" every file is read once into its own buffer, as long as it fits in
+        the model cache.
+        """
+        mode = self.config.MODEL_LOAD_MODE
+        logger.info(f"Preloading models to CPU memory ({mode})...")
+
+        full_paths = []
+        # The tensors take about the size of the file, skip the models that would
+        # evict other preloaded ones instead of loading them for nothing
+        free_bytes = self.model_cache.free_bytes()
         for model_path in model_paths:
             full_path = os.path.join("/volume/", model_path)
-            logger.info(f"Loading {model_path} into CPU memory...")
-
-            start_time = time.time()
             try:
-                # Load state dict to CPU
-                if model_path.endswith(".safetensors"):
-                    state_dict = safetensors.torch.load_file(full_path, device="cpu")
-
-                load_time = time.time() - start_time
-                file_size = os.path.getsize(full_path) / (
-                    1024 * 1024 * 1024
-                )  # Size in GB
-                loading_speed = file_size / load_time
-
-                logger.info(
-                    f"Model loaded in {load_time:.2f}s ({loading_speed:.2f} GB/s)"
-                )
-                self.model_cache[model_path.split("/")[-1]] = state_dict
-                logger.info(f"Successfully cached {model_path} in CPU memory")
-
-            except Exception as e:
+                size = os.path.getsize(full_path)
+            except OSError as e:
                 logger.error(f"Failed to load {model_path}: {str(e)}")
+                continue
+            if mode == "read":
+                if size > free_bytes:
+                    logger.warning(
+                        f"Skipping {model_path}: {size / 1024**3:.2f} GB don't fit in "
+                        f"the {free_bytes / 1024**3:.2f} GB left in the model cache"
+                    )
+                    continue
+                free_bytes -= size
+            full_paths.append(full_path)
+
+        def preload(full_path: str) -> None:
+            state_dict = load_state_dict(full_path, mode)
+            if self.model_cache.put(full_path, state_dict, mapped=mode == "mmap"):
+                logger.info(f"Successfully cached {full_path} in CPU memory")
+
+        return PreloadScheduler(
+            preload,
+            max_workers=self.config.PRELOAD_CONCURRENCY,
+            # Reading the file is the load itself in "read" mode
+            warm=mode == "mmap" and self.config.PRELOAD_WARM_PAGE_CACHE,
+        ).start(full_paths)
+
+
+class _Job:
+    """A workflow queued for the executor thread and the future of its result."""
+
+    __slots__ = ("data", "loop", "future", "on_message", "cancelled")
+
+    def __init__(
+        self,
+        data: ExecutionData,
+        loop: asyncio.AbstractEventLoop,
+        on_message: Callable[[str, dict], None],
+    ):
+        self.data = data
+        self.loop = loop
+        self.future: asyncio.Future = loop.create_future()
+        self.on_message = on_message
+        self.cancelled = False
+
+    def post(self, event_type: str, msg: dict) -> None:
+        """Hand a message of the executor thread to the event loop."""
+        self._call_soon(self.on_message, event_type, msg)
+
+    def resolve(self, result: Dict) -> None:
+        self._call_soon(self._settle, result, None)
 
-        logger.info("Preloaded models to CPU memory")
+    def fail(self, error: Exception) -> None:
+        self._call_soon(self._settle, None, error)
+
+    def _call_soon(self, callback: Callable, *args) -> None:
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # The loop of the caller is closed, nobody waits for the job anymore
+            pass
+
+    def _settle(self, result: Optional[Dict], error: Optional[Exception]) -> None:
+        # Messages posted before are handled first, the loop runs callbacks in order
+        if self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
@@ -0,0 +1,92 @@
+"""
+Helpers to work with ComfyUI prompts (API format) as graphs.
+
+A prompt maps node ids to nodes of the shape {"class_type": str, "inputs": dict}.
+An input whose value is a [node_id, output_index] pair is a link to the output of
+another node, every other input value is a literal.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+
+def is_link(value: Any) -> bool:
+    """Whether an input value is a link to the output of another node."""
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+    )
+
+
+def iter_links(node: Dict) -> Iterator[Tuple[str, str, int]]:
+    """Yield (input_name, source_node_id, output_index) for the links of a node."""
+    for name, value in node.get("inputs", {}).items():
+        if is_link(value):
+            yield name, value[0], value[1]
+
+
+def upstream_ids(node: Dict) -> Set[str]:
+    return {source for _, source, _ in iter_links(node)}
+
+
+def topological_order(prompt: Dict[str, Dict]) -> List[str]:
+    """Return the node ids so that every node comes after the nodes it links to.
+
+    Links to nodes that are not in the prompt are ignored.
+
+    Raises:
+        ValueError: If the prompt contains a cycle
+    """
+    dependencies = {
+        node_id: upstream_ids(node) & prompt.keys() for node_id, node in prompt.items()
+    }
+    dependents: Dict[str, List[str]] = {node_id: [] for node_id in prompt}
+    for node_id, sources in dependencies.items():
+        for source in sources:
+            dependents[source].append(node_id)
+
+    remaining = {node_id: len(sources) for node_id, sources in dependencies.items()}
+    ready = [node_id for node_id, count in remaining.items() if count == 0]
+    order = []
+    while ready:
+        node_id = ready.pop()
+        order.append(node_id)
+        for dependent in dependents[node_id]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+
+    if len(order) != len(prompt):
+        raise ValueError("Prompt contains a cycle")
+    return order
+
+
+def downstream_nodes(prompt: Dict[str, Dict], node_ids: Iterable[str]) -> Set[str]:
+    """Return the given nodes and every node that depends on them."""
+    affected = set(node_ids)
+    for node_id in topological_order(prompt):
+        if node_id not in affected and upstream_ids(prompt[node_id]) & affected:
+            affected.add(node_id)
+    return affected
+
+
+def upstream_nodes(prompt: Dict[str, Dict], node_ids: Iterable[str]) -> Set[str]:
+    """Return the given nodes and every node they depend on."""
+    visited = set()
+    stack = [node_id for node_id in node_ids if node_id in prompt]
+    while stack:
+        node_id = stack.pop()
+        if node_id in visited:
+            continue
+        visited.add(node_id)
+        stack.extend(upstream_ids(prompt[node_id]) & prompt.keys() - visited)
+    return visited
+
+
+def canonical_hash(value: Any) -> str:
+    """Stable hash of a JSON-serializable value, independent of key order."""
+    serialized = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
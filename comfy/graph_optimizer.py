@@ -0,0 +1,181 @@
+import json
+import logging
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from .graph import is_link, topological_order, upstream_nodes
+from .models import PromptOptimization
+from .prompt_validation import NodeSchemaIndex
+
+logger = logging.getLogger(__name__)
+
+# Output nodes of ComfyUI core, used for classes the schema index doesn't know
+DEFAULT_OUTPUT_CLASSES = {
+    "SaveImage",
+    "PreviewImage",
+    "SaveImageWebsocket",
+    "SaveAnimatedWEBP",
+    "SaveAnimatedPNG",
+    "SaveLatent",
+}
+
+# Classes of ComfyUI core whose output only depends on their inputs, so two of
+# them with the same inputs can run once. Nothing tells the others apart from
+# nodes that must run every time, such as nodes whose IS_CHANGED returns NaN or
+# that draw random numbers without a seed input, so they are never merged
+DEFAULT_MERGEABLE_CLASSES = {
+    "CheckpointLoaderSimple",
+    "CheckpointLoader",
+    "UNETLoader",
+    "CLIPLoader",
+    "DualCLIPLoader",
+    "VAELoader",
+    "LoraLoader",
+    "LoraLoaderModelOnly",
+    "ControlNetLoader",
+    "CLIPVisionLoader",
+    "UpscaleModelLoader",
+    "LoadImage",
+    "CLIPSetLastLayer",
+    "CLIPTextEncode",
+    "ConditioningCombine",
+    "ConditioningSetArea",
+    "ControlNetApply",
+    "ControlNetApplyAdvanced",
+    "EmptyLatentImage",
+    "LatentUpscale",
+    "LatentUpscaleBy",
+    "KSampler",
+    "KSamplerAdvanced",
+    "VAEDecode",
+    "VAEEncode",
+    "VAEDecodeTiled",
+    "VAEEncodeTiled",
+    "ImageScale",
+    "ImageScaleBy",
+}
+
+
+def unknown_classes(
+    prompt: Dict[str, Dict],
+    index: Optional[NodeSchemaIndex] = None,
+    output_classes: Iterable[str] = DEFAULT_OUTPUT_CLASSES,
+) -> Set[str]:
+    """Classes of the prompt that may or may not be output nodes: the ones neither
+    the schema index nor `output_classes` know, every other class without an index."""
+    return {
+        node.get("class_type")
+        for node in prompt.values()
+        if node.get("class_type") not in output_classes
+        and (index is None or index.get(node.get("class_type")) is None)
+    }
+
+
+def output_nodes(
+    prompt: Dict[str, Dict],
+    index: Optional[NodeSchemaIndex] = None,
+    output_classes: Iterable[str] = DEFAULT_OUTPUT_CLASSES,
+) -> Set[str]:
+    """Ids of the nodes ComfyUI executes the prompt for."""
+    outputs = set()
+    for node_id, node in prompt.items():
+        class_type = node.get("class_type")
+        schema = index.get(class_type) if index is not None else None
+        if schema is not None:
+            is_output = schema.output_node
+        else:
+            is_output = class_type in output_classes
+        if is_output:
+            outputs.add(node_id)
+    return outputs
+
+
+def optimize_prompt(
+    prompt: Dict[str, Dict],
+    index: Optional[NodeSchemaIndex] = None,
+    output_classes: Iterable[str] = DEFAULT_OUTPUT_CLASSES,
+    mergeable_classes: Iterable[str] = DEFAULT_MERGEABLE_CLASSES,
+) -> Tuple[Dict[str, Dict], PromptOptimization]:
+    """
+    Return a leaner prompt that produces the same outputs.
+
+    - Nodes no output node depends on are pruned
+    - Nodes of `mergeable_classes` with the same class and the same inputs
+      (literals and, once their own sources are merged, links) are merged into
+      one of them, so identical loaders or encoders and the subgraphs built on
+      them run once. Output nodes are never merged, each of them sends or saves
+      its own result
+    - Nodes are listed in topological order with their class_type and inputs only,
+      UI metadata such as `_meta` is dropped
+
+    The given prompt is not modified. Prompts without a known output node or with
+    a cycle are returned as they are, for ComfyUI to report. So are prompts with
+    classes that aren't known to be outputs or not (see unknown_classes), e.g.
+    the video saver of a custom node pack would be pruned with all its inputs.
+    """
+    unknown = unknown_classes(prompt, index, output_classes)
+    if unknown:
+        logger.debug(f"Not optimizing a prompt with unknown classes {unknown}")
+        return prompt, PromptOptimization(nodes=len(prompt))
+    outputs = output_nodes(prompt, index, output_classes)
+    if not outputs:
+        return prompt, PromptOptimization(nodes=len(prompt))
+    try:
+        order = topological_order(prompt)
+    except ValueError:
+        logger.warning("Not optimizing a prompt that contains a cycle")
+        return prompt, PromptOptimization(nodes=len(prompt))
+
+    reachable = upstream_nodes(prompt, outputs)
+    pruned = [node_id for node_id in prompt if node_id not in reachable]
+    optimized, merged = merge_duplicates(
+        prompt,
+        [node_id for node_id in order if node_id in reachable],
+        mergeable_classes,
+        keep=outputs,
+    )
+    return optimized, PromptOptimization(
+        nodes=len(prompt), pruned=pruned, merged=merged
+    )
+
+
+def merge_duplicates(
+    prompt: Dict[str, Dict],
+    order: Iterable[str],
+    mergeable_classes: Iterable[str] = DEFAULT_MERGEABLE_CLASSES,
+    keep: Iterable[str] = (),
+) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+    """
+    Merge the nodes of `mergeable_classes` with the same class and inputs into the
+    first of them, see optimize_prompt. Returns the nodes of `order`, which must be
+    topological, with their links rewritten, and the id of the node each merged
+    node was merged into. Nodes of `keep` are never merged.
+    """
+    keep = set(keep)
+    optimized: Dict[str, Dict] = {}
+    # Merged node id -> id of the node it was merged into
+    merged: Dict[str, str] = {}
+    # Serialized class and inputs of each kept node, for finding duplicates
+    kept_by_key: Dict[str, str] = {}
+    for node_id in order:
+        node = prompt[node_id]
+        inputs = node.get("inputs", {})
+        rewritten = None
+        for name, value in inputs.items():
+            if is_link(value) and value[0] in merged:
+                if rewritten is None:
+                    rewritten = dict(inputs)
+                rewritten[name] = [merged[value[0]], value[1]]
+        if rewritten is not None:
+            inputs = rewritten
+
+        if node_id not in keep and node.get("class_type") in mergeable_classes:
+            key = json.dumps(
+                [node.get("class_type"), inputs], sort_keys=True, default=str
+            )
+            duplicate_of = kept_by_key.get(key)
+            if duplicate_of is not None:
+                merged[node_id] = duplicate_of
+                continue
+            kept_by_key[key] = node_id
+        optimized[node_id] = {"class_type": node.get("class_type"), "inputs": inputs}
+    return optimized, merged
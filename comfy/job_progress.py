@@ -1,7 +1,15 @@
-from typing import Dict, Set, Optional, List, Any
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Set
+
+from .graph import upstream_nodes
+from .timeline import NodeLatencyHistograms
 
 
 class ComfyStatusLog:
+    __slots__ = ("prompt_id", "node", "value", "max", "status", "nodes")
+
     def __init__(
         self,
         prompt_id: str,
@@ -9,7 +17,7 @@ class ComfyStatusLog:
         value: Optional[int] = 1,
         max: Optional[int] = 1,
         status: Optional[str] = None,
-        nodes: Optional[List[str]] = [],
+        nodes: Sequence[str] = (),
     ):
         self.prompt_id = prompt_id
         self.node = node
@@ -23,54 +31,264 @@ class ComfyStatusLog:
         self.status = message_data.get("status", None)
         self.max = message_data.get("max", 1)
         self.value = message_data.get("value", 1)
-        self.nodes = message_data.get("nodes", [])
+        self.nodes = message_data.get("nodes", ())
         return self
 
 
+# Estimates for nodes without history, in milliseconds
+DEFAULT_NODE_MS = 100.0
+DEFAULT_STEP_MS = 200.0
+
+# Share of the expected work that must be done before the ETA is scaled by the
+# speed observed so far
+ETA_CALIBRATION_SHARE = 0.05
+ETA_SPEED_BOUNDS = (0.2, 5.0)
+
+# Status logs kept per job, older ones are only counted
+MAX_STATUS_LOGS = 100
+
+
 class ComfyJobProgress:
-    def __init__(self, prompt: Dict[str, any]):
-        self.status_logs: List[ComfyStatusLog] = []
+    """Progress and ETA of a job, weighted by the expected duration of its nodes.
+
+    Every node is weighted by its median duration on this container, or on the
+    workers before it (see NodeLatencyHistograms.prior), scaled by its steps for
+    samplers. Nodes without history get a default estimate. A node is done once ComfyUI executed it, reported it as
+    cached, or started a node that depends on it. `progress` messages add the done
+    share of the steps of the running node.
+
+    Only the last `max_status_logs` status logs are kept and the done and total
+    weights are maintained incrementally, so memory and the cost of a message stay
+    constant however many messages a job sends.
+    """
+
+    def __init__(
+        self,
+        prompt: Dict[str, any],
+        history: Optional[NodeLatencyHistograms] = None,
+        max_status_logs: int = MAX_STATUS_LOGS,
+    ):
+        self.status_logs: Deque[ComfyStatusLog] = deque(maxlen=max_status_logs)
+        self.message_count = 0
         self.prompt = prompt
         self.visited_nodes: Set[str] = set()
+        self.cached_nodes: Set[str] = set()
         self.current_node: Optional[ComfyStatusLog] = None
         self.total_nodes: Set[str] = set(self.prompt.keys())
         self.last_percentage: float = 0
+        self.weights: Dict[str, float] = {
+            node_id: self._estimate_duration(node, history)
+            for node_id, node in prompt.items()
+        }
+        self.started_at: Optional[float] = None
+        self.finished = False
+        # Nodes that finished executing and the sum of their weights
+        self._completed: Set[str] = set()
+        self._completed_weight = 0.0
+        self._total_weight = sum(self.weights.values())
+
+    @staticmethod
+    def _estimate_duration(
+        node: Dict[str, Any], history: Optional[NodeLatencyHistograms]
+    ) -> float:
+        steps = node.get("inputs", {}).get("steps")
+        if not isinstance(steps, int) or isinstance(steps, bool) or steps <= 0:
+            steps = None
+        if history is not None:
+            expected = history.expected_duration(node.get("class_type"), steps)
+            if expected is not None:
+                return max(expected, 1.0)
+        return steps * DEFAULT_STEP_MS if steps else DEFAULT_NODE_MS
 
     def remove_cached_nodes_from_total_nodes(self, status_log: ComfyStatusLog):
-        if len(status_log.nodes) > 0:
-            self.total_nodes -= set(status_log.nodes)
+        for node in status_log.nodes:
+            if node not in self.total_nodes:
+                continue
+            self.total_nodes.discard(node)
+            self.cached_nodes.add(node)
+            self._total_weight -= self.weights.get(node, 0)
+            if node in self._completed:
+                self._completed.discard(node)
+                self._completed_weight -= self.weights.get(node, 0)
 
     def add_status_log(self, status_log: ComfyStatusLog):
-        self.remove_cached_nodes_from_total_nodes(status_log)
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        self.message_count += 1
         self.status_logs.append(status_log)
-        if status_log.node is not None:
-            self.current_node = status_log
-        if (
-            self.current_node
-            and self.current_node.node
-            and self.current_node.node in self.total_nodes
-        ):
-            self.visited_nodes.add(self.current_node.node)
+        if status_log.nodes:
+            self.remove_cached_nodes_from_total_nodes(status_log)
+        if status_log.node is None:
+            return
+        previous = self.current_node.node if self.current_node else None
+        if status_log.node != previous:
+            # ComfyUI runs one node at a time, a new node means the last one is done
+            if previous is not None:
+                self._complete(previous)
+            self._complete_upstream(status_log.node)
+        self.current_node = status_log
+        if status_log.node in self.total_nodes:
+            self.visited_nodes.add(status_log.node)
+
+    def finish(self) -> None:
+        """Mark the job as done, including nodes ComfyUI skipped."""
+        self.finished = True
+
+    def _complete(self, node_id: str) -> None:
+        if node_id in self.total_nodes and node_id not in self._completed:
+            self._completed.add(node_id)
+            self._completed_weight += self.weights.get(node_id, 0)
+            self.visited_nodes.add(node_id)
+
+    def _complete_upstream(self, node_id: str) -> None:
+        """Every node a started node depends on has been executed or cached."""
+        for upstream in upstream_nodes(self.prompt, [node_id]):
+            if upstream != node_id:
+                self._complete(upstream)
 
     def get_status_logs(self) -> List[ComfyStatusLog]:
-        return self.status_logs
+        return list(self.status_logs)
+
+    def _done_weight(self) -> float:
+        return (
+            self._completed_weight
+            + self.get_current_node_fraction() * self._current_weight()
+        )
+
+    def _current_weight(self) -> float:
+        if self.current_node is None:
+            return 0
+        node = self.current_node.node
+        if node not in self.total_nodes or node in self._completed:
+            return 0
+        return self.weights.get(node, 0)
+
+    def get_current_node_fraction(self) -> float:
+        """Done share of the running node, from its step progress."""
+        if self.current_node is None or not self.current_node.max:
+            return 0
+        if self.current_node.max == 1:
+            return 0
+        return min(self.current_node.value / self.current_node.max, 1)
 
     def get_current_node_percentage(self) -> float:
-        node_total_percentage = 100 / len(self.total_nodes)
-        value = self.current_node.value if self.current_node else 1
-        max = self.current_node.max if self.current_node else 1
-        node_percentage = value / max
-        return min(node_percentage * node_total_percentage, 100)
+        if self._total_weight <= 0:
+            return 0
+        current = self.get_current_node_fraction() * self._current_weight()
+        return min(current / self._total_weight * 100, 100)
 
     def get_percentage(self) -> float:
-        current_node_percentage = self.get_current_node_percentage()
-        has_max = self.current_node and self.current_node.max != 1
-        has_value = self.current_node and self.current_node.value
-        node_has_progress = has_max and has_value
-        last_percentage = (
-            (len(self.visited_nodes) - (0 if node_has_progress else 1))
-            / len(self.total_nodes)
-        ) * 100
-        new_percentage = last_percentage + current_node_percentage
+        if self.finished:
+            self.last_percentage = 100
+            return 100
+        total = self._total_weight
+        new_percentage = self._done_weight() / total * 100 if total > 0 else 0
         self.last_percentage = min(max(new_percentage, self.last_percentage), 100)
         return round(self.last_percentage, 2)
+
+    def get_eta(self) -> Optional[float]:
+        """Estimated seconds until the job finishes, None before it started."""
+        if self.finished:
+            return 0
+        if self.started_at is None:
+            return None
+        total = self._total_weight
+        done = self._done_weight()
+        remaining = max(total - done, 0)
+        # Scale the estimates by how fast this job has been so far
+        speed = 1.0
+        if total > 0 and done / total >= ETA_CALIBRATION_SHARE:
+            elapsed = (time.perf_counter() - self.started_at) * 1000
+            low, high = ETA_SPEED_BOUNDS
+            speed = min(max(elapsed / done, low), high)
+        return round(remaining * speed / 1000, 2)
+
+    def summary(self) -> Dict[str, Any]:
+        """Compact state of the job, cheap enough to query on every message."""
+        current = self.current_node
+        return {
+            "messages": self.message_count,
+            "retained_messages": len(self.status_logs),
+            "nodes": len(self.total_nodes),
+            "cached_nodes": len(self.cached_nodes),
+            "completed_nodes": len(self._completed),
+            "current_node": current.node if current else None,
+            "current_step": current.value if current and current.max != 1 else None,
+            "current_steps": current.max if current and current.max != 1 else None,
+            "percentage": round(self.last_percentage, 2),
+            "eta": self.get_eta(),
+        }
+
+
+class ProgressEmitter:
+    """Throttles the progress updates of a job.
+
+    The first update and the end of the job are always emitted. In between, an
+    update is emitted right away only when the percentage moved by at least
+    `min_delta` and `min_interval` seconds passed since the last one. Updates that
+    arrive too early are merged into a single one, sent when the interval is over.
+    Smaller moves are merged the same way and sent `min_interval` seconds after the
+    last emit at the earliest, so the last known progress always reaches the
+    callback, e.g. a job stuck at 99.5% doesn't report 99% until it ends.
+    """
+
+    def __init__(
+        self,
+        on_progress: Optional[Callable[[str, Dict, Optional[str]], Any]],
+        min_interval: float = 0.5,
+        min_delta: float = 1.0,
+    ):
+        self.on_progress = on_progress
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self.emitted = 0
+        self.merged = 0
+        self._last_emitted_at: Optional[float] = None
+        self._last_percentage: Optional[float] = None
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._job: Optional[ComfyJobProgress] = None
+
+    def update(self, job: ComfyJobProgress) -> None:
+        if self.on_progress is None:
+            return
+        percentage = job.get_percentage()
+        if job.finished or self._last_emitted_at is None:
+            self._emit(job, percentage)
+            return
+        wait = self._last_emitted_at + self.min_interval - time.monotonic()
+        small_move = percentage - self._last_percentage < self.min_delta
+        if wait <= 0 and not small_move:
+            self._emit(job, percentage)
+            return
+        self.merged += 1
+        self._job = job
+        if self._flush_handle is None:
+            # Small moves wait a full interval, the next one may well be large
+            delay = max(wait, self.min_interval) if small_move else wait
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                delay, self._flush
+            )
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        if self._job is None:
+            return
+        percentage = self._job.get_percentage()
+        if percentage != self._last_percentage:
+            self._emit(self._job, percentage)
+
+    def _emit(self, job: ComfyJobProgress, percentage: float) -> None:
+        self.close()
+        self._last_emitted_at = time.monotonic()
+        self._last_percentage = percentage
+        self.emitted += 1
+        self.on_progress(
+            "progress", {"progress": percentage, "eta": job.get_eta()}, None
+        )
+
+    def close(self) -> None:
+        """Drop the pending update, if any."""
+        self._job = None
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
@@ -0,0 +1,371 @@
+import asyncio
+import functools
+import hashlib
+import io
+import ipaddress
+import logging
+import os
+import shutil
+import socket
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional, Tuple, Union
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+from pydantic import BaseModel
+from yarl import URL
+
+from .client import ComfyClient
+from .config import ComfyConfig
+from .models import MediaInput
+
+logger = logging.getLogger(__name__)
+
+# Hashes of ingested files remembered per container
+MAX_KNOWN_INPUTS = 10000
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_SCHEMES = {"http", "https"}
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+# Formats ComfyUI's LoadImage reads, by the format name of Pillow
+IMAGE_EXTENSIONS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp", "GIF": "gif"}
+
+
+def media_inputs(input: BaseModel) -> List[MediaInput]:
+    """The media inputs of a workflow input, in its fields or lists of them."""
+    found = []
+    for name in type(input).model_fields:
+        value = getattr(input, name)
+        values = value if isinstance(value, (list, tuple)) else (value,)
+        found.extend(item for item in values if isinstance(item, MediaInput))
+    return found
+
+
+# The bytes of an input, or the path of the temporary file it was downloaded to
+MediaSource = Union[bytes, str]
+
+
+def is_public_address(host: str) -> bool:
+    """Whether an IP address is globally routable: not private, loopback,
+    link-local (such as the metadata service), multicast or reserved."""
+    address = ipaddress.ip_address(host.split("%")[0])
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+def check_url(url: URL, allow_private: bool = False) -> None:
+    """
+    Raises:
+        ValueError: If the URL isn't http(s) or names a non-public address
+    """
+    if url.scheme not in DOWNLOAD_SCHEMES or not url.host:
+        raise ValueError(f"Input URL {url} isn't an http or https URL")
+    if allow_private:
+        return
+    try:
+        public = is_public_address(url.host)
+    except ValueError:
+        # A host name, checked once resolved (see PublicResolver)
+        return
+    if not public:
+        raise ValueError(f"Input URL {url} names a non-public address")
+
+
+class PublicResolver(AbstractResolver):
+    """Resolves host names to their public addresses only, see is_public_address.
+    Checking the addresses connected to, rather than the host name, also covers
+    names that resolve differently from one lookup to the next."""
+
+    def __init__(self):
+        self._resolver = aiohttp.ThreadedResolver()
+
+    async def resolve(
+        self, host: str, port: int = 0, family: int = socket.AF_INET
+    ) -> List[Dict]:
+        addresses = [
+            address
+            for address in await self._resolver.resolve(host, port, family)
+            if is_public_address(address["host"])
+        ]
+        if not addresses:
+            raise OSError(f"{host} has no public address")
+        return addresses
+
+    async def close(self) -> None:
+        await self._resolver.close()
+
+
+def _prepare_image(
+    source: MediaSource, max_side: Optional[int]
+) -> Tuple[MediaSource, str]:
+    """Check that the data is an image and downscale it, in a worker thread."""
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    except UnidentifiedImageError as e:
+        raise ValueError("Input is not a supported image") from e
+    with image:
+        extension = IMAGE_EXTENSIONS.get(image.format)
+        if extension is None:
+            raise ValueError(f"Unsupported image format {image.format}")
+        if max_side is None or max(image.size) <= max_side:
+            # Opening only parsed the header, the file is stored as it was sent
+            return source, extension
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format="PNG")
+        return output.getvalue(), "png"
+
+
+class MediaIngest:
+    """Stores the input files of requests where ComfyUI's loader nodes find them.
+
+    Files are named after the SHA-256 of their content, so an image sent again
+    (the same reference image of thousands of img2img requests) maps to the file
+    already stored and is neither decoded nor written a second time. Concurrent
+    requests with the same file wait for a single ingest.
+
+    URLs and files (uploads staged by the gateway) are streamed to a temporary
+    file and hashed chunk by chunk, so they are never held in memory (see spool).
+    They are capped at INPUT_MAX_BYTES while reading, downloads also against
+    Content-Length up front and at INPUT_DOWNLOAD_TIMEOUT seconds. Hashing,
+    writing, decoding and resizing run on a thread pool, the event loop only
+    moves bytes. URLs come from callers, so only http(s) URLs of public addresses
+    are fetched, redirects included (see check_url and PublicResolver).
+    """
+
+    def __init__(self, config: ComfyConfig, client: Optional[ComfyClient] = None):
+        self.config = config
+        self.client = client
+        self.input_dir = os.path.join(config.COMFYUI_PATH, "input")
+        self.ingested = 0
+        self.deduplicated = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.INPUT_WORKERS, thread_name_prefix="media-ingest"
+        )
+        # Content hash -> stored name, in order of last use
+        self._names: OrderedDict[str, str] = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            resolver = (
+                None if self.config.INPUT_ALLOW_PRIVATE_URLS else PublicResolver()
+            )
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(resolver=resolver),
+                timeout=aiohttp.ClientTimeout(total=self.config.INPUT_DOWNLOAD_TIMEOUT),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self._executor.shutdown(wait=False)
+
+    async def ingest_all(self, input: BaseModel) -> None:
+        """Ingest every media input of a workflow input."""
+        await asyncio.gather(*(self.ingest(media) for media in media_inputs(input)))
+
+    async def ingest(self, media: MediaInput) -> str:
+        """
+        Store a media input and set its name.
+
+        Raises:
+            ValueError: If the file is too large, not a supported image, a path
+                outside INPUT_STAGING_DIR or a URL that isn't allowed (see check_url)
+            aiohttp.ClientError: If the URL can't be downloaded
+        """
+        if media.name is not None:
+            return media.name
+        loop = asyncio.get_running_loop()
+        if media.url is not None:
+            digest, source = await self._download(media.url)
+        elif media.path is not None:
+            path = self._staged_path(media.path)
+            digest, source = await self.spool(read_chunks(path), media.path)
+        else:
+            if len(media.data) > self.config.INPUT_MAX_BYTES:
+                raise ValueError(f"Input is larger than {self.config.INPUT_MAX_BYTES}")
+            source = media.data
+            digest = await loop.run_in_executor(
+                self._executor, lambda: hashlib.sha256(source).hexdigest()
+            )
+        try:
+            name = await self._ingest(digest, source)
+        finally:
+            if isinstance(source, str) and os.path.exists(source):
+                # Spooled file that was already stored or failed to be
+                os.remove(source)
+        media._name = name
+        return name
+
+    def _staged_path(self, path: str) -> str:
+        """
+        Raises:
+            ValueError: If the path is outside INPUT_STAGING_DIR
+        """
+        staging_dir = self.config.INPUT_STAGING_DIR
+        if staging_dir is not None:
+            staging_dir = os.path.realpath(staging_dir)
+            path = os.path.realpath(path)
+            if os.path.commonpath([staging_dir, path]) == staging_dir:
+                return path
+        raise ValueError(f"Input path {path} is outside INPUT_STAGING_DIR")
+
+    async def _ingest(self, digest: str, source: MediaSource) -> str:
+        loop = asyncio.get_running_loop()
+        name = self._names.get(digest)
+        if name is not None:
+            self._names.move_to_end(digest)
+            self.deduplicated += 1
+        else:
+            pending = self._pending.get(digest)
+            if pending is not None:
+                name = await asyncio.shield(pending)
+                self.deduplicated += 1
+            else:
+                pending = self._pending[digest] = loop.create_future()
+                try:
+                    name = await self._store(digest, source)
+                    pending.set_result(name)
+                except BaseException as e:
+                    pending.set_exception(e)
+                    # Waiters re-raise it, don't warn about it never being retrieved
+                    pending.exception()
+                    raise
+                finally:
+                    del self._pending[digest]
+                self._names[digest] = name
+                if len(self._names) > MAX_KNOWN_INPUTS:
+                    self._names.popitem(last=False)
+                self.ingested += 1
+        return name
+
+    async def _download(self, url: str) -> Tuple[str, str]:
+        """
+        Download a URL to a temporary file, see spool. Redirects are followed up to
+        MAX_REDIRECTS times, each URL is checked like the first one.
+
+        Raises:
+            ValueError: If the file is larger than INPUT_MAX_BYTES, or a URL isn't
+                http(s) or names a non-public address (see check_url)
+            aiohttp.ClientError: If a host name has no public address
+        """
+        max_bytes = self.config.INPUT_MAX_BYTES
+        target = URL(url)
+        for _ in range(MAX_REDIRECTS + 1):
+            check_url(target, self.config.INPUT_ALLOW_PRIVATE_URLS)
+            async with self.session.get(target, allow_redirects=False) as response:
+                if response.status in REDIRECT_STATUSES:
+                    target = response.url.join(URL(response.headers["Location"]))
+                    continue
+                response.raise_for_status()
+                if (response.content_length or 0) > max_bytes:
+                    raise ValueError(f"Input at {url} is larger than {max_bytes}")
+                return await self.spool(
+                    response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE), url
+                )
+        raise ValueError(f"Input at {url} redirects more than {MAX_REDIRECTS} times")
+
+    async def spool(
+        self,
+        chunks: AsyncIterator[bytes],
+        label: str,
+        directory: Optional[str] = None,
+    ) -> Tuple[str, str]:
+        """
+        Write chunks to a temporary file, hashing them as they arrive. Returns the
+        SHA-256 of the content and the path of the file, which the caller removes
+        or moves.
+
+        Args:
+            chunks: The content, e.g. of a download or an upload
+            label: Names the input in errors
+            directory: Where to create the file, the temporary directory if None
+
+        Raises:
+            ValueError: If the content is larger than INPUT_MAX_BYTES
+        """
+        loop = asyncio.get_running_loop()
+        max_bytes = self.config.INPUT_MAX_BYTES
+        digest = hashlib.sha256()
+        size = 0
+        fd, path = await loop.run_in_executor(
+            self._executor,
+            functools.partial(tempfile.mkstemp, prefix="media-ingest-", dir=directory),
+        )
+        try:
+            with os.fdopen(fd, "wb") as file:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ValueError(f"Input {label} is larger than {max_bytes}")
+                    await loop.run_in_executor(
+                        self._executor, _append, file, digest, chunk
+                    )
+        except BaseException:
+            os.remove(path)
+            raise
+        return digest.hexdigest(), path
+
+    async def _store(self, digest: str, source: MediaSource) -> str:
+        loop = asyncio.get_running_loop()
+        source, extension = await loop.run_in_executor(
+            self._executor, _prepare_image, source, self.config.INPUT_MAX_SIDE
+        )
+        name = f"{digest[:32]}.{extension}"
+        if self.config.INPUT_UPLOAD == "http":
+            if isinstance(source, str):
+                source = await loop.run_in_executor(self._executor, _read, source)
+            # ComfyUI answers with the name it stored the file as
+            response = await self.client.upload_image(source, name, overwrite=True)
+            return response.get("name", name)
+        await loop.run_in_executor(self._executor, self._write, name, source)
+        return name
+
+    def _write(self, name: str, source: MediaSource) -> None:
+        path = os.path.join(self.input_dir, name)
+        if os.path.exists(path):
+            # Stored by an earlier container on the same disk
+            return
+        os.makedirs(self.input_dir, exist_ok=True)
+        # Written under a temporary name so ComfyUI never reads a partial file
+        temporary = f"{path}.{os.getpid()}.tmp"
+        if isinstance(source, str):
+            # Renamed when the temporary directory is on the same filesystem
+            shutil.move(source, temporary)
+        else:
+            with open(temporary, "wb") as file:
+                file.write(source)
+        os.replace(temporary, path)
+
+
+def _append(file: BinaryIO, digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    file.write(chunk)
+
+
+async def read_chunks(
+    path: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """The content of a file in chunks, read on a worker thread."""
+    with open(path, "rb") as file:
+        while True:
+            chunk = await asyncio.to_thread(file.read, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
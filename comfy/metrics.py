@@ -0,0 +1,37 @@
+"""Metrics of the ComfyUI worker, registered on the process wide registry."""
+
+from lib.metrics import REGISTRY
+
+EXECUTIONS = REGISTRY.counter(
+    "comfy_executions_total", "Executions by outcome", ["status"]
+)
+EXECUTIONS_IN_FLIGHT = REGISTRY.gauge(
+    "comfy_executions_in_flight", "Executions queued or running on ComfyUI"
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "comfy_queue_depth", "Executions queued on ComfyUI that did not start yet"
+)
+QUEUE_SECONDS = REGISTRY.histogram(
+    "comfy_queue_seconds", "Time from queueing a prompt until ComfyUI starts it"
+)
+EXECUTION_SECONDS = REGISTRY.histogram(
+    "comfy_execution_seconds", "Time from the start of a prompt until it finished"
+)
+TOTAL_SECONDS = REGISTRY.histogram(
+    "comfy_total_seconds", "Time spent in ComfyServer.execute"
+)
+NODE_SECONDS = REGISTRY.histogram(
+    "comfy_node_duration_seconds", "Duration of executed nodes", ["class_type"]
+)
+RESULT_CACHE_REQUESTS = REGISTRY.counter(
+    "comfy_result_cache_requests_total", "Result cache lookups", ["result"]
+)
+RESPONSE_BYTES = REGISTRY.counter(
+    "comfy_response_bytes_total", "Bytes of output returned to callers"
+)
+COLD_STARTS = REGISTRY.counter(
+    "comfy_cold_starts_total", "ComfyUI servers started by this process"
+)
+STARTUP_SECONDS = REGISTRY.gauge(
+    "comfy_startup_phase_seconds", "Duration of the last ComfyUI startup", ["phase"]
+)
@@ -0,0 +1,207 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Literal, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EvictionPolicy = Literal["lru", "lfu"]
+
+# Identity of a file: device, inode, size and modification time. The same file
+# reached through different mounts or symlinks has the same key, a file replaced
+# in place gets a new one
+ModelKey = Tuple[int, int, int, int]
+
+CGROUP_MEMORY_LIMITS = (
+    "/sys/fs/cgroup/memory.max",
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+)
+
+
+def model_key(path: str) -> ModelKey:
+    stat = os.stat(path)
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def memory_limit_bytes() -> int:
+    """Memory the container may use: its cgroup limit, or the physical memory."""
+    physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for path in CGROUP_MEMORY_LIMITS:
+        try:
+            with open(path) as file:
+                value = file.read().strip()
+        except OSError:
+            continue
+        if value.isdigit():
+            return min(int(value), physical)
+    return physical
+
+
+def state_dict_bytes(state_dict: Dict[str, Any]) -> int:
+    """Resident bytes of the tensors of a state dict, shared storages count once."""
+    seen = set()
+    total = 0
+    for value in state_dict.values():
+        storage = getattr(value, "untyped_storage", None)
+        if storage is None:
+            continue
+        storage = storage()
+        if storage.data_ptr() in seen:
+            continue
+        seen.add(storage.data_ptr())
+        total += storage.nbytes()
+    return total
+
+
+class _Entry:
+    __slots__ = ("path", "value", "size", "mapped", "hits", "last_used")
+
+    def __init__(self, path: str, value: Any, size: int, mapped: bool = False):
+        self.path = path
+        self.value = value
+        self.size = size
+        self.mapped = mapped
+        self.hits = 0
+        self.last_used = time.monotonic()
+
+
+class ModelCache:
+    """State dicts kept in host memory, bounded by a byte budget.
+
+    Entries are keyed by file identity (see model_key) and looked up in O(1).
+    When an entry doesn't fit, the least recently used ("lru") or the least used
+    ("lfu", ties broken by recency) entries are evicted first. Entries larger
+    than the whole budget are not cached. A file replaced on disk drops the entry
+    of its previous version.
+
+    Memory mapped state dicts (see model_loading), the default MODEL_LOAD_MODE,
+    live in the page cache, which the kernel reclaims under pressure. They are
+    counted in `mapped_bytes`, don't use the budget and are never evicted, only
+    dropped when their file changes. The budget bounds "read" mode models only.
+    """
+
+    def __init__(self, max_bytes: int, policy: EvictionPolicy = "lru"):
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.resident_bytes = 0
+        self.mapped_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+        # In order of last use, oldest first
+        self._entries: OrderedDict[ModelKey, _Entry] = OrderedDict()
+        # Real path -> key of the version of the file in the cache
+        self._keys_by_path: Dict[str, ModelKey] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, path: str) -> bool:
+        try:
+            return model_key(path) in self._entries
+        except OSError:
+            return False
+
+    def free_bytes(self) -> int:
+        return self.max_bytes - self.resident_bytes
+
+    def get(self, path: str) -> Optional[Any]:
+        try:
+            key = model_key(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                # The file may have been replaced, free its previous version
+                stale = self._keys_by_path.get(os.path.realpath(path))
+                if stale is not None:
+                    self._remove(stale)
+                return None
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            entry.last_used = time.monotonic()
+            self.hits += 1
+            return entry.value
+
+    def put(
+        self, path: str, value: Any, size: Optional[int] = None, mapped: bool = False
+    ) -> bool:
+        """Cache a state dict, evicting others to make room. Returns if it was cached."""
+        key = model_key(path)
+        real_path = os.path.realpath(path)
+        if size is None:
+            size = state_dict_bytes(value)
+        with self._lock:
+            previous = self._keys_by_path.get(real_path)
+            if previous is not None:
+                self._remove(previous)
+            if key in self._entries:
+                self._remove(key)
+            if mapped:
+                self._entries[key] = _Entry(path, value, size, mapped=True)
+                self._keys_by_path[real_path] = key
+                self.mapped_bytes += size
+                return True
+            if size > self.max_bytes:
+                self.rejected += 1
+                logger.warning(
+                    f"Not caching {path}: {size} bytes exceed the model cache "
+                    f"budget of {self.max_bytes}"
+                )
+                return False
+            while self.resident_bytes + size > self.max_bytes:
+                victim = self._victim()
+                logger.info(f"Evicting {self._entries[victim].path} from model cache")
+                self._remove(victim)
+                self.evictions += 1
+            self._entries[key] = _Entry(path, value, size)
+            self._keys_by_path[real_path] = key
+            self.resident_bytes += size
+            return True
+
+    def get_or_load(self, path: str, load: Callable[[str], Any]) -> Any:
+        value = self.get(path)
+        if value is None:
+            value = load(path)
+            self.put(path, value)
+        return value
+
+    def _victim(self) -> ModelKey:
+        # Only resident entries use the budget
+        candidates = [key for key, entry in self._entries.items() if not entry.mapped]
+        if self.policy == "lfu":
+            return min(
+                candidates,
+                key=lambda key: (self._entries[key].hits, self._entries[key].last_used),
+            )
+        return candidates[0]
+
+    def _remove(self, key: ModelKey) -> None:
+        entry = self._entries.pop(key)
+        if entry.mapped:
+            self.mapped_bytes -= entry.size
+        else:
+            self.resident_bytes -= entry.size
+        real_path = os.path.realpath(entry.path)
+        if self._keys_by_path.get(real_path) == key:
+            del self._keys_by_path[real_path]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "resident_bytes": self.resident_bytes,
+                "mapped_bytes": self.mapped_bytes,
+                "max_bytes": self.max_bytes,
+                "policy": self.policy,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "rejected": self.rejected,
+            }
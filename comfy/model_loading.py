@@ -0,0 +1,129 @@
+"""
+Loading of model files into CPU tensors without intermediate copies.
+
+Two modes:
+- "mmap": the file is mapped copy-on-write and every tensor is a view on the
+  mapping. Nothing is read until a tensor is used and the pages are shared with
+  the OS page cache, so a preloaded model adds no anonymous memory. After a
+  memory snapshot is restored the pages are read again from the file on first
+  use, the file must be at the same path (e.g. the same volume mount).
+- "read": the file is read once into a single buffer and every tensor is a view
+  on it. The weights are part of the process memory, and of a memory snapshot,
+  for the price of one copy instead of the two of safetensors.torch.load_file.
+
+Other formats go through torch.load, memory mapped in "mmap" mode when the file
+uses the zip format.
+"""
+
+import json
+import logging
+import mmap
+import struct
+from typing import Any, Dict, Literal, Tuple
+
+logger = logging.getLogger(__name__)
+
+LoadMode = Literal["mmap", "read"]
+
+SAFETENSORS_EXTENSIONS = (".safetensors", ".sft")
+
+# Names of the torch dtypes of safetensors dtypes, fp8 types need torch >= 2.1
+SAFETENSORS_DTYPES = {
+    "F64": "float64",
+    "F32": "float32",
+    "F16": "float16",
+    "BF16": "bfloat16",
+    "F8_E4M3": "float8_e4m3fn",
+    "F8_E5M2": "float8_e5m2",
+    "I64": "int64",
+    "I32": "int32",
+    "I16": "int16",
+    "I8": "int8",
+    "U8": "uint8",
+    "BOOL": "bool",
+}
+
+HEADER_SIZE = struct.Struct("<Q")
+READ_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def read_safetensors_header(file) -> Tuple[Dict[str, Any], int]:
+    """Return the header of a safetensors file and the offset of its data."""
+    (size,) = HEADER_SIZE.unpack(file.read(HEADER_SIZE.size))
+    header = json.loads(file.read(size))
+    return header, HEADER_SIZE.size + size
+
+
+def _read_into_buffer(file, size: int) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    position = 0
+    while position < size:
+        read = file.readinto(view[position : position + READ_CHUNK_SIZE])
+        if not read:
+            raise ValueError(f"Unexpected end of file after {position} bytes")
+        position += read
+    return buffer
+
+
+def load_safetensors(path: str, mode: LoadMode = "mmap") -> Dict[str, Any]:
+    """Tensors of a safetensors file as views on a mapping or on a single buffer."""
+    import torch
+
+    with open(path, "rb") as file:
+        header, data_offset = read_safetensors_header(file)
+        if mode == "mmap":
+            # Copy-on-write keeps the file untouched and lets torch see a
+            # writable buffer, unchanged pages stay shared with the page cache
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        else:
+            file.seek(0, 2)
+            size = file.tell() - data_offset
+            file.seek(data_offset)
+            buffer = _read_into_buffer(file, size)
+            data_offset = 0
+
+    state_dict = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, SAFETENSORS_DTYPES.get(info["dtype"], ""), None)
+        if dtype is None:
+            raise ValueError(f"Unsupported dtype {info['dtype']} of {name} in {path}")
+        begin, end = info["data_offsets"]
+        shape = info["shape"]
+        if end == begin:
+            state_dict[name] = torch.empty(shape, dtype=dtype)
+            continue
+        # The tensors keep a reference to the buffer, the mapping lives as long
+        # as one of them
+        state_dict[name] = torch.frombuffer(
+            buffer,
+            dtype=dtype,
+            count=(end - begin) // dtype.itemsize,
+            offset=data_offset + begin,
+        ).reshape(shape)
+    return state_dict
+
+
+def load_state_dict(path: str, mode: LoadMode = "mmap") -> Dict[str, Any]:
+    """Load a model file to the CPU, like comfy.utils.load_torch_file."""
+    if path.lower().endswith(SAFETENSORS_EXTENSIONS):
+        return load_safetensors(path, mode)
+
+    import torch
+
+    state_dict = None
+    if mode == "mmap":
+        try:
+            state_dict = torch.load(
+                path, map_location="cpu", mmap=True, weights_only=True
+            )
+        except RuntimeError as e:
+            # Files saved before the zip format can't be memory mapped
+            logger.info(f"Loading {path} without mmap: {e}")
+    if state_dict is None:
+        state_dict = torch.load(path, map_location="cpu", weights_only=True)
+    if "state_dict" in state_dict:
+        state_dict = state_dict["state_dict"]
+    return state_dict
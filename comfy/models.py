@@ -1,23 +1,88 @@
-from typing import Optional, Callable, Dict, Literal
-from pydantic import BaseModel
+import base64
+import time
+from typing import Awaitable, Optional, Callable, Dict, List, Literal
+from pydantic import BaseModel, Field, PrivateAttr, field_validator, model_validator
 from lib.exceptions import ComfyUIError
+from .binary_frames import PreviewMode
+
+
+class MediaInput(BaseModel):
+    """An input file of a workflow, e.g. the reference image of img2img.
+
+    Either the bytes of the file (base64 encoded in JSON), a URL to download it
+    from or the path of a file the worker can read, such as an upload the gateway
+    staged on a volume. Once ingested (see MediaIngest), `name` is the name
+    ComfyUI's loader nodes know the file by.
+    """
+
+    data: Optional[bytes] = None
+    url: Optional[str] = None
+    path: Optional[str] = None
+    filename: Optional[str] = None
+    _name: Optional[str] = PrivateAttr(None)
+
+    @field_validator("data", mode="before")
+    @classmethod
+    def decode_base64(cls, value):
+        if isinstance(value, str):
+            return base64.b64decode(value, validate=True)
+        return value
+
+    @model_validator(mode="after")
+    def check_source(self) -> "MediaInput":
+        if [self.data, self.url, self.path].count(None) != 2:
+            raise ValueError("Exactly one of data, url and path must be set")
+        return self
+
+    @property
+    def name(self) -> Optional[str]:
+        return self._name
+
+
+class ExecutionLimits(BaseModel):
+    """Bounds a client can set on the execution of its request."""
+
+    # Seconds the execution may take, counted from when the gateway received it
+    timeout: Optional[float] = Field(None, gt=0)
+    # Unix timestamp after which the result is no longer needed
+    deadline: Optional[float] = None
 
 
 class ExecutionData(BaseModel):
     prompt: Dict
     process_id: str
+    # Seconds the execution may take, counted from received_at
+    timeout: Optional[float] = None
+    # Unix timestamp after which the result is no longer needed
+    deadline: Optional[float] = None
+    received_at: float = Field(default_factory=time.time)
+    # Step previews passed to on_preview: every one, at most one per
+    # preview_interval seconds, or none
+    previews: PreviewMode = "none"
+    preview_interval: float = 1.0
+    # Throttling of on_progress, defaults to PROGRESS_MIN_INTERVAL and
+    # PROGRESS_MIN_DELTA of the server config
+    progress_interval: Optional[float] = None
+    progress_min_delta: Optional[float] = None
+
+
+# Callbacks may be plain functions or coroutine functions
+CallbackResult = Optional[Awaitable[None]]
 
 
 class ExecutionCallbacks(BaseModel):
-    on_error: Optional[Callable[[Dict], None]] = None
-    on_done: Optional[Callable[[Dict], None]] = None
-    on_progress: Optional[Callable[[str, Dict, Optional[str]], None]] = None
-    on_start: Optional[Callable[[Dict], None]] = None
+    on_error: Optional[Callable[[Dict], CallbackResult]] = None
+    on_done: Optional[Callable[[Dict], CallbackResult]] = None
+    on_progress: Optional[Callable[[str, Dict, Optional[str]], CallbackResult]] = None
+    on_start: Optional[Callable[[Dict], CallbackResult]] = None
+    # Images of SaveImageWebsocket nodes and step previews, called with the node id,
+    # a view on the received image and its format
+    on_output: Optional[Callable[[str, memoryview, str], CallbackResult]] = None
+    on_preview: Optional[Callable[[str, memoryview, str], CallbackResult]] = None
     on_ws_message: Optional[
         Callable[
             [
                 Literal[
-                    "binary",
                     "executing",
                     "execution_cached",
                     "execution_complete",
@@ -26,16 +91,84 @@ class ExecutionCallbacks(BaseModel):
                     "status",
                     "completed",
                 ],
-                Dict | bytes,
+                Dict,
             ],
-            None,
+            CallbackResult,
         ]
     ] = None
 
 
+class NodeSpan(BaseModel):
+    """Execution of a single node, times are in milliseconds since the job started."""
+
+    node: str
+    class_type: str
+    start: float
+    duration: float = 0
+    cached: bool = False
+    steps: Optional[int] = None
+
+
+class PromptOptimization(BaseModel):
+    """What the graph optimizer removed from a prompt."""
+
+    # Nodes of the prompt before the optimization
+    nodes: int
+    # Nodes no output depends on
+    pruned: List[str] = []
+    # Duplicate node id -> id of the identical node kept in its place
+    merged: Dict[str, str] = {}
+
+    @property
+    def removed(self) -> int:
+        return len(self.pruned) + len(self.merged)
+
+
 class ExecutionResult(BaseModel):
     prompt_id: str
     queue_duration: int
+    timeline: List[NodeSpan] = []
+    # Requests executed in the same prompt as this one, see ExecutionBatcher
+    batch_size: int = 1
+
+
+class StartupTimings(BaseModel):
+    """Duration of each ComfyUI startup phase in milliseconds."""
+
+    process_spawn: int
+    node_import: int
+    server_listen: int
+    first_response: int
+    total: int
+
+
+class PreloadTiming(BaseModel):
+    """Time it took to preload one model file."""
+
+    path: str
+    size: int
+    seconds: float
+    error: Optional[str] = None
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second"""
+        return self.size / self.seconds if self.seconds > 0 else 0
+
+
+class PreloadReport(BaseModel):
+    files: List[PreloadTiming] = []
+    # Wall time of the whole preload, files are loaded concurrently
+    seconds: float = 0
+
+    @property
+    def size(self) -> int:
+        return sum(timing.size for timing in self.files)
+
+    @property
+    def throughput(self) -> float:
+        """Aggregate bytes per second"""
+        return self.size / self.seconds if self.seconds > 0 else 0
 
 
 class PerformanceMetrics(BaseModel):
@@ -0,0 +1,111 @@
+import logging
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from .models import PreloadReport, PreloadTiming
+
+logger = logging.getLogger(__name__)
+
+WARM_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def advise_willneed(path: str) -> None:
+    """Ask the kernel to start reading a whole file into the page cache."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        # Not supported by every filesystem, the hint is only an optimization
+        pass
+    finally:
+        os.close(fd)
+
+
+def warm_page_cache(path: str, chunk_size: int = WARM_CHUNK_SIZE) -> int:
+    """Read a file through the page cache, for filesystems that ignore hints."""
+    buffer = bytearray(chunk_size)
+    total = 0
+    with open(path, "rb", buffering=0) as file:
+        while True:
+            read = file.readinto(buffer)
+            if not read:
+                return total
+            total += read
+
+
+class PreloadScheduler:
+    """Loads models on a pool of threads while the caller does something else.
+
+    Reads from network volumes are latency bound, so several files are read at
+    once. When started, every file gets a readahead hint so the kernel fetches
+    the ones still waiting for a thread. With `warm` each file is read through
+    the page cache before `load` is called, which makes memory mapped loads hit
+    warm pages. File reads release the GIL, so the pool overlaps with imports
+    running on the main thread.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str], None],
+        max_workers: int = 4,
+        warm: bool = False,
+    ):
+        self.load = load
+        self.warm = warm
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="preload"
+        )
+        self._futures: Dict[str, Future] = {}
+        self._started_at: Optional[float] = None
+
+    def start(self, paths: List[str]) -> "PreloadScheduler":
+        self._started_at = time.perf_counter()
+        for path in paths:
+            advise_willneed(path)
+        for path in paths:
+            self._futures[path] = self._pool.submit(self._preload, path)
+        return self
+
+    def _preload(self, path: str) -> PreloadTiming:
+        start_time = time.perf_counter()
+        try:
+            size = os.path.getsize(path)
+            if self.warm:
+                warm_page_cache(path)
+            self.load(path)
+        except Exception as e:
+            logger.error(f"Failed to preload {path}: {e}")
+            return PreloadTiming(
+                path=path,
+                size=0,
+                seconds=time.perf_counter() - start_time,
+                error=str(e),
+            )
+        timing = PreloadTiming(
+            path=path, size=size, seconds=time.perf_counter() - start_time
+        )
+        logger.info(
+            f"Preloaded {path} in {timing.seconds:.2f}s "
+            f"({timing.throughput / 1024**3:.2f} GB/s)"
+        )
+        return timing
+
+    def wait(self) -> PreloadReport:
+        """Wait for every file and report the throughput of each and in total."""
+        files = [future.result() for future in self._futures.values()]
+        self._pool.shutdown()
+        started_at = self._started_at or time.perf_counter()
+        report = PreloadReport(files=files, seconds=time.perf_counter() - started_at)
+        logger.info(
+            f"Preloaded {report.size / 1024**3:.2f} GB from {len(files)} files in "
+            f"{report.seconds:.2f}s ({report.throughput / 1024**3:.2f} GB/s)"
+        )
+        return report
@@ -0,0 +1,483 @@
+"""
+Validation of ComfyUI prompts against the node schemas of `/object_info`.
+
+ComfyUI only validates a prompt once it is queued, on a container that already
+booted. The schemas are captured once at image build (see capture_node_schemas)
+and stored as a compact index, so the API gateway can reject prompts ComfyUI
+would reject without starting a GPU container.
+
+The checks follow ComfyUI's own validation and report errors in the same shape
+as the `node_errors` of its /prompt route. The index can't see everything
+ComfyUI accepts, so some checks are left to ComfyUI:
+- Nodes that override VALIDATE_INPUTS can accept values their schema doesn't
+  list. Their classes are passed as `unchecked_classes`, only their links are
+  checked
+- Combo inputs listing model files (checkpoints, LoRAs) accept files added to the
+  models volume after the index was captured. Workers save a fresh index when
+  they start (see save_node_schemas), model names are checked against it while it
+  is newer than the model folders (see models_modified_at). Once a folder changed,
+  values missing from the options of model combos are left to ComfyUI
+"""
+
+import functools
+import json
+import logging
+import os
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from lib.exceptions import PromptValidationError
+from .config import ComfyConfig
+from .graph import is_link, upstream_nodes
+
+logger = logging.getLogger(__name__)
+
+NODE_SCHEMAS_PATH = "/root/node_schemas.json"
+
+SCHEMA_INDEX_VERSION = 1
+
+# Extensions of the model files ComfyUI lists in combo inputs, like
+# folder_paths.supported_pt_extensions
+MODEL_EXTENSIONS = (
+    ".ckpt",
+    ".pt",
+    ".pt2",
+    ".bin",
+    ".pth",
+    ".safetensors",
+    ".pkl",
+    ".sft",
+)
+
+# Scalar types ComfyUI converts literal values to before range checks
+NUMBER_TYPES = {"INT": int, "FLOAT": float}
+
+NodeErrors = Dict[str, Dict[str, Any]]
+
+
+def lists_model_files(options: Optional[FrozenSet]) -> bool:
+    """Whether combo options are files of a models folder, which can change after
+    the index is captured. An empty list is a folder without models yet."""
+    if options is None:
+        return False
+    return not options or any(
+        isinstance(option, str) and option.lower().endswith(MODEL_EXTENSIONS)
+        for option in options
+    )
+
+
+def models_modified_at(models_dir: str) -> float:
+    """
+    Latest modification time of the folders under a models directory, which
+    changes when model files are added to or removed from them. Hidden folders,
+    such as caches kept on the same volume, and the directory itself, which holds
+    the saved index, are left out. 0 if there are no folders.
+    """
+    latest = 0.0
+    for root, dirs, _ in os.walk(models_dir):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        if root != models_dir:
+            latest = max(latest, os.stat(root).st_mtime)
+    return latest
+
+
+class InputSchema:
+    __slots__ = ("type", "required", "options", "min", "max", "upload", "models")
+
+    def __init__(
+        self,
+        type: str,
+        required: bool = True,
+        options: Optional[List[Any]] = None,
+        min: Optional[float] = None,
+        max: Optional[float] = None,
+        upload: bool = False,
+    ):
+        self.type = type
+        self.required = required
+        self.options: Optional[FrozenSet] = (
+            frozenset(options) if options is not None else None
+        )
+        self.min = min
+        self.max = max
+        # Files uploaded at request time are not in the captured options
+        self.upload = upload
+        # Files of the models volume, which may have changed since the capture
+        self.models = lists_model_files(self.options)
+
+    @classmethod
+    def from_object_info(cls, spec: List[Any], required: bool) -> "InputSchema":
+        input_type, extra = spec[0], spec[1] if len(spec) > 1 else {}
+        extra = extra if isinstance(extra, dict) else {}
+        options = None
+        if isinstance(input_type, list):
+            # Old combo format, the options are the type
+            input_type, options = "COMBO", input_type
+        elif input_type == "COMBO":
+            options = extra.get("options")
+        upload = bool(
+            extra.get("image_upload") or extra.get("upload") or extra.get("remote")
+        )
+        return cls(
+            type=input_type,
+            required=required,
+            options=options,
+            min=extra.get("min"),
+            max=extra.get("max"),
+            upload=upload,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"type": self.type}
+        if not self.required:
+            data["required"] = False
+        if self.options is not None:
+            data["options"] = sorted(self.options, key=str)
+        for name in ("min", "max"):
+            if getattr(self, name) is not None:
+                data[name] = getattr(self, name)
+        if self.upload:
+            data["upload"] = True
+        return data
+
+
+class NodeSchema:
+    __slots__ = ("inputs", "outputs", "output_node")
+
+    def __init__(
+        self, inputs: Dict[str, InputSchema], outputs: List[str], output_node: bool
+    ):
+        self.inputs = inputs
+        self.outputs = outputs
+        self.output_node = output_node
+
+
+class NodeSchemaIndex:
+    """Input and output types of every node class ComfyUI has loaded."""
+
+    def __init__(self, nodes: Dict[str, NodeSchema]):
+        self.nodes = nodes
+
+    def __contains__(self, class_type: str) -> bool:
+        return class_type in self.nodes
+
+    def get(self, class_type: str) -> Optional[NodeSchema]:
+        return self.nodes.get(class_type)
+
+    @classmethod
+    def from_object_info(cls, object_info: Dict[str, Dict]) -> "NodeSchemaIndex":
+        nodes = {}
+        for class_type, info in object_info.items():
+            inputs = {}
+            for section, required in (("required", True), ("optional", False)):
+                for name, spec in (info.get("input", {}).get(section) or {}).items():
+                    inputs[name] = InputSchema.from_object_info(spec, required)
+            outputs = [
+                "COMBO" if isinstance(output, list) else output
+                for output in info.get("output", [])
+            ]
+            nodes[class_type] = NodeSchema(
+                inputs, outputs, bool(info.get("output_node"))
+            )
+        return cls(nodes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": SCHEMA_INDEX_VERSION,
+            "nodes": {
+                class_type: {
+                    "inputs": {
+                        name: spec.to_dict() for name, spec in node.inputs.items()
+                    },
+                    "outputs": node.outputs,
+                    "output_node": node.output_node,
+                }
+                for class_type, node in self.nodes.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "NodeSchemaIndex":
+        if data.get("version") != SCHEMA_INDEX_VERSION:
+            raise ValueError(
+                f"Unsupported node schema index version {data.get('version')}"
+            )
+        return cls(
+            {
+                class_type: NodeSchema(
+                    {
+                        name: InputSchema(**spec)
+                        for name, spec in node["inputs"].items()
+                    },
+                    node["outputs"],
+                    node["output_node"],
+                )
+                for class_type, node in data["nodes"].items()
+            }
+        )
+
+    def save(self, path: str = NODE_SCHEMAS_PATH) -> None:
+        # Written under a temporary name, other containers may read the file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.to_dict(), file, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = NODE_SCHEMAS_PATH) -> "NodeSchemaIndex":
+        with open(path, "r") as file:
+            return cls.from_dict(json.load(file))
+
+
+@functools.lru_cache(maxsize=None)
+def load_node_schemas(path: str = NODE_SCHEMAS_PATH) -> Optional[NodeSchemaIndex]:
+    """The index saved at build, loaded once per container. None if there is none."""
+    if not os.path.exists(path):
+        return None
+    return NodeSchemaIndex.load(path)
+
+
+def types_match(received: str, expected: str) -> bool:
+    """Whether an output type can be linked to an input, like ComfyUI's check."""
+    if received == expected or "*" in (received, expected):
+        return True
+    if not isinstance(received, str) or not isinstance(expected, str):
+        return False
+    # Comma separated types accept any of their types
+    return bool(set(received.split(",")) & set(expected.split(",")))
+
+
+def _error(type: str, message: str, details: str, **extra_info) -> Dict[str, Any]:
+    return {
+        "type": type,
+        "message": message,
+        "details": details,
+        "extra_info": extra_info,
+    }
+
+
+class PromptValidator:
+    """Checks prompts against a NodeSchemaIndex.
+
+    Like ComfyUI, every node must exist and only output nodes and the nodes they
+    depend on are validated: required inputs, links (source node, output index and
+    type), number ranges and combo values such as checkpoint names.
+
+    Only the links of nodes whose class is in `unchecked_classes` are validated, for
+    classes that validate their inputs themselves with VALIDATE_INPUTS.
+
+    Model names are rejected only while `check_models` is set, i.e. while the index
+    lists the current files of the model folders.
+    """
+
+    def __init__(
+        self,
+        index: NodeSchemaIndex,
+        unchecked_classes: Iterable[str] = (),
+        check_models: bool = True,
+    ):
+        self.index = index
+        self.unchecked_classes = frozenset(unchecked_classes)
+        self.check_models = check_models
+
+    def validate(
+        self, prompt: Dict[str, Dict], unchecked_classes: Iterable[str] = ()
+    ) -> Tuple[Optional[Dict[str, Any]], NodeErrors]:
+        """Return the prompt error, if any, and the errors of each node.
+
+        Args:
+            prompt: The prompt to validate
+            unchecked_classes: More classes to only check the links of, for this
+                prompt
+        """
+        unchecked = self.unchecked_classes.union(unchecked_classes)
+        for node_id, node in prompt.items():
+            class_type = node.get("class_type") if isinstance(node, dict) else None
+            if class_type is None:
+                return _error(
+                    "invalid_prompt",
+                    "Cannot execute because a node is missing the class_type property.",
+                    f"Node ID '#{node_id}'",
+                ), {}
+            if class_type not in self.index:
+                return _error(
+                    "invalid_prompt",
+                    f"Cannot execute because node {class_type} does not exist.",
+                    f"Node ID '#{node_id}'",
+                ), {}
+
+        outputs = [
+            node_id
+            for node_id, node in prompt.items()
+            if self.index.get(node["class_type"]).output_node
+        ]
+        if not outputs:
+            return _error("prompt_no_outputs", "Prompt has no outputs", ""), {}
+
+        node_errors: NodeErrors = {}
+        for node_id in upstream_nodes(prompt, outputs):
+            errors = self._validate_node(
+                prompt, node_id, prompt[node_id]["class_type"] in unchecked
+            )
+            if errors:
+                node_errors[node_id] = {
+                    "errors": errors,
+                    "class_type": prompt[node_id]["class_type"],
+                }
+        if node_errors:
+            return _error(
+                "prompt_outputs_failed_validation",
+                "Prompt outputs failed validation",
+                "",
+            ), node_errors
+        return None, {}
+
+    def check(
+        self, prompt: Dict[str, Dict], unchecked_classes: Iterable[str] = ()
+    ) -> None:
+        """
+        Raises:
+            PromptValidationError: If ComfyUI would reject the prompt
+        """
+        error, node_errors = self.validate(prompt, unchecked_classes)
+        if error is not None:
+            raise PromptValidationError(
+                error["message"], {"error": error, "node_errors": node_errors}
+            )
+
+    def _validate_node(
+        self, prompt: Dict[str, Dict], node_id: str, links_only: bool = False
+    ) -> List[Dict]:
+        node = prompt[node_id]
+        schema = self.index.get(node["class_type"])
+        inputs = node.get("inputs", {})
+        errors = []
+        for name, spec in schema.inputs.items():
+            if name not in inputs:
+                if spec.required:
+                    errors.append(
+                        _error(
+                            "required_input_missing",
+                            "Required input is missing",
+                            name,
+                            input_name=name,
+                        )
+                    )
+                continue
+            value = inputs[name]
+            if is_link(value):
+                error = self._validate_link(prompt, name, value, spec)
+            elif links_only:
+                continue
+            else:
+                error = self._validate_value(name, value, spec)
+            if error is not None:
+                errors.append(error)
+        return errors
+
+    def _validate_link(
+        self, prompt: Dict[str, Dict], name: str, link: List, spec: InputSchema
+    ) -> Optional[Dict]:
+        source_id, output_index = link
+        source = prompt.get(source_id)
+        if source is None:
+            return _error(
+                "bad_linked_input",
+                "Bad linked input, source node doesn't exist",
+                f"{name}, {source_id}",
+                input_name=name,
+            )
+        outputs = self.index.get(source["class_type"]).outputs
+        if not 0 <= output_index < len(outputs):
+            return _error(
+                "bad_linked_input",
+                "Bad linked input, output index out of range",
+                f"{name}, {source_id}, {output_index}",
+                input_name=name,
+            )
+        received = outputs[output_index]
+        if not types_match(received, spec.type):
+            return _error(
+                "return_type_mismatch",
+                "Return type mismatch between linked nodes",
+                f"{name}, received_type({received}) mismatch input_type({spec.type})",
+                input_name=name,
+                received_type=received,
+                linked_node=link,
+            )
+        return None
+
+    def _validate_value(
+        self, name: str, value: Any, spec: InputSchema
+    ) -> Optional[Dict]:
+        convert = NUMBER_TYPES.get(spec.type)
+        if convert is not None:
+            try:
+                value = convert(value)
+            except (TypeError, ValueError):
+                return _error(
+                    "invalid_input_type",
+                    f"Failed to convert an input value to a {spec.type} value",
+                    f"{name}, {value}",
+                    input_name=name,
+                )
+            if spec.min is not None and value < spec.min:
+                return _error(
+                    "value_smaller_than_min",
+                    f"Value {value} smaller than min of {spec.min}",
+                    f"{name}",
+                    input_name=name,
+                )
+            if spec.max is not None and value > spec.max:
+                return _error(
+                    "value_bigger_than_max",
+                    f"Value {value} bigger than max of {spec.max}",
+                    f"{name}",
+                    input_name=name,
+                )
+        elif spec.options is not None and not spec.upload:
+            try:
+                allowed = value in spec.options
+            except TypeError:
+                allowed = False
+            if not allowed and (self.check_models or not spec.models):
+                return _error(
+                    "value_not_in_list",
+                    "Value not in list",
+                    f"{name}: '{value}' not in list",
+                    input_name=name,
+                )
+        return None
+
+
+def save_node_schemas(server, output_path: str = NODE_SCHEMAS_PATH) -> None:
+    """Save the index of the node schemas of a running ComfyServer."""
+    config = server.config
+    response = server.http_session.get(
+        f"http://{config.SERVER_HOST}:{config.SERVER_PORT}/object_info",
+        timeout=config.HTTP_TIMEOUT,
+    )
+    response.raise_for_status()
+    index = NodeSchemaIndex.from_object_info(response.json())
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    index.save(output_path)
+    logger.info(f"Saved the schemas of {len(index.nodes)} nodes to {output_path}")
+
+
+def capture_node_schemas(output_path: str = NODE_SCHEMAS_PATH) -> None:
+    """
+    Start ComfyUI on the CPU, save the index of its node schemas and stop it.
+
+    Run at image build, after custom nodes are installed and models are in place,
+    so the combo options include the checkpoint and LoRA names.
+    """
+    from .server import ComfyServer
+
+    config = ComfyConfig(CPU_ONLY=True)
+    server = ComfyServer(config)
+    server.start()
+    try:
+        server.wait_until_ready()
+        save_node_schemas(server, output_path)
+    finally:
+        if server.process:
+            server.process.terminate()
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from .config import ComfyConfig
+from .graph import canonical_hash
+from .metrics import RESULT_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Suffix of the files entries are written to before being renamed into place
+TMP_SUFFIX = ".tmp"
+
+_CACHE_HITS = RESULT_CACHE_REQUESTS.labels("hit")
+_CACHE_MISSES = RESULT_CACHE_REQUESTS.labels("miss")
+
+
+class ResultCache:
+    """Content-addressed cache for the results of deterministic prompts.
+
+    Results are keyed by a canonical hash of the prompt, so any two requests that
+    produce the same prompt (same template, inputs and seed) share an entry. The
+    cache has two tiers:
+
+    - An in-memory LRU bounded by RESULT_CACHE_MEMORY_BYTES
+    - An optional directory, usually on a volume so containers share it, bounded by
+      RESULT_CACHE_DISK_BYTES with the least recently used files evicted first
+
+    Entries of both tiers expire after RESULT_CACHE_TTL seconds.
+
+    A read-only cache never writes to the directory: it neither removes expired
+    entries nor records the hits that drive eviction, and puts only fill the
+    memory tier. The gateway reads the directory of the workers this way, so
+    expiry and eviction are decided by the containers whose changes the volume
+    commits.
+    """
+
+    def __init__(self, config: ComfyConfig = None, read_only: bool = False):
+        config = config if config is not None else ComfyConfig()
+        self.memory_limit = config.RESULT_CACHE_MEMORY_BYTES
+        self.disk_limit = config.RESULT_CACHE_DISK_BYTES
+        self.ttl = config.RESULT_CACHE_TTL
+        self.directory = config.RESULT_CACHE_DIR
+        self.read_only = read_only
+        self._memory: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._memory_bytes = 0
+        # Estimated size of the disk tier, rescanned when it goes over the limit
+        self._disk_bytes: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(prompt: Dict) -> str:
+        return canonical_hash(prompt)
+
+    async def get(self, prompt: Dict) -> Optional[bytes]:
+        """Return the cached result of a prompt, or None."""
+        return await self.get_by_key(self.key(prompt))
+
+    async def get_by_key(self, key: str) -> Optional[bytes]:
+        """Return the cached result under a key from `key`, or None."""
+        value = self._memory_get(key)
+        if value is None and self.directory:
+            value = await asyncio.to_thread(self._disk_get, key)
+            if value is not None:
+                self._memory_put(key, value)
+        if value is None:
+            self.misses += 1
+            _CACHE_MISSES.inc()
+        else:
+            self.hits += 1
+            _CACHE_HITS.inc()
+        return value
+
+    async def put(self, prompt: Dict, value: bytes) -> None:
+        """Store the result of a prompt in both tiers."""
+        key = self.key(prompt)
+        self._memory_put(key, value)
+        if self.directory and not self.read_only:
+            try:
+                await asyncio.to_thread(self._disk_put, key, value)
+            except OSError as e:
+                logger.error(f"Failed to write result cache entry {key}: {e}")
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _memory_get(self, key: str) -> Optional[bytes]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        value, stored_at = entry
+        if self._expired(stored_at):
+            self._memory_remove(key)
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key: str, value: bytes) -> None:
+        if len(value) > self.memory_limit:
+            return
+        self._memory_remove(key)
+        self._memory[key] = (value, time.time())
+        self._memory_bytes += len(value)
+        while self._memory_bytes > self.memory_limit:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _memory_remove(self, key: str) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry[0])
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            if self._expired(os.stat(path).st_mtime):
+                if not self.read_only:
+                    os.remove(path)
+                return None
+            with open(path, "rb") as file:
+                value = file.read()
+            if not self.read_only:
+                # The access time drives LRU eviction, mtime is kept for the TTL
+                os.utime(path, (time.time(), os.stat(path).st_mtime))
+            return value
+        except FileNotFoundError:
+            return None
+
+    def _disk_put(self, key: str, value: bytes) -> None:
+        if len(value) > self.disk_limit:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A unique name, containers sharing the volume often have the same pid
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix=f".{key}.", suffix=TMP_SUFFIX
+        )
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        if self._disk_bytes is None:
+            self._disk_bytes = self._scan_disk_usage()[0]
+        else:
+            self._disk_bytes += len(value)
+        if self._disk_bytes > self.disk_limit:
+            self._evict_disk()
+
+    def _scan_disk_usage(self) -> Tuple[int, list]:
+        total = 0
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(TMP_SUFFIX):
+                    # Being written by another container
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                total += stat.st_size
+                entries.append((stat.st_atime, stat.st_mtime, stat.st_size, path))
+        return total, entries
+
+    def _evict_disk(self) -> None:
+        """Remove expired entries, then the least recently used ones, until under the limit."""
+        total, entries = self._scan_disk_usage()
+        entries.sort()
+        for accessed_at, modified_at, size, path in entries:
+            if total <= self.disk_limit and not self._expired(modified_at):
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._disk_bytes = total
@@ -1,3 +1,4 @@
+import os
 import subprocess
 import time
 import logging
@@ -6,15 +7,44 @@ import threading
 from .config import ComfyConfig
 from lib.utils import get_time_ms
 from lib.exceptions import ServerStartupError
-from lib.exceptions import ExecutionError
-from .models import ExecutionResult, QueuePromptData, ExecutionData, ExecutionCallbacks
-import json
+from lib.exceptions import ExecutionError, WebSocketError
+from .models import (
+    ExecutionResult,
+    QueuePromptData,
+    ExecutionData,
+    ExecutionCallbacks,
+    StartupTimings,
+)
 import asyncio
-import websocket
-from .job_progress import ComfyJobProgress, ComfyStatusLog
+from typing import Optional
+from .job_progress import ComfyJobProgress, ComfyStatusLog, ProgressEmitter
+from .websocket_router import ComfyWebSocketRouter
+from .client import ComfyClient
+from .callback_dispatcher import CallbackDispatcher
+from .binary_frames import (
+    OUTPUT_NODE_CLASSES,
+    PREVIEW_IMAGE,
+    PreviewFilter,
+    decode_image_frame,
+    frame_event,
+)
+from .timeline import NodeLatencyHistograms, NodeTimelineRecorder
+from . import metrics
 
 logger = logging.getLogger(__name__)
 
+# Lines ComfyUI prints once custom nodes are loaded and once it accepts connections
+NODES_IMPORTED_BANNER = "Starting server"
+LISTEN_BANNER = "To see the GUI go to"
+
+# Messages after which ComfyUI no longer works on a prompt
+TERMINAL_MESSAGE_TYPES = {
+    "execution_success",
+    "execution_error",
+    "execution_interrupted",
+    "websocket_closed",
+}
+
 
 class ComfyServer:
     """Manages ComfyUI server lifecycle."""
@@ -29,6 +59,15 @@ class ComfyServer:
         self.process = None
         self.is_ready = False
         self.is_executing = False
+        self.client = ComfyClient(self.config)
+        self.ws_router: ComfyWebSocketRouter = None
+        # Node durations of every execution on this server, by class_type
+        self.node_latencies = NodeLatencyHistograms()
+        # Used for the blocking readiness checks during container startup
+        self.http_session = requests.Session()
+        self.startup_timings: StartupTimings = None
+        self._startup_marks: dict[str, float] = {}
+        self._listening = threading.Event()
 
     def _build_command(
         self,
@@ -41,40 +80,24 @@ class ComfyServer:
             "--disable-metadata",
             "--listen",
         ]
-        # TODO: Maybe reference comfy's cli args file here as this can quickly become a mess
-        if self.config.GPU_ONLY:
-            command.append("--gpu-only")
-        elif self.config.HIGH_VRAM:
-            command.append("--high-vram")
-        elif self.config.CPU_ONLY:
-            command.append("--cpu")
+        command.extend(self.config.PERFORMANCE_PROFILE.to_args())
         return command
 
-    def queue_prompt(self, data: QueuePromptData):
-        import urllib
+    def _build_env(self) -> dict[str, str]:
+        """Environment of the ComfyUI process, with the profile's variables on top."""
+        return {**os.environ, **self.config.PERFORMANCE_PROFILE.env}
 
-        serialized = json.dumps(data).encode("utf-8")
-        req = urllib.request.Request(
-            f"http://{self.config.SERVER_HOST}:{self.config.SERVER_PORT}/prompt",
-            data=serialized,
-        )
-
-        try:
-            response = urllib.request.urlopen(req)
-            return json.loads(response.read())
-        except urllib.error.HTTPError as e:
-            if e.code == 400:
-                error_data = json.loads(e.read())
-                raise ValueError(
-                    f"Comfy error: {error_data.get('error', 'Unknown error')}, Node errors: {error_data.get('node_errors', {})}"
-                )
-            else:
-                raise Exception("Error while queueing prompt.")
+    async def queue_prompt(self, data: QueuePromptData):
+        """Queue a prompt on the ComfyUI server without blocking the event loop."""
+        return await self.client.queue_prompt(data)
 
     def start(self) -> None:
         """
         Start the ComfyUI server process.
 
+        The output of the process is watched for the banners ComfyUI prints while
+        booting, which are used to detect readiness and to time the startup phases.
+
         Raises:
             ServerStartupError: If the server process fails to start
         """
@@ -83,15 +106,21 @@ class ComfyServer:
                 logger.info("ComfyUI server already running, skipping start")
                 return
 
+            self._startup_marks = {"start": time.perf_counter()}
+            self._listening.clear()
             command = self._build_command()
             self.process = subprocess.Popen(
                 command,
                 cwd=self.config.COMFYUI_PATH,
+                env=self._build_env(),
                 stdout=subprocess.PIPE,
+                # ComfyUI logs to stderr, merge it so the banners can be watched
+                stderr=subprocess.STDOUT,
                 text=True,
                 bufsize=1,
                 universal_newlines=True,
             )
+            self._startup_marks["spawned"] = time.perf_counter()
         except Exception as e:
             raise ServerStartupError(
                 f"Failed to start ComfyUI server: {str(e)}",
@@ -102,39 +131,113 @@ class ComfyServer:
             for line in iter(stream.readline, ""):
                 if line.strip():
                     logger.info(f"{prefix}: {line.strip()}")
+                    if not self._listening.is_set():
+                        self._watch_startup_banner(line)
             stream.close()
 
         threading.Thread(
             target=stream_output, args=(self.process.stdout, "COMFY-OUT"), daemon=True
         ).start()
 
+    def _watch_startup_banner(self, line: str) -> None:
+        """Record the startup phase a line of ComfyUI output marks, if any."""
+        if NODES_IMPORTED_BANNER in line:
+            self._startup_marks.setdefault("nodes_imported", time.perf_counter())
+        elif LISTEN_BANNER in line:
+            self._startup_marks["listening"] = time.perf_counter()
+            self._listening.set()
+
     def wait_until_ready(self) -> bool:
         """
         Wait for server to become responsive.
 
+        Waits for the listen banner of the ComfyUI process and confirms it with a
+        request. Until the banner shows up the server is also polled with a backoff
+        that starts at SERVER_CHECK_MIN_DELAY and grows up to SERVER_CHECK_DELAY, in
+        case the banner is missed or the server was started elsewhere.
+
         Raises:
-            ServerStartupError: If the server fails to become responsive within timeout
+            ServerStartupError: If the server exits or fails to become responsive
+                within timeout
         """
         url = f"http://{self.config.SERVER_HOST}:{self.config.SERVER_PORT}"
-        deadline = time.time() + self.config.SERVER_TIMEOUT
-
-        while time.time() < deadline:
+        deadline = time.perf_counter() + self.config.SERVER_TIMEOUT
+        delay = self.config.SERVER_CHECK_MIN_DELAY
+
+        while time.perf_counter() < deadline:
+            if self.process is not None and self.process.poll() is not None:
+                raise ServerStartupError(
+                    f"ComfyUI server exited with code {self.process.returncode}",
+                    {"url": url},
+                )
             try:
-                response = requests.head(url)
+                response = self.http_session.head(
+                    url, timeout=self.config.HTTP_CONNECT_TIMEOUT
+                )
                 if response.status_code == 200:
-                    logger.info("ComfyUI server is reachable.")
+                    self._startup_marks["reachable"] = time.perf_counter()
+                    self.startup_timings = self._build_startup_timings()
+                    logger.info(
+                        f"ComfyUI server is reachable. Startup: {self.startup_timings}"
+                    )
+                    self._record_startup_metrics()
                     self.is_ready = True
                     return True
 
             except requests.RequestException:
                 pass
 
-            time.sleep(self.config.SERVER_CHECK_DELAY)
+            if self._listening.is_set():
+                time.sleep(self.config.SERVER_CHECK_MIN_DELAY)
+            elif not self._listening.wait(delay):
+                # The wait returns early as soon as the listen banner is seen
+                delay = min(delay * 2, self.config.SERVER_CHECK_DELAY)
         raise ServerStartupError(
             f"Server failed to start within {self.config.SERVER_TIMEOUT}s",
             {"url": url, "timeout": self.config.SERVER_TIMEOUT},
         )
 
+    def _record_startup_metrics(self) -> None:
+        metrics.COLD_STARTS.inc()
+        for phase, duration_ms in self.startup_timings.model_dump().items():
+            metrics.STARTUP_SECONDS.labels(phase).set(duration_ms / 1000)
+
+    def _build_startup_timings(self) -> StartupTimings:
+        marks = self._startup_marks
+        reachable = marks["reachable"]
+        start = marks.get("start", reachable)
+        spawned = marks.get("spawned", start)
+        listening = marks.get("listening", reachable)
+        nodes_imported = marks.get("nodes_imported", listening)
+
+        def elapsed_ms(begin: float, end: float) -> int:
+            return int(round((end - begin) * 1000))
+
+        return StartupTimings(
+            process_spawn=elapsed_ms(start, spawned),
+            node_import=elapsed_ms(spawned, nodes_imported),
+            server_listen=elapsed_ms(nodes_imported, listening),
+            first_response=elapsed_ms(listening, reachable),
+            total=elapsed_ms(start, reachable),
+        )
+
+    async def _get_ws_router(self) -> ComfyWebSocketRouter:
+        """Return the shared websocket router, connecting it on first use."""
+        if self.ws_router is None:
+            self.ws_router = ComfyWebSocketRouter(
+                f"ws://{self.config.SERVER_HOST}:{self.config.SERVER_PORT}/ws",
+                session=self.client.session,
+            )
+        await self.ws_router.ensure_connected()
+        return self.ws_router
+
+    async def close(self) -> None:
+        """Close the shared websocket connection and the HTTP connection pool."""
+        if self.ws_router is not None:
+            await self.ws_router.close()
+            self.ws_router = None
+        await self.client.close()
+
     async def execute(
         self,
         data: ExecutionData,
@@ -143,119 +246,84 @@ class ComfyServer:
         """
             Asynchronously execute a ComfyUI prompt with websocket-based monitoring and callbacks.
 
-        This function queues a prompt for execution and monitors its progress via websocket,
-        triggering appropriate callbacks at different stages of execution.
+        This function queues a prompt for execution and monitors its progress through the
+        shared websocket connection, triggering appropriate callbacks at different stages
+        of execution. Several executions can run concurrently on the same server.
+
+        The execution is bounded by the timeout of the request (or EXECUTION_TIMEOUT) and
+        by its deadline. When either expires, or the calling task is cancelled, the prompt
+        is removed from the ComfyUI queue or interrupted if it is already running.
+
+        Callbacks can be functions or coroutine functions. They are run in order on a
+        separate task behind a bounded queue (see CallbackDispatcher) and have all been
+        called when this returns.
 
         Args:
             data: ExecutionData containing prompt and execution metadata
             callbacks: ExecutionCallbacks instance containing callback functions
-            timeout: Maximum time to wait for execution in seconds
 
         Returns:
-            Dict containing execution results including prompt_id and process_id
+            ExecutionResult containing the prompt_id and the queueing duration
 
         Raises:
             Exception: If there's an error during prompt queuing or execution
-            asyncio.TimeoutError: If execution exceeds timeout
+            ExecutionError: If the execution times out or its deadline has passed
         """
-
-        execution_started = False
-        ws = None
+        prompt_id = None
+        ws_router = None
+        timeline = None
+        status = "error"
+        execute_started_at = time.perf_counter()
+        metrics.EXECUTIONS_IN_FLIGHT.inc()
+        # Callbacks run on their own task, a slow consumer never holds back the job
+        dispatcher = CallbackDispatcher(
+            callbacks, self.config.CALLBACK_QUEUE_SIZE, self.config.CALLBACK_OVERFLOW
+        )
+        callbacks = dispatcher.callbacks
 
         try:
-            comfy_job = ComfyJobProgress(data.prompt)
+            timeout = self.remaining_time(data)
+            if timeout is not None and timeout <= 0:
+                raise ExecutionError("Deadline exceeded before execution started")
+
+            comfy_job = ComfyJobProgress(data.prompt, self.node_latencies)
+            timeline = NodeTimelineRecorder(data.prompt)
+            # Connect before queueing so no message of the prompt can be missed
+            ws_router = await self._get_ws_router()
             queue_start_time = get_time_ms()
-            queue_response = self.queue_prompt(
-                {"prompt": data.prompt, "client_id": data.process_id}
+            queue_response = await self.queue_prompt(
+                {"prompt": data.prompt, "client_id": ws_router.client_id}
             )
             prompt_id = queue_response["prompt_id"]
             queue_end_time = get_time_ms()
             comfy_queue_duration = queue_end_time - queue_start_time
+            queued_at = time.perf_counter()
+            metrics.QUEUE_DEPTH.inc()
 
-            ws = websocket.WebSocket()
-            ws.connect(f"ws://localhost:8188/ws?clientId={data.process_id}")
-            result_future = asyncio.Future()
-
-            async def monitor_ws():
-                nonlocal execution_started
-
-                while True:
-                    try:
-                        # Use asyncio.to_thread for the blocking websocket receive
-                        out = await asyncio.to_thread(ws.recv)
-                        if not isinstance(out, str):
-                            if callbacks.on_ws_message:
-                                callbacks.on_ws_message("binary", out)
-                            continue
-
-                        message = json.loads(out)
-                        message_type = message.get("type", None)
-                        message_data = message.get("data", {})
-                        msg_prompt_id = message_data.get("prompt_id", None)
-
-                        # Skip irrelevant messages
-                        if prompt_id != msg_prompt_id or not comfy_job:
-                            continue
-
-                        if callbacks.on_ws_message:
-                            callbacks.on_ws_message(message_type, message_data)
-
-                        # Handle execution errors
-                        if message_type == "execution_error":
-                            if callbacks.on_error:
-                                callbacks.on_error(message.get("data", {}))
-                            raise Exception(
-                                message.get("data", {}).get(
-                                    "exception_message",
-                                    "Unknown Exception while executing the workflow",
-                                )
-                            )
-
-                        # Update job status
-                        comfy_job.add_status_log(
-                            ComfyStatusLog(msg_prompt_id).from_comfy_message(
-                                message_data
-                            )
-                        )
-
-                        # Handle execution progress
-                        if message["type"] == "executing":
-                            # Trigger start callback on first execution message
-                            if not execution_started and callbacks.on_start:
-                                callbacks.on_start({"process_id": data.process_id})
-                                execution_started = True
-
-                            if callbacks.on_progress:
-                                callbacks.on_progress(
-                                    "progress",
-                                    {"progress": comfy_job.getPercentage()},
-                                    None,
-                                )
-
-                            # Check for completion
-                            if message_data["node"] is None:
-                                if callbacks.on_done:
-                                    callbacks.on_done({"process_id": data.process_id})
-                                result_future.set_result(
-                                    ExecutionResult(
-                                        prompt_id=prompt_id,
-                                        queue_duration=comfy_queue_duration,
-                                    )
-                                )
-                                break
-                    except Exception as e:
-                        logger.error(f"Error in monitor_ws: {e}")
-                        if not result_future.done():
-                            result_future.set_exception(e)
-                        break
-
-            # Start monitoring task and wait for result with timeout
-            monitor_task = asyncio.create_task(monitor_ws())
+            messages = ws_router.subscribe(prompt_id)
             try:
-                return await result_future
+                await asyncio.wait_for(
+                    self._monitor_prompt(
+                        messages, comfy_job, timeline, data, callbacks
+                    ),
+                    self.remaining_time(data),
+                )
             except asyncio.TimeoutError:
-                monitor_task.cancel()
+                status = "timeout"
+                await self.cancel(prompt_id, messages)
                 raise ExecutionError("Execution timed out")
+            except asyncio.CancelledError:
+                status = "cancelled"
+                # Finish freeing the GPU even though the caller is gone
+                await asyncio.shield(self.cancel(prompt_id, messages))
+                raise
+            status = "success"
+            self._record_execution_metrics(timeline, queued_at)
+            return ExecutionResult(
+                prompt_id=prompt_id,
+                queue_duration=comfy_queue_duration,
+                timeline=timeline.spans,
+            )
 
         except Exception as e:
             if callbacks.on_error:
@@ -263,5 +331,194 @@ class ComfyServer:
             raise e
 
         finally:
-            if ws:
-                ws.close()
+            if ws_router and prompt_id:
+                ws_router.unsubscribe(prompt_id)
+                if timeline.execution_started_at is None:
+                    metrics.QUEUE_DEPTH.dec()
+            metrics.EXECUTIONS_IN_FLIGHT.dec()
+            metrics.EXECUTIONS.labels(status).inc()
+            metrics.TOTAL_SECONDS.observe(time.perf_counter() - execute_started_at)
+            # Results are only returned once the callbacks saw every event
+            await dispatcher.close(
+                self.config.CALLBACK_DRAIN_TIMEOUT, drain=status != "cancelled"
+            )
+
+    def _record_execution_metrics(
+        self, timeline: NodeTimelineRecorder, queued_at: float
+    ) -> None:
+        self.node_latencies.add_timeline(timeline.spans)
+        started_at = timeline.execution_started_at or queued_at
+        metrics.QUEUE_SECONDS.observe(started_at - queued_at)
+        metrics.EXECUTION_SECONDS.observe(time.perf_counter() - started_at)
+        for span in timeline.spans:
+            if not span.cached:
+                metrics.NODE_SECONDS.labels(span.class_type).observe(
+                    span.duration / 1000
+                )
+
+    def remaining_time(self, data: ExecutionData) -> Optional[float]:
+        """Seconds left for an execution, or None if it is not bounded."""
+        limits = []
+        timeout = (
+            data.timeout if data.timeout is not None else self.config.EXECUTION_TIMEOUT
+        )
+        if timeout is not None:
+            limits.append(timeout - (time.time() - data.received_at))
+        if data.deadline is not None:
+            limits.append(data.deadline - time.time())
+        return min(limits) if limits else None
+
+    async def cancel(
+        self, prompt_id: str, messages: Optional[asyncio.Queue] = None
+    ) -> None:
+        """
+        Remove a prompt from the ComfyUI queue, or interrupt it if it is running.
+
+        When the message queue of the prompt is given, waits up to
+        CANCEL_GRACE_PERIOD seconds for ComfyUI to confirm that it stopped.
+        """
+        try:
+            await self.client.delete_from_queue([prompt_id])
+            queue = await self.client.get_queue()
+            running = {item[1] for item in queue.get("queue_running", [])}
+            if prompt_id not in running:
+                logger.info(f"Removed prompt {prompt_id} from the queue")
+                return
+
+            await self.client.interrupt(prompt_id)
+            if messages is None:
+                return
+            await asyncio.wait_for(
+                self._wait_until_stopped(messages), self.config.CANCEL_GRACE_PERIOD
+            )
+            logger.info(f"Interrupted prompt {prompt_id}")
+        except asyncio.TimeoutError:
+            logger.error(
+                f"Prompt {prompt_id} did not stop within {self.config.CANCEL_GRACE_PERIOD}s of being interrupted"
+            )
+        except Exception as e:
+            logger.error(f"Failed to cancel prompt {prompt_id}: {e}")
+
+    async def _wait_until_stopped(self, messages: asyncio.Queue) -> None:
+        while True:
+            message_type, message_data = await messages.get()
+            if message_type in TERMINAL_MESSAGE_TYPES or (
+                message_type == "executing" and message_data.get("node") is None
+            ):
+                return
+
+    def _dispatch_image(
+        self,
+        data: bytes,
+        current_node: Optional[str],
+        class_types: dict[str, str],
+        previews: PreviewFilter,
+        callbacks: ExecutionCallbacks,
+    ) -> None:
+        """Pass a binary frame to on_output or on_preview, dropping unwanted previews."""
+        wants_previews = previews.enabled and callbacks.on_preview is not None
+        # Frames without metadata come from the executing node, so previews nobody
+        # wants are dropped without decoding them
+        if (
+            not wants_previews
+            and class_types.get(current_node) not in OUTPUT_NODE_CLASSES
+            and frame_event(data) == PREVIEW_IMAGE
+        ):
+            return
+        frame = decode_image_frame(data, current_node, class_types)
+        if frame is None:
+            return
+        if frame.is_output:
+            if callbacks.on_output:
+                callbacks.on_output(frame.node, frame.image, frame.image_format)
+        elif callbacks.on_preview and previews.accept():
+            callbacks.on_preview(frame.node, frame.image, frame.image_format)
+
+    async def _monitor_prompt(
+        self,
+        messages: asyncio.Queue,
+        comfy_job: ComfyJobProgress,
+        timeline: NodeTimelineRecorder,
+        data: ExecutionData,
+        callbacks: ExecutionCallbacks,
+    ) -> None:
+        """Consume the routed messages of a prompt until it finishes."""
+        execution_started = False
+        current_node = None
+        class_types = {
+            node_id: node.get("class_type") for node_id, node in data.prompt.items()
+        }
+        previews = PreviewFilter(data.previews, data.preview_interval)
+
+        progress = ProgressEmitter(
+            callbacks.on_progress,
+            data.progress_interval
+            if data.progress_interval is not None
+            else self.config.PROGRESS_MIN_INTERVAL,
+            data.progress_min_delta
+            if data.progress_min_delta is not None
+            else self.config.PROGRESS_MIN_DELTA,
+        )
+
+        try:
+            while True:
+                message_type, message_data = await messages.get()
+
+                if message_type == "binary":
+                    self._dispatch_image(
+                        message_data, current_node, class_types, previews, callbacks
+                    )
+                    continue
+
+                if message_type == "websocket_closed":
+                    raise WebSocketError(message_data["exception_message"])
+
+                was_started = timeline.execution_started_at is not None
+                timeline.record(message_type, message_data)
+                if not was_started and timeline.execution_started_at is not None:
+                    metrics.QUEUE_DEPTH.dec()
+
+                if callbacks.on_ws_message:
+                    callbacks.on_ws_message(message_type, message_data)
+
+                # Handle execution errors
+                if message_type == "execution_error":
+                    if callbacks.on_error:
+                        callbacks.on_error(message_data)
+                    raise ExecutionError(
+                        message_data.get(
+                            "exception_message",
+                            "Unknown Exception while executing the workflow",
+                        )
+                    )
+
+                # Update job status
+                comfy_job.add_status_log(
+                    ComfyStatusLog(message_data.get("prompt_id")).from_comfy_message(
+                        message_data
+                    )
+                )
+
+                # Steps of the running node refine the progress between nodes
+                if message_type == "progress":
+                    progress.update(comfy_job)
+
+                # Handle execution progress
+                if message_type == "executing":
+                    current_node = message_data.get("node")
+                    if current_node is None:
+                        comfy_job.finish()
+                    # Trigger start callback on first execution message
+                    if not execution_started and callbacks.on_start:
+                        callbacks.on_start({"process_id": data.process_id})
+                        execution_started = True
+
+                    progress.update(comfy_job)
+
+                    # Check for completion
+                    if message_data["node"] is None:
+                        if callbacks.on_done:
+                            callbacks.on_done({"process_id": data.process_id})
+                        return
+        finally:
+            progress.close()
@@ -0,0 +1,193 @@
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from .models import NodeSpan
+
+PERCENTILES = (50, 95, 99)
+
+# Messages that show ComfyUI took the prompt off its queue
+EXECUTION_STARTED = {"execution_start", "execution_cached", "executing"}
+
+
+def _median(samples) -> float:
+    ordered = sorted(samples)
+    return ordered[(len(ordered) - 1) // 2]
+
+
+class NodeTimelineRecorder:
+    """Turns the websocket messages of one job into a per-node timeline.
+
+    A node starts when an `executing` message names it and ends when the next
+    `executing` message (or the end of the job) arrives. Cached nodes are recorded
+    with a duration of 0 and sampler steps are taken from `progress` messages.
+
+    The recorder is created right before the prompt is queued, the time ComfyUI
+    started working on the prompt is kept in `execution_started_at`.
+    """
+
+    def __init__(self, prompt: Dict[str, Dict]):
+        self.prompt = prompt
+        self.spans: List[NodeSpan] = []
+        self._started_at = time.perf_counter()
+        self._current: Optional[NodeSpan] = None
+        self._current_started_at = 0.0
+        self.execution_started_at: Optional[float] = None
+
+    def _elapsed_ms(self, at: float) -> float:
+        return round((at - self._started_at) * 1000, 3)
+
+    def _class_type(self, node: str) -> str:
+        return self.prompt.get(node, {}).get("class_type", "unknown")
+
+    def record(self, message_type: str, message_data: Dict[str, Any]) -> None:
+        now = time.perf_counter()
+        if self.execution_started_at is None and message_type in EXECUTION_STARTED:
+            self.execution_started_at = now
+        if message_type == "executing":
+            self._close_current(now)
+            node = message_data.get("node")
+            if node is not None:
+                self._current = NodeSpan(
+                    node=node,
+                    class_type=self._class_type(node),
+                    start=self._elapsed_ms(now),
+                )
+                self._current_started_at = now
+        elif message_type == "execution_cached":
+            for node in message_data.get("nodes", []):
+                self.spans.append(
+                    NodeSpan(
+                        node=node,
+                        class_type=self._class_type(node),
+                        start=self._elapsed_ms(now),
+                        cached=True,
+                    )
+                )
+        elif message_type == "progress" and self._current is not None:
+            self._current.steps = message_data.get("max")
+        elif message_type in (
+            "execution_success",
+            "execution_error",
+            "execution_interrupted",
+        ):
+            self._close_current(now)
+
+    def _close_current(self, now: float) -> None:
+        if self._current is None:
+            return
+        self._current.duration = round((now - self._current_started_at) * 1000, 3)
+        self.spans.append(self._current)
+        self._current = None
+
+
+class NodeLatencyHistograms:
+    """Per class_type latency distribution of executed nodes across jobs.
+
+    Keeps the most recent `max_samples` durations of every class_type and computes
+    percentiles over them, so memory stays bounded on long running containers.
+
+    `prior` holds durations observed elsewhere, e.g. the merged histograms of the
+    workers that ran before this container. expected_duration falls back to it for
+    the class_types without samples here, it isn't part of snapshot or summary.
+    """
+
+    def __init__(self, max_samples: int = 1000):
+        self.max_samples = max_samples
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        # Duration per step of nodes that reported steps, e.g. samplers
+        self._step_samples: Dict[str, Deque[float]] = {}
+        self.prior: Optional["NodeLatencyHistograms"] = None
+
+    def observe(self, class_type: str, duration_ms: float) -> None:
+        samples = self._samples.get(class_type)
+        if samples is None:
+            samples = self._samples[class_type] = deque(maxlen=self.max_samples)
+            self._counts[class_type] = 0
+        samples.append(duration_ms)
+        self._counts[class_type] += 1
+
+    def add_timeline(self, spans: List[NodeSpan]) -> None:
+        for span in spans:
+            if not span.cached:
+                self.observe(span.class_type, span.duration)
+                if span.steps:
+                    samples = self._step_samples.get(span.class_type)
+                    if samples is None:
+                        samples = self._step_samples[span.class_type] = deque(
+                            maxlen=self.max_samples
+                        )
+                    samples.append(span.duration / span.steps)
+
+    def expected_duration(
+        self, class_type: str, steps: Optional[int] = None
+    ) -> Optional[float]:
+        """Median duration in ms of a node, scaled by its steps when known."""
+        if class_type not in self._samples and self.prior is not None:
+            return self.prior.expected_duration(class_type, steps)
+        if steps:
+            step_samples = self._step_samples.get(class_type)
+            if step_samples:
+                return _median(step_samples) * steps
+        samples = self._samples.get(class_type)
+        return _median(samples) if samples else None
+
+    def percentiles(self, class_type: str) -> Optional[Dict[str, float]]:
+        samples = self._samples.get(class_type)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        result = {
+            # Nearest-rank percentile
+            f"p{p}": ordered[max(0, math.ceil(len(ordered) * p / 100) - 1)]
+            for p in PERCENTILES
+        }
+        result["count"] = self._counts[class_type]
+        return result
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            class_type: self.percentiles(class_type) for class_type in self._samples
+        }
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Samples and counts by class_type, in plain types so other processes can
+        merge them."""
+        return {
+            class_type: {
+                "samples": list(samples),
+                "steps": list(self._step_samples.get(class_type, ())),
+                "count": self._counts[class_type],
+            }
+            for class_type, samples in self._samples.items()
+        }
+
+    @classmethod
+    def merge(
+        cls, snapshots: Iterable[Dict[str, Dict[str, Any]]], max_samples: int = 1000
+    ) -> "NodeLatencyHistograms":
+        """Histograms over the snapshots of several processes, e.g. every worker.
+
+        Each snapshot keeps up to `max_samples` of its samples, so a busy process
+        doesn't push the samples of the others out.
+        """
+        snapshots = list(snapshots)
+        merged = cls(max_samples * max(len(snapshots), 1))
+        for snapshot in snapshots:
+            for class_type, histogram in snapshot.items():
+                for duration_ms in histogram["samples"][-max_samples:]:
+                    merged.observe(class_type, duration_ms)
+                # Observing counted the samples, the total of the process is known
+                merged._counts[class_type] += histogram["count"] - min(
+                    len(histogram["samples"]), max_samples
+                )
+                if histogram["steps"]:
+                    step_samples = merged._step_samples.get(class_type)
+                    if step_samples is None:
+                        step_samples = merged._step_samples[class_type] = deque(
+                            maxlen=merged.max_samples
+                        )
+                    step_samples.extend(histogram["steps"][-max_samples:])
+        return merged
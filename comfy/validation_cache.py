@@ -0,0 +1,141 @@
+import inspect
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .graph import canonical_hash, downstream_nodes
+
+# Result of ComfyUI's validate_prompt: valid, error, outputs to execute, node errors
+ValidationResult = Tuple[bool, Optional[Dict], List[str], Dict]
+
+SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+def scalar_inputs(node: Dict) -> Dict[str, Tuple[type, Any]]:
+    """Scalar inputs of a node with their type, 1, 1.0 and True differ."""
+    return {
+        name: (type(value), value)
+        for name, value in node.get("inputs", {}).items()
+        if isinstance(value, SCALAR_TYPES)
+    }
+
+
+def validation_signature(prompt: Dict[str, Dict]) -> str:
+    """Hash of everything but the scalar inputs: node ids, classes, links and
+    non-scalar values."""
+    return canonical_hash(
+        {
+            node_id: [
+                node.get("class_type"),
+                {
+                    name: value
+                    for name, value in node.get("inputs", {}).items()
+                    if not isinstance(value, SCALAR_TYPES)
+                },
+            ]
+            for node_id, node in prompt.items()
+        }
+    )
+
+
+def partial_validator(execution) -> Optional[Callable]:
+    """ComfyUI's validate_inputs(prompt, item, validated), None if this version of
+    ComfyUI has another signature."""
+    validate_inputs = getattr(execution, "validate_inputs", None)
+    if validate_inputs is None or inspect.iscoroutinefunction(validate_inputs):
+        return None
+    if len(inspect.signature(validate_inputs).parameters) != 3:
+        return None
+    return validate_inputs
+
+
+class _CachedValidation:
+    __slots__ = ("outputs", "inputs")
+
+    def __init__(self, outputs: List[str], inputs: Dict[str, Dict[str, Tuple]]):
+        self.outputs = outputs
+        # Scalar inputs of every node that are known to be valid
+        self.inputs = inputs
+
+
+class PromptValidationCache:
+    """Remembers the prompts ComfyUI validated, by structure.
+
+    Prompts of the same template share their validation signature and differ in
+    scalar inputs only. When a prompt matches a validated one, only the nodes
+    whose scalar inputs changed, and the nodes depending on them, are validated
+    again. Every other node is handed to ComfyUI's validate_inputs as already
+    validated, so the outcome is the one of a full validation of the prompt.
+
+    Only prompts where every output is valid are remembered. Whenever a partial
+    validation finds an error, the whole prompt goes through validate_prompt so
+    the errors are reported exactly like ComfyUI does.
+    """
+
+    def __init__(self, max_size: int = 64):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.revalidated_nodes = 0
+        self._entries: OrderedDict[str, _CachedValidation] = OrderedDict()
+
+    def validate(
+        self,
+        prompt: Dict[str, Dict],
+        validate_prompt: Callable[[Dict], ValidationResult],
+        validate_inputs: Optional[Callable] = None,
+    ) -> ValidationResult:
+        if self.max_size <= 0 or validate_inputs is None:
+            return validate_prompt(prompt)
+
+        signature = validation_signature(prompt)
+        entry = self._entries.get(signature)
+        if entry is None:
+            self.misses += 1
+            return self._validate_all(signature, prompt, validate_prompt)
+
+        self.hits += 1
+        self._entries.move_to_end(signature)
+        changed = {
+            node_id
+            for node_id, node in prompt.items()
+            if scalar_inputs(node) != entry.inputs[node_id]
+        }
+        if changed:
+            stale = downstream_nodes(prompt, changed)
+            self.revalidated_nodes += len(stale)
+            validated = {
+                node_id: (True, [], node_id)
+                for node_id in prompt
+                if node_id not in stale
+            }
+            for output in entry.outputs:
+                if validate_inputs(prompt, output, validated)[0] is not True:
+                    return validate_prompt(prompt)
+            for node_id in changed:
+                entry.inputs[node_id] = scalar_inputs(prompt[node_id])
+        return True, None, list(entry.outputs), {}
+
+    def _validate_all(
+        self,
+        signature: str,
+        prompt: Dict[str, Dict],
+        validate_prompt: Callable[[Dict], ValidationResult],
+    ) -> ValidationResult:
+        result = validate_prompt(prompt)
+        valid, _, outputs, node_errors = result
+        if valid and not node_errors:
+            self._entries[signature] = _CachedValidation(
+                list(outputs),
+                {node_id: scalar_inputs(node) for node_id, node in prompt.items()},
+            )
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated_nodes": self.revalidated_nodes,
+        }
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
+
+import aiohttp
+
+from lib.exceptions import WebSocketError
+
+logger = logging.getLogger(__name__)
+
+# ComfyUI serializes messages with the default json separators, so the prompt id
+# can be located with a plain substring search before paying for a full parse.
+PROMPT_ID_MARKER = '"prompt_id": "'
+
+# Messages that arrive for a prompt before anyone subscribed to it (the job can
+# start before the /prompt response is processed) are kept in a small buffer.
+MAX_PENDING_PROMPTS = 32
+MAX_PENDING_MESSAGES = 1024
+
+
+def extract_prompt_id(message: str) -> Optional[str]:
+    """Return the prompt_id of a raw ComfyUI text message without parsing it."""
+    start = message.find(PROMPT_ID_MARKER)
+    if start == -1:
+        if '"prompt_id"' not in message:
+            return None
+        # Unusual formatting, fall back to a full parse
+        data = json.loads(message).get("data") or {}
+        return data.get("prompt_id")
+    start += len(PROMPT_ID_MARKER)
+    end = message.find('"', start)
+    return message[start:end] if end != -1 else None
+
+
+class ComfyWebSocketRouter:
+    """Holds a single websocket connection to ComfyUI and routes its messages.
+
+    One reader task consumes the socket and dispatches every message to the queue
+    of the prompt it belongs to. Text messages are matched on their prompt_id
+    before being decoded, binary frames are routed to the prompt that is currently
+    running since ComfyUI executes one prompt at a time.
+    """
+
+    def __init__(self, url: str, session: Optional[aiohttp.ClientSession] = None):
+        """
+        Args:
+            url: Websocket endpoint of the ComfyUI server, without the clientId query
+            session: Optional aiohttp session to share with other clients
+        """
+        self.client_id = f"modal-comfy-worker-{uuid.uuid4().hex}"
+        self.url = f"{url}?clientId={self.client_id}"
+        self.session = session
+        self._owns_session = session is None
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+        self._subscriptions: Dict[str, asyncio.Queue] = {}
+        self._pending: "OrderedDict[str, List[Union[str, bytes]]]" = OrderedDict()
+        self._running_prompt_id: Optional[str] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None and not self._ws.closed
+
+    async def ensure_connected(self) -> None:
+        """Open the websocket connection and start the reader task if needed."""
+        if self.connected:
+            return
+        async with self._connect_lock:
+            if self.connected:
+                return
+            if self.session is None or self.session.closed:
+                self.session = aiohttp.ClientSession()
+                self._owns_session = True
+            try:
+                self._ws = await self.session.ws_connect(
+                    self.url, heartbeat=30, max_msg_size=0
+                )
+            except aiohttp.ClientError as e:
+                raise WebSocketError(f"Failed to connect to ComfyUI websocket: {e}")
+            self._reader_task = asyncio.create_task(self._read_loop())
+            logger.info(f"Connected to ComfyUI websocket as {self.client_id}")
+
+    def subscribe(self, prompt_id: str) -> asyncio.Queue:
+        """Register a prompt and return the queue its messages will be put on.
+
+        Messages received for the prompt before this call are replayed first.
+        """
+        queue = asyncio.Queue()
+        self._subscriptions[prompt_id] = queue
+        for message in self._pending.pop(prompt_id, []):
+            if isinstance(message, str):
+                self._dispatch_text(message, prompt_id)
+            else:
+                queue.put_nowait(("binary", message))
+        return queue
+
+    def unsubscribe(self, prompt_id: str) -> None:
+        self._subscriptions.pop(prompt_id, None)
+        self._pending.pop(prompt_id, None)
+
+    async def close(self) -> None:
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._ws is not None:
+            await self._ws.close()
+            self._ws = None
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _read_loop(self) -> None:
+        ws = self._ws
+        try:
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    prompt_id = extract_prompt_id(msg.data)
+                    if prompt_id is not None:
+                        self._running_prompt_id = prompt_id
+                        self._dispatch_text(msg.data, prompt_id)
+                elif msg.type == aiohttp.WSMsgType.BINARY:
+                    self._dispatch_binary(msg.data)
+                elif msg.type == aiohttp.WSMsgType.ERROR:
+                    break
+        except Exception as e:
+            logger.error(f"Error in websocket reader: {e}")
+        finally:
+            if self._ws is ws:
+                self._ws = None
+            self._fail_subscriptions("Websocket connection to ComfyUI was closed")
+
+    def _dispatch_text(self, raw: str, prompt_id: str) -> None:
+        queue = self._subscriptions.get(prompt_id)
+        if queue is None:
+            self._buffer(prompt_id, raw)
+            return
+
+        message = json.loads(raw)
+        message_type = message.get("type", None)
+        message_data = message.get("data", {})
+        queue.put_nowait((message_type, message_data))
+
+    def _dispatch_binary(self, data: bytes) -> None:
+        prompt_id = self._running_prompt_id
+        if prompt_id is None:
+            return
+        queue = self._subscriptions.get(prompt_id)
+        if queue is None:
+            self._buffer(prompt_id, data)
+            return
+        queue.put_nowait(("binary", data))
+
+    def _buffer(self, prompt_id: str, message: Union[str, bytes]) -> None:
+        messages = self._pending.get(prompt_id)
+        if messages is None:
+            if len(self._pending) >= MAX_PENDING_PROMPTS:
+                self._pending.popitem(last=False)
+            messages = self._pending[prompt_id] = []
+        if len(messages) < MAX_PENDING_MESSAGES:
+            messages.append(message)
+
+    def _fail_subscriptions(self, reason: str) -> None:
+        for queue in self._subscriptions.values():
+            queue.put_nowait(("websocket_closed", {"exception_message": reason}))
@@ -1,4 +1,5 @@
 from modal import Secret, enter, App, Volume, method, exception, functions, asgi_app
+from ...comfy.config import ComfyConfig
 from ...comfy.experimental_server import ExperimentalComfyServer
 from ...lib.image import get_comfy_image
 from ...comfy.models import ExecutionCallbacks, ExecutionData
@@ -60,12 +61,16 @@ class ComfyWorkflow:
     def run_this_on_container_startup(self):
         self.web_app = FastAPI()
         self.server = ExperimentalComfyServer(
+            # Preloaded weights are read into process memory so they are part of
+            # the memory snapshot. Mapped ("mmap") weights would be read again
+            # from the volume after every restore
+            config=ComfyConfig(MODEL_LOAD_MODE="read"),
             preload_models=[
                 # You can optionally preload diffusion models to CPU memory.
                 # This is meant to reduce the inference time on containers with slow disk reads.
                 # "/root/ComfyUI/models/checkpoints/sd_xl_refiner_1.0.safetensors",
                 # "/root/ComfyUI/models/checkpoints/sd_xl_base_1.0.safetensors",
-            ]
+            ],
         )
 
     @method()
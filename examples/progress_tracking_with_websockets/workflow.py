@@ -7,6 +7,7 @@ import websocket
 from ...lib.logger import logger
 from ...lib.messaging import send_ws_message
 from ...lib.utils import get_time_ms
+import asyncio
 import os
 
 local_snapshot_path = os.path.join(os.path.dirname(__file__), "snapshot.json")
@@ -73,6 +74,19 @@ class ComfyWorkflow:
                 "Failed to establish websocket connection to server: {e}"
             )
 
+        async def on_progress(event, msg, sid):
+            # The ETA is in seconds, None until the first node started
+            logger.info(f"Job Progress: {msg['progress']}%, ETA: {msg['eta']}s")
+            if server_ws_connection:
+                # Sent from a thread so a slow server doesn't block the event loop,
+                # progress events are coalesced if it falls behind
+                await asyncio.to_thread(
+                    send_ws_message,
+                    server_ws_connection,
+                    "worker:job_progress",
+                    {"percentage": msg["progress"], "eta": msg["eta"]},
+                )
+
         try:
             # Define callbacks for execution monitoring
             callbacks = ExecutionCallbacks(
@@ -101,18 +115,7 @@ class ComfyWorkflow:
                         f"Job Completed for: Job ID {data.process_id}. Sending Completion Event."
                     ),
                 ),
-                on_progress=lambda event, msg, sid: (
-                    send_ws_message(
-                        server_ws_connection,
-                        "worker:job_progress",
-                        {
-                            "percentage": msg.get("percentage", 0),
-                        },
-                    )
-                    if server_ws_connection
-                    else None,
-                    logger.info(f"Job Progress: {msg.get('percentage', 0)}%"),
-                ),
+                on_progress=on_progress,
                 on_start=lambda msg: (
                     logger.info(
                         f"Execution start took: {get_time_ms() - job_start_time} ms"
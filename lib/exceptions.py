@@ -1,8 +1,9 @@
 class ComfyUIError(Exception):
     """Base exception for all ComfyUI related errors"""
 
-    def __init__(self, message: str):
+    def __init__(self, message: str, details: dict = None):
         super().__init__(message)
+        self.details = details or {}
 
 
 class ServerStartupError(ComfyUIError):
@@ -21,3 +22,18 @@ class WebSocketError(ComfyUIError):
     """Raised when there's an error with WebSocket communication"""
 
     pass
+
+
+class ComfyAPIError(ComfyUIError):
+    """Raised when the ComfyUI HTTP API responds with an error status"""
+
+    def __init__(self, message: str, status: int, body: str = None):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+
+
+class PromptValidationError(ComfyUIError):
+    """Raised when a prompt doesn't match the node schemas of ComfyUI"""
+
+    pass
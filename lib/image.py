@@ -1,13 +1,16 @@
 from modal import Image, Secret, Volume
 from typing import Optional, Callable
 from comfy.download_comfy import download_comfy
+from comfy.prompt_validation import capture_node_schemas as capture_schemas
 
 base_image = (
     Image.debian_slim(python_version="3.12")
     .apt_install("git", "wget")
     .pip_install(
         "websocket-client",
+        "aiohttp",
         "fastapi>=0.100.0",
+        "python-multipart",
         "pydantic>=2.0.0",
         "cupy-cuda12x",
         "requests",
@@ -42,6 +45,8 @@ def get_comfy_image(
     github_secret: Optional[Secret] = None,
     volume: Optional[Volume] = None,
     volume_updater: Optional[Callable] = None,
+    local_workflows_dir: Optional[str] = None,
+    capture_node_schemas: bool = False,
 ) -> Image:
     """
     Prepares a container image with ComfyUI setup and standardized file paths.
@@ -54,18 +59,31 @@ def get_comfy_image(
         local_snapshot_path: Path to the local snapshot.json file
         local_prompt_path: Path to the local prompt.json file
         github_secret: Optional GitHub secret for private repository access
+        volume: Optional volume the models are downloaded to
+        volume_updater: Optional function that downloads the models into the volume
+        local_workflows_dir: Optional folder of additional workflow templates, copied
+            to /root/workflows
+        capture_node_schemas: Save the node schemas of ComfyUI to
+            /root/node_schemas.json once the models are in place, used to validate
+            prompts before they reach a GPU container
 
     Returns:
         Image: Configured Modal container image with ComfyUI setup
     """
-    return (
+    image = (
         base_image.add_local_file(local_snapshot_path, "/root/snapshot.json", copy=True)
         .run_function(
             download_comfy, args=["/root/snapshot.json"], secrets=[github_secret]
         )
         .add_local_file(local_prompt_path, "/root/prompt.json", copy=True)
-        .run_commands(["rm -rf /root/ComfyUI/models"])
-        .run_function(volume_updater, volumes={"/volume": volume})
-        if volume_updater
-        else None
     )
+    if local_workflows_dir:
+        image = image.add_local_dir(local_workflows_dir, "/root/workflows", copy=True)
+    image = image.run_commands(["rm -rf /root/ComfyUI/models"])
+    if volume_updater:
+        image = image.run_function(volume_updater, volumes={"/volume": volume})
+    if capture_node_schemas:
+        # Mounted where ComfyUI looks for models so their names are in the schemas
+        volumes = {"/root/ComfyUI/models": volume} if volume else {}
+        image = image.run_function(capture_schemas, volumes=volumes)
+    return image
@@ -0,0 +1,279 @@
+"""
+Minimal metrics registry that renders the Prometheus text exposition format.
+
+Metrics are plain Python objects updated in place, so recording a value costs a
+dict lookup and an addition. Labelled metrics resolve their label values to a child
+once with `labels()`, which can be kept around on hot paths.
+
+The registries of several processes, e.g. every worker container, are combined by
+rendering merge_snapshots() of their snapshot().
+"""
+
+import bisect
+import math
+from typing import Any, Collection, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+
+    def labels(self, *values: str, **kwargs: str):
+        """Return the child metric for a combination of label values."""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self) -> "_Metric":
+        return type(self)(self.name, self.documentation)
+
+    def _samples(self) -> Iterable[Tuple["_Metric", Tuple[str, ...]]]:
+        if self.labelnames:
+            return [(child, key) for key, child in self._children.items()]
+        return [(self, ())]
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for child, key in self._samples():
+            lines.extend(child._render_sample(self.name, self.labelnames, key))
+        return lines
+
+    def _render_sample(self, name, labelnames, key) -> List[str]:
+        raise NotImplementedError
+
+    def _state(self) -> Any:
+        raise NotImplementedError
+
+    def _merge_state(self, state: Any) -> None:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def _render_sample(self, name, labelnames, key) -> List[str]:
+        labels = _format_labels(labelnames, key)
+        return [f"{name}{labels} {_format_value(self.value)}"]
+
+    def _state(self) -> float:
+        return self.value
+
+    def _merge_state(self, state: float) -> None:
+        self.value += state
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def _merge_state(self, state: float) -> None:
+        self.value = state
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # One slot per bucket plus the +Inf bucket, cumulated on render
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def _render_sample(self, name, labelnames, key) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            labels = _format_labels(labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, key)
+        lines.append(f"{name}_sum{labels} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+    def _state(self) -> List:
+        return [list(self.counts), self.sum]
+
+    def _merge_state(self, state: List) -> None:
+        counts, total = state
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.sum += total
+
+
+class MetricsRegistry:
+    """Holds metrics by name and renders them all in Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Iterable[str] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(
+        self, name: str, documentation: str, labelnames: Iterable[str] = ()
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Optional[Sequence[float]] = None,
+    ) -> Histogram:
+        return self._register(
+            Histogram(name, documentation, labelnames, buckets or DEFAULT_BUCKETS)
+        )
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """The metrics and their values in plain types, see merge_snapshots."""
+        return {
+            name: {
+                "type": metric.type_name,
+                "documentation": metric.documentation,
+                "labelnames": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "samples": [
+                    [list(key), child._state()] for child, key in metric._samples()
+                ],
+            }
+            for name, metric in self._metrics.items()
+        }
+
+
+def merge_snapshots(
+    snapshots: Dict[str, Dict[str, Dict[str, Any]]],
+    live: Optional[Collection[str]] = None,
+) -> MetricsRegistry:
+    """
+    Registry with the metrics of the snapshots of several processes, by process.
+
+    Counters and histograms are summed, so the totals only keep growing as long as
+    the snapshots of stopped processes are kept. Gauges have one series per process
+    under an extra `process` label, for the processes in `live` (all when None).
+    """
+    merged = MetricsRegistry()
+    for process, snapshot in snapshots.items():
+        for name, state in snapshot.items():
+            labelnames = state["labelnames"]
+            if state["type"] == "gauge":
+                if live is not None and process not in live:
+                    continue
+                metric = merged.gauge(
+                    name, state["documentation"], ["process", *labelnames]
+                )
+            elif state["type"] == "histogram":
+                metric = merged.histogram(
+                    name, state["documentation"], labelnames, state["buckets"]
+                )
+                if metric.buckets != tuple(sorted(state["buckets"])):
+                    # Recorded by another version, the counts can't be added up
+                    continue
+            else:
+                metric = merged.counter(name, state["documentation"], labelnames)
+            for key, value in state["samples"]:
+                if state["type"] == "gauge":
+                    key = [process, *key]
+                child = metric.labels(*key) if metric.labelnames else metric
+                child._merge_state(value)
+    return merged
+
+
+# Registry shared by the modules of a process
+REGISTRY = MetricsRegistry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
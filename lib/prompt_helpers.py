@@ -1,26 +1,21 @@
 def assign_values_if_path_exists(workflow: dict, values_to_assign: dict) -> None:
     """
-    Recursively assign values to workflow based on dot-notation paths.
+    Assign values to workflow based on dot-notation paths.
     Example paths:
     - "1.inputs.value"
     - "2.class_type.params.strength"
-    """
-
-    def assign_value(obj: dict, path: list[str], value: any) -> None:
-        """Recursively traverse the object and assign the value"""
-        if len(path) == 1:
-            obj[path[0]] = value
-            return
-
-        key = path[0]
-        if key not in obj:
-            raise ValueError(f"Invalid path segment '{key}' in object")
-
-        assign_value(obj[key], path[1:], value)
 
+    To build a prompt per request from the same workflow, prefer
+    lib.prompt_template.PromptTemplate, which doesn't need a copy of the workflow.
+    """
     for path, value in values_to_assign.items():
         try:
-            path_parts = path.split(".")
-            assign_value(workflow, path_parts, value)
+            *parents, last = path.split(".")
+            obj = workflow
+            for key in parents:
+                if key not in obj:
+                    raise ValueError(f"Invalid path segment '{key}' in object")
+                obj = obj[key]
+            obj[last] = value
         except (KeyError, TypeError) as e:
             raise ValueError(f"Invalid path: {path}. Error: {str(e)}")
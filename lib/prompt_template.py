@@ -0,0 +1,89 @@
+import json
+import threading
+from typing import Any, Dict, Tuple
+
+
+class PromptTemplate:
+    """A ComfyUI workflow parsed once and rendered into a prompt per request.
+
+    Override paths use the dot notation of assign_values_if_path_exists
+    ("6.inputs.text") and are compiled into the node id and the keys leading to the
+    value the first time they are used. Rendering copies only the nodes a request
+    changes, every other node of the returned prompt is the template's own dict.
+    Prompts are only serialized and sent to ComfyUI, so sharing the unchanged nodes
+    is safe as long as callers don't modify prompts in place.
+    """
+
+    def __init__(self, workflow: Dict[str, Dict]):
+        self.workflow = workflow
+        self._paths: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+
+    @classmethod
+    def from_file(cls, path: str) -> "PromptTemplate":
+        with open(path, "r") as file:
+            return cls(json.load(file))
+
+    def compile_path(self, path: str) -> Tuple[str, Tuple[str, ...]]:
+        """
+        Split and validate a dot-notation path against the template.
+
+        Raises:
+            ValueError: If a segment before the last one doesn't exist
+        """
+        compiled = self._paths.get(path)
+        if compiled is not None:
+            return compiled
+
+        node_id, *keys = path.split(".")
+        if node_id not in self.workflow:
+            raise ValueError(f"Invalid path: {path}. Unknown node '{node_id}'")
+        obj = self.workflow[node_id]
+        for key in keys[:-1]:
+            if not isinstance(obj, dict) or key not in obj:
+                raise ValueError(f"Invalid path segment '{key}' in path {path}")
+            obj = obj[key]
+        if keys and not isinstance(obj, dict):
+            raise ValueError(f"Invalid path: {path}. Only objects can be assigned to")
+
+        compiled = self._paths[path] = (node_id, tuple(keys))
+        return compiled
+
+    def render(self, values: Dict[str, Any]) -> Dict[str, Dict]:
+        """Return a prompt with the values assigned, leaving the template untouched."""
+        prompt = dict(self.workflow)
+        # Objects already copied for this prompt, by id of the template's object
+        copied: Dict[int, dict] = {}
+
+        for path, value in values.items():
+            node_id, keys = self.compile_path(path)
+            if not keys:
+                # The whole node is replaced
+                prompt[node_id] = value
+                continue
+            source = self.workflow[node_id]
+            target = copied.get(id(source))
+            if target is None:
+                target = copied[id(source)] = prompt[node_id] = dict(source)
+            for key in keys[:-1]:
+                source = source[key]
+                child = copied.get(id(source))
+                if child is None:
+                    child = copied[id(source)] = target[key] = dict(source)
+                target = child
+            target[keys[-1]] = value
+        return prompt
+
+
+_templates: Dict[str, PromptTemplate] = {}
+_templates_lock = threading.Lock()
+
+
+def load_template(path: str) -> PromptTemplate:
+    """Return the template of a workflow file, parsing it on first use only."""
+    template = _templates.get(path)
+    if template is None:
+        with _templates_lock:
+            template = _templates.get(path)
+            if template is None:
+                template = _templates[path] = PromptTemplate.from_file(path)
+    return template
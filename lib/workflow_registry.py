@@ -0,0 +1,91 @@
+from typing import Any, Callable, Dict, List, Type, Union
+
+from pydantic import BaseModel
+
+from .prompt_template import PromptTemplate, load_template
+
+
+class WorkflowDefinition(BaseModel):
+    """A named workflow: its template, its input model and how inputs map onto it."""
+
+    name: str
+    template_path: str
+    input_model: Type[BaseModel]
+    # Returns the dot-notation paths of the template to override for an input
+    build_values: Callable[[Any], Dict[str, Any]]
+    # Check prompts against the node schemas in the gateway
+    validate_prompt: bool = True
+    # Node classes with a VALIDATE_INPUTS of their own, only their links are checked
+    unchecked_classes: List[str] = []
+
+    @property
+    def template(self) -> PromptTemplate:
+        """The parsed template, loaded on first use and cached per container."""
+        return load_template(self.template_path)
+
+    def parse_input(self, payload: Union[BaseModel, Dict]) -> BaseModel:
+        """
+        Validate a payload against the input model of the workflow.
+
+        Raises:
+            pydantic.ValidationError: If the payload doesn't match the input model
+        """
+        if isinstance(payload, self.input_model):
+            return payload
+        if isinstance(payload, BaseModel):
+            payload = payload.model_dump()
+        return self.input_model.model_validate(payload)
+
+    def construct_prompt(self, payload: Union[BaseModel, Dict]) -> Dict:
+        return self.template.render(self.build_values(self.parse_input(payload)))
+
+
+class WorkflowRegistry:
+    """Named workflows served by a single deployment.
+
+    Registering a workflow only records where its template is, templates are parsed
+    the first time a request uses them.
+    """
+
+    def __init__(self):
+        self._workflows: Dict[str, WorkflowDefinition] = {}
+
+    def register(
+        self,
+        name: str,
+        template_path: str,
+        input_model: Type[BaseModel],
+        build_values: Callable[[Any], Dict[str, Any]],
+        validate_prompt: bool = True,
+        unchecked_classes: List[str] = [],
+    ) -> WorkflowDefinition:
+        if name in self._workflows:
+            raise ValueError(f"Workflow {name} is already registered")
+        workflow = self._workflows[name] = WorkflowDefinition(
+            name=name,
+            template_path=template_path,
+            input_model=input_model,
+            build_values=build_values,
+            validate_prompt=validate_prompt,
+            unchecked_classes=unchecked_classes,
+        )
+        return workflow
+
+    def get(self, name: str) -> WorkflowDefinition:
+        """
+        Raises:
+            KeyError: If no workflow is registered under the name
+        """
+        workflow = self._workflows.get(name)
+        if workflow is None:
+            raise KeyError(f"Unknown workflow {name}")
+        return workflow
+
+    def names(self) -> List[str]:
+        return list(self._workflows)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._workflows
+
+    def construct_prompt(self, name: str, payload: Union[BaseModel, Dict]) -> Dict:
+        return self.get(name).construct_prompt(payload)
@@ -1,28 +1,55 @@
-import json
-import copy
-from pydantic import BaseModel
-from lib.prompt_helpers import assign_values_if_path_exists
+from comfy.models import ExecutionLimits
+from lib.workflow_registry import WorkflowRegistry
 
+PROMPT_PATH = "/root/prompt.json"
+# Extra workflow templates, copied from the local `workflows/` folder
+WORKFLOWS_DIR = "/root/workflows"
 
-class WorkflowInput(BaseModel):
+DEFAULT_WORKFLOW = "default"
+
+
+# Inherits the optional `timeout` and `deadline` a request may set
+class WorkflowInput(ExecutionLimits):
     prompt: str
 
 
+# Every workflow served by the app. Register more templates with their own input
+# model and mapping, e.g.
+#
+#   class UpscaleInput(BaseModel):
+#       image: MediaInput
+#       scale: float = 2.0
+#
+#   WORKFLOWS.register(
+#       "upscale",
+#       f"{WORKFLOWS_DIR}/upscale.json",
+#       UpscaleInput,
+#       lambda input: {"1.inputs.image": input.image.name, "3.inputs.scale_by": input.scale},
+#   )
+#
+# MediaInput fields (from comfy.models) are stored in ComfyUI's input folder before
+# the prompt is built, `name` is then the file name to give to a LoadImage node.
+# The gateway reads `timeout` and `deadline` from every payload, whether the input
+# model declares them or not.
+#
+# The gateway checks prompts against the node schemas of ComfyUI before a worker
+# runs them. Pass `unchecked_classes=["MyNode"]` for custom nodes that accept values
+# their schema doesn't list (VALIDATE_INPUTS), or `validate_prompt=False` to leave
+# the whole workflow to ComfyUI.
+WORKFLOWS = WorkflowRegistry()
+
+WORKFLOWS.register(
+    DEFAULT_WORKFLOW,
+    PROMPT_PATH,
+    WorkflowInput,
+    lambda input: {"6.inputs.text": input.prompt},
+)
+
+
 def construct_workflow_prompt(input: WorkflowInput) -> dict:
     """
     Generate a keyframe prompt based on the provided settings.
     """
-    # Read the workflow JSON file fresh for each call
-    with open("/root/prompt.json", "r") as file:
-        source_workflow = json.load(file)
-
-    # Clone the workflow to avoid mutating the original object
-    workflow = copy.deepcopy(source_workflow)
-
-    # Define values to assign
-    values_to_assign = {"6.inputs.text": input.prompt}
-
-    # Assign all values to the workflow
-    assign_values_if_path_exists(workflow, values_to_assign)
-
-    return workflow
+    # The workflow is parsed once per container, each call only copies the
+    # nodes it changes
+    return WORKFLOWS.construct_prompt(DEFAULT_WORKFLOW, input)
@@ -0,0 +1,215 @@
+import asyncio
+
+from comfy.batching import ExecutionBatcher, batch_key, combine_prompts
+from comfy.callback_dispatcher import invoke
+from comfy.config import ComfyConfig
+from comfy.graph import topological_order
+from comfy.models import ExecutionCallbacks, ExecutionData, ExecutionResult
+from comfy.server import ComfyServer
+from lib.exceptions import ExecutionError
+
+
+def prompt(text="a cat", seed=1):
+    return {
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a"}},
+        "5": {
+            "class_type": "EmptyLatentImage",
+            "inputs": {"width": 64, "height": 64, "batch_size": 1},
+        },
+        "6": {
+            "class_type": "CLIPTextEncode",
+            "inputs": {"text": text, "clip": ["4", 1]},
+        },
+        "7": {
+            "class_type": "CLIPTextEncode",
+            "inputs": {"text": "blurry", "clip": ["4", 1]},
+        },
+        "3": {
+            "class_type": "KSampler",
+            "inputs": {
+                "seed": seed,
+                "model": ["4", 0],
+                "positive": ["6", 0],
+                "negative": ["7", 0],
+                "latent_image": ["5", 0],
+            },
+        },
+        "9": {"class_type": "SaveImageWebsocket", "inputs": {"images": ["3", 0]}},
+    }
+
+
+class FakeServer:
+    """Runs the nodes of a prompt in order, the image of each output node names the
+    text and seed of the sampler it saves."""
+
+    def __init__(self, delay=0.0):
+        self.config = ComfyConfig(BATCH_MAX_SIZE=4, BATCH_MAX_WAIT_MS=20)
+        self.prompts = []
+        self.delay = delay
+
+    remaining_time = ComfyServer.remaining_time
+
+    async def execute(self, data, callbacks=ExecutionCallbacks()):
+        self.prompts.append(data.prompt)
+        await asyncio.sleep(self.delay)
+        if callbacks.on_start:
+            await invoke(callbacks.on_start, {"process_id": data.process_id})
+        nodes = data.prompt
+        for node_id in topological_order(nodes):
+            if callbacks.on_ws_message:
+                await invoke(callbacks.on_ws_message, "executing", {"node": node_id})
+            if nodes[node_id]["class_type"] == "SaveImageWebsocket":
+                sampler = nodes[nodes[node_id]["inputs"]["images"][0]]["inputs"]
+                text = nodes[sampler["positive"][0]]["inputs"]["text"]
+                image = f"{text}/{sampler['seed']}".encode()
+                await invoke(callbacks.on_output, node_id, memoryview(image), "png")
+        if callbacks.on_done:
+            await invoke(callbacks.on_done, {"process_id": data.process_id})
+        return ExecutionResult(prompt_id="p", queue_duration=0)
+
+
+class Request:
+    def __init__(self, text="a cat", seed=1, **data):
+        self.data = ExecutionData(
+            prompt=prompt(text, seed), process_id=f"{text}/{seed}", **data
+        )
+        self.images, self.messages, self.done = [], [], []
+        self.callbacks = ExecutionCallbacks(
+            on_output=lambda node, image, image_format: self.images.append(
+                (node, bytes(image).decode())
+            ),
+            on_ws_message=lambda message_type, msg: self.messages.append(msg["node"]),
+            on_done=self.done.append,
+        )
+
+
+def execute_all(batcher, requests):
+    async def run():
+        return await asyncio.gather(
+            *(batcher.execute(request.data, request.callbacks) for request in requests)
+        )
+
+    return asyncio.run(run())
+
+
+def test_batch_key_ignores_literals():
+    assert batch_key(prompt("a cat", 1)) == batch_key(prompt("a dog", 2))
+    other = {**prompt(), "9": {"class_type": "PreviewImage", "inputs": {}}}
+    assert batch_key(prompt()) != batch_key(other)
+
+
+def test_combined_prompt_merges_the_nodes_branches_share():
+    combined, merged = combine_prompts([prompt("a cat", 1), prompt("a dog", 1)])
+
+    # The loader, the empty latent and the negative prompt run once
+    assert merged == {"1:4": "0:4", "1:5": "0:5", "1:7": "0:7"}
+    assert combined["1:6"]["inputs"] == {"text": "a dog", "clip": ["0:4", 1]}
+    assert combined["1:3"]["inputs"]["positive"] == ["1:6", 0]
+    assert combined["1:3"]["inputs"]["negative"] == ["0:7", 0]
+    assert sorted(combined) == ["0:3", "0:4", "0:5", "0:6", "0:7", "0:9"] + [
+        "1:3",
+        "1:6",
+        "1:9",
+    ]
+
+
+def test_each_request_gets_the_images_of_its_own_prompt_and_seed():
+    server = FakeServer()
+    requests = [Request("a cat", 1), Request("a dog", 2), Request("a cat", 3)]
+
+    results = execute_all(ExecutionBatcher(server), requests)
+
+    assert len(server.prompts) == 1
+    assert [request.images for request in requests] == [
+        [("9", "a cat/1")],
+        [("9", "a dog/2")],
+        [("9", "a cat/3")],
+    ]
+    assert [result.batch_size for result in results] == [3, 3, 3]
+    assert [request.done for request in requests] == [
+        [{"process_id": request.data.process_id}] for request in requests
+    ]
+
+
+def test_identical_requests_share_their_sampler_but_not_their_output():
+    server = FakeServer()
+    requests = [Request("a cat", 1), Request("a cat", 1)]
+
+    execute_all(ExecutionBatcher(server), requests)
+
+    assert sorted(server.prompts[0]) == ["0:3", "0:4", "0:5", "0:6", "0:7"] + [
+        "0:9",
+        "1:9",
+    ]
+    assert [request.images for request in requests] == [[("9", "a cat/1")]] * 2
+
+
+def test_messages_go_to_the_requests_their_node_runs_for():
+    server = FakeServer()
+    cat, dog = Request("a cat", 1), Request("a dog", 2)
+
+    execute_all(ExecutionBatcher(server), [cat, dog])
+
+    # Under their own ids, merged nodes for both
+    for request in (cat, dog):
+        assert sorted(request.messages) == ["3", "4", "5", "6", "7", "9"]
+
+
+def test_different_workflows_run_separately():
+    server = FakeServer()
+    cat, other = Request(), Request()
+    other.data.prompt["8"] = {"class_type": "PreviewImage", "inputs": {}}
+
+    execute_all(ExecutionBatcher(server), [cat, other])
+
+    assert len(server.prompts) == 2
+    assert cat.images == other.images == [("9", "a cat/1")]
+
+
+def test_full_batch_runs_without_waiting():
+    server = FakeServer()
+    batcher = ExecutionBatcher(server, max_batch_size=2, max_wait_ms=10_000)
+    requests = [Request(seed=seed) for seed in range(3)]
+
+    async def run():
+        tasks = [
+            asyncio.create_task(batcher.execute(request.data, request.callbacks))
+            for request in requests
+        ]
+        await asyncio.wait_for(asyncio.gather(*tasks[:2]), 1)
+        tasks[2].cancel()
+
+    asyncio.run(run())
+
+    assert len(server.prompts) == 1
+    # The two samplers and their outputs, the rest is shared
+    assert len(server.prompts[0]) == 8
+
+
+def test_batch_size_of_one_passes_through():
+    server = FakeServer()
+    request = Request()
+
+    execute_all(ExecutionBatcher(server, max_batch_size=1), [request])
+
+    assert server.prompts == [request.data.prompt]
+    assert request.images == [("9", "a cat/1")]
+
+
+def test_request_times_out_on_its_own():
+    server = FakeServer(delay=0.5)
+    batcher = ExecutionBatcher(server, max_wait_ms=1)
+    short, long = Request(seed=1, timeout=0.1), Request(seed=2)
+
+    async def run():
+        return await asyncio.gather(
+            batcher.execute(short.data, short.callbacks),
+            batcher.execute(long.data, long.callbacks),
+            return_exceptions=True,
+        )
+
+    timed_out, result = asyncio.run(run())
+
+    assert isinstance(timed_out, ExecutionError)
+    assert result.batch_size == 2
+    assert long.images == [("9", "a cat/2")]
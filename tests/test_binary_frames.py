@@ -0,0 +1,127 @@
+import json
+import struct
+
+from comfy.binary_frames import (
+    PREVIEW_IMAGE,
+    PREVIEW_IMAGE_WITH_METADATA,
+    TEXT,
+    PreviewFilter,
+    decode_image_frame,
+    frame_event,
+)
+from comfy.models import ExecutionCallbacks
+from comfy.server import ComfyServer
+
+CLASS_TYPES = {"3": "KSampler", "9": "SaveImageWebsocket"}
+
+
+def image_frame(image=b"image", image_format=2):
+    return struct.pack(">II", PREVIEW_IMAGE, image_format) + image
+
+
+def metadata_frame(metadata, image=b"image"):
+    encoded = json.dumps(metadata).encode()
+    return (
+        struct.pack(">II", PREVIEW_IMAGE_WITH_METADATA, len(encoded)) + encoded + image
+    )
+
+
+def test_image_frame_comes_from_the_executing_node():
+    frame = decode_image_frame(image_frame(image_format=1), "3", CLASS_TYPES)
+
+    assert (frame.node, frame.image_format, bytes(frame.image)) == (
+        "3",
+        "jpeg",
+        b"image",
+    )
+    assert not frame.is_output
+
+
+def test_metadata_frame_names_its_node_and_format():
+    data = metadata_frame({"node_id": "9", "image_type": "image/webp"})
+
+    frame = decode_image_frame(data, "3", CLASS_TYPES)
+
+    assert (frame.node, frame.image_format, bytes(frame.image)) == (
+        "9",
+        "webp",
+        b"image",
+    )
+    assert frame.is_output
+
+
+def test_image_is_a_view_on_the_frame():
+    data = bytearray(image_frame(b"before"))
+
+    frame = decode_image_frame(data, "9", CLASS_TYPES)
+    data[-6:] = b"after!"
+
+    assert isinstance(frame.image, memoryview)
+    assert frame.image.obj is data
+    assert bytes(frame.image) == b"after!"
+
+
+def test_malformed_and_short_frames_are_ignored():
+    truncated = metadata_frame({"node_id": "9"})[:12]
+    not_json = struct.pack(">II", PREVIEW_IMAGE_WITH_METADATA, 3) + b"{{{image"
+    not_an_object = metadata_frame([1, 2])
+    text = struct.pack(">II", TEXT, 0) + b"text"
+
+    for data in (b"", b"\x00\x00", b"\x00\x00\x00\x01", truncated, not_json):
+        assert decode_image_frame(data, "3", CLASS_TYPES) is None
+    assert decode_image_frame(not_an_object, "3", CLASS_TYPES) is None
+    assert decode_image_frame(text, "3", CLASS_TYPES) is None
+    assert frame_event(b"\x00\x00") is None
+    assert frame_event(text) == TEXT
+
+
+def dispatch(frames, current_node, previews, on_preview=True):
+    outputs, preview_images = [], []
+    callbacks = ExecutionCallbacks(
+        on_output=lambda node, image, image_format: outputs.append(
+            (node, bytes(image))
+        ),
+        on_preview=(
+            lambda node, image, image_format: preview_images.append(
+                (node, bytes(image))
+            )
+        )
+        if on_preview
+        else None,
+    )
+    server = ComfyServer()
+    for data in frames:
+        server._dispatch_image(data, current_node, CLASS_TYPES, previews, callbacks)
+    return outputs, preview_images
+
+
+def test_output_frames_go_to_on_output_whatever_the_previews():
+    frames = [image_frame(b"result"), metadata_frame({"node_id": "9"}, b"metadata")]
+
+    for previews in (PreviewFilter("none"), PreviewFilter("all")):
+        outputs, preview_images = dispatch(frames, "9", previews)
+        assert outputs == [("9", b"result"), ("9", b"metadata")]
+        assert preview_images == []
+
+
+def test_preview_frames_go_to_on_preview_when_wanted():
+    frames = [image_frame(b"step 1"), metadata_frame({"node_id": "3"}, b"step 2")]
+
+    assert dispatch(frames, "3", PreviewFilter("all")) == (
+        [],
+        [("3", b"step 1"), ("3", b"step 2")],
+    )
+    assert dispatch(frames, "3", PreviewFilter("none")) == ([], [])
+    assert dispatch(frames, "3", PreviewFilter("all"), on_preview=False) == ([], [])
+    # Throttled to one per interval
+    assert dispatch(frames, "3", PreviewFilter("throttle", 60)) == (
+        [],
+        [("3", b"step 1")],
+    )
+
+
+def test_output_with_metadata_is_routed_while_a_preview_node_executes():
+    # A SaveImageWebsocket frame with metadata, sent while the sampler is executing
+    frames = [metadata_frame({"node_id": "9"}, b"result")]
+
+    assert dispatch(frames, "3", PreviewFilter("none")) == ([("9", b"result")], [])
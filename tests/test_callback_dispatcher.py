@@ -0,0 +1,165 @@
+import asyncio
+
+from comfy.callback_dispatcher import CallbackDispatcher
+from comfy.models import ExecutionCallbacks
+
+
+class SlowConsumer:
+    """Records the events it receives, blocked until `release` is set."""
+
+    def __init__(self):
+        self.events = []
+        self.release = asyncio.Event()
+
+    async def record(self, name, *args):
+        await self.release.wait()
+        self.events.append((name, *args))
+
+    def callbacks(self, **overrides):
+        names = ("on_start", "on_output", "on_preview", "on_progress", "on_done")
+        callbacks = {
+            name: (lambda *args, name=name: self.record(name, *args)) for name in names
+        }
+        callbacks["on_ws_message"] = lambda *args: self.record("on_ws_message", *args)
+        return ExecutionCallbacks(**{**callbacks, **overrides})
+
+
+def fill(callbacks, count):
+    for value in range(count):
+        callbacks.on_ws_message("executing", {"node": str(value)})
+
+
+def test_slow_consumer_drops_previews_and_messages():
+    async def run():
+        consumer = SlowConsumer()
+        dispatcher = CallbackDispatcher(consumer.callbacks(), max_size=2)
+        callbacks = dispatcher.callbacks
+        fill(callbacks, 3)
+        callbacks.on_preview("9", b"preview", "jpeg")
+        callbacks.on_output("9", b"image", "png")
+        callbacks.on_done({"process_id": "a"})
+        consumer.release.set()
+        await dispatcher.close()
+        return consumer.events, dispatcher.dropped
+
+    events, dropped = asyncio.run(run())
+
+    assert dropped == 2
+    assert [event[0] for event in events] == [
+        "on_ws_message",
+        "on_ws_message",
+        "on_output",
+        "on_done",
+    ]
+
+
+def test_progress_is_coalesced_per_kind():
+    async def run():
+        consumer = SlowConsumer()
+        dispatcher = CallbackDispatcher(consumer.callbacks(), max_size=2)
+        callbacks = dispatcher.callbacks
+        callbacks.on_progress("progress", {"percentage": 1}, None)
+        callbacks.on_ws_message("progress", {"value": 1})
+        for value in range(2, 5):
+            callbacks.on_progress("progress", {"percentage": value}, None)
+            callbacks.on_ws_message("progress", {"value": value})
+        consumer.release.set()
+        await dispatcher.close()
+        return consumer.events, dispatcher.coalesced
+
+    events, coalesced = asyncio.run(run())
+
+    # One event of each kind waited, it was updated to the latest value
+    assert coalesced == 6
+    assert events == [
+        ("on_progress", "progress", {"percentage": 4}, None),
+        ("on_ws_message", "progress", {"value": 4}),
+    ]
+
+
+def test_progress_is_dropped_with_the_drop_policy():
+    async def run():
+        consumer = SlowConsumer()
+        dispatcher = CallbackDispatcher(consumer.callbacks(), 1, "drop")
+        callbacks = dispatcher.callbacks
+        for value in range(3):
+            callbacks.on_progress("progress", {"percentage": value}, None)
+        consumer.release.set()
+        await dispatcher.close()
+        return consumer.events, dispatcher.dropped
+
+    events, dropped = asyncio.run(run())
+
+    assert dropped == 2
+    assert events == [("on_progress", "progress", {"percentage": 0}, None)]
+
+
+def test_close_drains_queued_events():
+    async def run():
+        consumer = SlowConsumer()
+        dispatcher = CallbackDispatcher(consumer.callbacks())
+        dispatcher.callbacks.on_start({"process_id": "a"})
+        dispatcher.callbacks.on_done({"process_id": "a"})
+        asyncio.get_running_loop().call_later(0.01, consumer.release.set)
+        await dispatcher.close(timeout=1)
+        # Events after close are ignored
+        dispatcher.callbacks.on_done({"process_id": "b"})
+        await asyncio.sleep(0)
+        return consumer.events
+
+    events = asyncio.run(run())
+
+    assert events == [
+        ("on_start", {"process_id": "a"}),
+        ("on_done", {"process_id": "a"}),
+    ]
+
+
+def test_close_without_drain_discards_queued_events():
+    async def run():
+        consumer = SlowConsumer()
+        dispatcher = CallbackDispatcher(consumer.callbacks())
+        dispatcher.callbacks.on_start({"process_id": "a"})
+        dispatcher.callbacks.on_done({"process_id": "a"})
+        await asyncio.sleep(0)
+        await dispatcher.close(drain=False)
+        consumer.release.set()
+        await asyncio.sleep(0)
+        return consumer.events
+
+    assert asyncio.run(run()) == []
+
+
+def test_plain_and_coroutine_callbacks_run_in_order():
+    events = []
+
+    async def on_start(msg):
+        await asyncio.sleep(0.01)
+        events.append("start")
+
+    def on_output(node, image, image_format):
+        events.append("output")
+
+    def on_error(msg):
+        raise RuntimeError("broken consumer")
+
+    async def run():
+        dispatcher = CallbackDispatcher(
+            ExecutionCallbacks(
+                on_start=on_start,
+                on_output=on_output,
+                on_error=on_error,
+                on_done=lambda msg: events.append("done"),
+            )
+        )
+        callbacks = dispatcher.callbacks
+        callbacks.on_start({})
+        callbacks.on_output("9", b"image", "png")
+        # A failing callback doesn't stop the ones after it
+        callbacks.on_error({})
+        callbacks.on_done({})
+        await dispatcher.close()
+
+    asyncio.run(run())
+
+    assert events == ["start", "output", "done"]
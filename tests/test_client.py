@@ -0,0 +1,154 @@
+import asyncio
+import socket
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from benchmarks.fake_comfy_server import FakeComfyServer
+from comfy.client import ComfyClient
+from comfy.config import ComfyConfig
+from lib.exceptions import ComfyAPIError
+
+PROMPT = {"1": {"class_type": "EmptyLatentImage", "inputs": {}}}
+
+
+class FlakyFakeServer(FakeComfyServer):
+    """Fake ComfyUI failing the first requests of a route, as set in `failures`:
+    "503" answers with a gateway error, "disconnect" drops the connection."""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.requests = []
+
+    def _fail(self, route):
+        self.requests.append(route)
+        pending = self.failures.get(route)
+        return pending.pop(0) if pending else None
+
+    async def _respond(self, route, request, handler):
+        failure = self._fail(route)
+        if failure == "503":
+            return web.Response(status=503)
+        if failure == "disconnect":
+            request.transport.close()
+            raise asyncio.CancelledError
+        return await handler(request)
+
+    async def handle_get_queue(self, request):
+        return await self._respond("GET /queue", request, super().handle_get_queue)
+
+    async def handle_prompt(self, request):
+        return await self._respond("POST /prompt", request, super().handle_prompt)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def client_for(port, backoff=0.01):
+    return ComfyClient(
+        ComfyConfig(SERVER_PORT=port, HTTP_MAX_RETRIES=2, HTTP_RETRY_BACKOFF=backoff)
+    )
+
+
+def run_against_fake_server(failures, test):
+    """Run `test(client)` against a fake ComfyUI, returns its result or error and
+    the routes of the requests the fake received."""
+    fake = FlakyFakeServer(failures)
+
+    async def run():
+        runner = web.AppRunner(fake.create_app())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        client = client_for(runner.addresses[0][1])
+        try:
+            return await test(client)
+        except Exception as e:
+            return e
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    return asyncio.run(run()), fake.requests
+
+
+def test_idempotent_requests_are_retried_on_gateway_errors():
+    result, requests = run_against_fake_server(
+        {"GET /queue": ["503", "503"]}, lambda client: client.get_queue()
+    )
+
+    assert result == {"queue_running": [], "queue_pending": []}
+    assert requests == ["GET /queue"] * 3
+
+
+def test_idempotent_requests_give_up_after_the_retries():
+    error, requests = run_against_fake_server(
+        {"GET /queue": ["503"] * 3}, lambda client: client.get_queue()
+    )
+
+    assert isinstance(error, ComfyAPIError) and error.status == 503
+    assert requests == ["GET /queue"] * 3
+
+
+def test_idempotent_requests_are_retried_on_dropped_connections():
+    result, requests = run_against_fake_server(
+        {"GET /queue": ["disconnect"]}, lambda client: client.get_queue()
+    )
+
+    assert result == {"queue_running": [], "queue_pending": []}
+    assert requests == ["GET /queue"] * 2
+
+
+def test_prompts_are_not_queued_twice():
+    for failure, error_type in (
+        ("503", ComfyAPIError),
+        ("disconnect", aiohttp.ServerDisconnectedError),
+    ):
+        error, requests = run_against_fake_server(
+            {"POST /prompt": [failure]},
+            lambda client: client.queue_prompt({"prompt": PROMPT}),
+        )
+
+        # ComfyUI may have queued the prompt before failing
+        assert isinstance(error, error_type)
+        assert requests == ["POST /prompt"]
+
+
+def test_prompts_are_retried_when_the_connection_is_refused():
+    port = free_port()
+    fake = FlakyFakeServer({})
+
+    async def run():
+        client = client_for(port, backoff=0.5)
+        # ComfyUI starts listening while the client backs off
+        queued = asyncio.create_task(client.queue_prompt({"prompt": PROMPT}))
+        await asyncio.sleep(0.005)
+        runner = web.AppRunner(fake.create_app())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        try:
+            return await queued
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    result = asyncio.run(run())
+
+    assert result["number"] == 1
+    assert fake.requests == ["POST /prompt"]
+
+
+def test_connection_errors_are_raised_after_the_retries():
+    async def run():
+        client = client_for(free_port())
+        try:
+            await client.queue_prompt({"prompt": PROMPT})
+        finally:
+            await client.close()
+
+    with pytest.raises(aiohttp.ClientConnectorError):
+        asyncio.run(run())
@@ -0,0 +1,111 @@
+import pytest
+from pydantic import ValidationError
+
+from comfy.config import (
+    AttentionBackend,
+    CacheMode,
+    ComfyConfig,
+    ComfyPerformanceProfile,
+    PreviewMethod,
+    VramMode,
+)
+from comfy.server import ComfyServer
+
+
+def test_empty_profile_adds_no_arguments():
+    assert ComfyPerformanceProfile().to_args() == []
+    assert ComfyConfig().PERFORMANCE_PROFILE == ComfyPerformanceProfile()
+
+
+def test_every_field_maps_onto_its_argument():
+    profile = ComfyPerformanceProfile(
+        vram_mode=VramMode.HIGH,
+        reserve_vram=1.5,
+        cache_mode=CacheMode.LRU,
+        cache_size=8,
+        preview_method=PreviewMethod.NONE,
+        fast=["fp16_accumulation"],
+        attention=AttentionBackend.SAGE,
+        disable_smart_memory=True,
+        extra_args=["--deterministic"],
+    )
+
+    assert profile.to_args() == [
+        "--highvram",
+        "--reserve-vram",
+        "1.5",
+        "--cache-lru",
+        "8",
+        "--preview-method",
+        "none",
+        "--fast",
+        "fp16_accumulation",
+        "--use-sage-attention",
+        "--disable-smart-memory",
+        "--deterministic",
+    ]
+    assert ComfyPerformanceProfile(cache_mode=CacheMode.NONE, fast=True).to_args() == [
+        "--cache-none",
+        "--fast",
+    ]
+
+
+def test_profile_round_trips_through_its_serialized_form():
+    profile = ComfyPerformanceProfile.preset("throughput")
+
+    restored = ComfyPerformanceProfile.model_validate(profile.model_dump(mode="json"))
+
+    assert restored == profile
+    assert restored.to_args() == profile.to_args()
+
+
+def test_invalid_profiles_are_rejected():
+    invalid = [
+        {"cache_mode": "lru"},
+        {"cache_mode": "classic", "cache_size": 8},
+        {"cache_size": 8},
+        {"cache_mode": "lru", "cache_size": 0},
+        {"reserve_vram": -1},
+        {"vram_mode": "turbo"},
+        {"attention": "xformers"},
+    ]
+
+    for fields in invalid:
+        with pytest.raises(ValidationError):
+            ComfyPerformanceProfile(**fields)
+
+
+def test_presets_are_copies_looked_up_by_name():
+    config = ComfyConfig(PERFORMANCE_PROFILE="low_latency")
+    config.PERFORMANCE_PROFILE.env["OMP_NUM_THREADS"] = "1"
+
+    assert config.PERFORMANCE_PROFILE.vram_mode == VramMode.GPU_ONLY
+    assert "OMP_NUM_THREADS" not in ComfyPerformanceProfile.preset("low_latency").env
+    with pytest.raises(ValidationError, match="Unknown performance preset"):
+        ComfyConfig(PERFORMANCE_PROFILE="fastest")
+
+
+def test_vram_shorthands_set_the_vram_mode():
+    assert "--highvram" in ComfyConfig(HIGH_VRAM=True).PERFORMANCE_PROFILE.to_args()
+    assert ComfyConfig(CPU_ONLY=True).PERFORMANCE_PROFILE.vram_mode == VramMode.CPU
+    # Agreeing with the profile is fine
+    config = ComfyConfig(GPU_ONLY=True, PERFORMANCE_PROFILE="low_latency")
+    assert config.PERFORMANCE_PROFILE.vram_mode == VramMode.GPU_ONLY
+
+    with pytest.raises(ValidationError, match="mutually exclusive"):
+        ComfyConfig(GPU_ONLY=True, CPU_ONLY=True)
+    with pytest.raises(ValidationError, match="conflicts"):
+        ComfyConfig(CPU_ONLY=True, PERFORMANCE_PROFILE="throughput")
+
+
+def test_server_passes_the_profile_to_comfyui():
+    server = ComfyServer(
+        ComfyConfig(
+            PERFORMANCE_PROFILE=ComfyPerformanceProfile(
+                preview_method=PreviewMethod.AUTO, env={"OMP_NUM_THREADS": "4"}
+            )
+        )
+    )
+
+    assert server._build_command()[-2:] == ["--preview-method", "auto"]
+    assert server._build_env()["OMP_NUM_THREADS"] == "4"
@@ -0,0 +1,103 @@
+import asyncio
+import importlib
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPT = {"1": {"class_type": "SaveImage", "inputs": {"images": ["2", 0]}}}
+
+
+@pytest.fixture
+def comfy(monkeypatch):
+    """ComfyUI's nodes and execution modules, with validation blocking on an event"""
+    pytest.importorskip("torch")
+    nodes = types.ModuleType("nodes")
+    nodes.interrupted = []
+    nodes.interrupt_processing = nodes.interrupted.append
+    execution = types.ModuleType("execution")
+    execution.validating = threading.Event()
+    execution.release = threading.Event()
+
+    def validate_prompt(prompt):
+        execution.validating.set()
+        execution.release.wait(5)
+        return True, None, ["1"], {}
+
+    execution.validate_prompt = validate_prompt
+    utils = types.ModuleType("comfy.utils")
+    utils.load_torch_file = lambda path, **kwargs: {}
+    monkeypatch.setitem(sys.modules, "nodes", nodes)
+    monkeypatch.setitem(sys.modules, "execution", execution)
+    # The comfy package of the repository shadows the one of ComfyUI
+    monkeypatch.setitem(sys.modules, "comfy.utils", utils)
+    monkeypatch.setattr(importlib.import_module("comfy"), "utils", utils, raising=False)
+    return nodes, execution
+
+
+@pytest.fixture
+def experimental_server(monkeypatch):
+    # The modules import ..lib, the repository is deployed as a package
+    package = types.ModuleType("deployed")
+    package.__path__ = [ROOT]
+    monkeypatch.setitem(sys.modules, "deployed", package)
+    return importlib.import_module("deployed.comfy.experimental_server")
+
+
+class FakeExecutor:
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.server = types.SimpleNamespace(on_send_sync=None)
+        self.executed = []
+
+    def execute(self, prompt, prompt_id, extra_data, execute_outputs):
+        # Like ComfyUI's PromptExecutor, the flag is cleared before the start
+        self.nodes.interrupt_processing(False)
+        self.server.on_send_sync("execution_start", {"prompt_id": prompt_id})
+        self.executed.append(prompt_id)
+
+
+def make_server(experimental_server, nodes):
+    return experimental_server.ExperimentalComfyServer(
+        experimental_server.ComfyConfig(VALIDATION_CACHE_SIZE=0),
+        executor=FakeExecutor(nodes),
+    )
+
+
+def test_cancel_during_validation_skips_execution(comfy, experimental_server):
+    nodes, execution = comfy
+    server = make_server(experimental_server, nodes)
+    data = experimental_server.ExecutionData(prompt=PROMPT, process_id="a")
+
+    async def cancel_while_validating():
+        task = asyncio.create_task(server.execute(data))
+        await asyncio.get_running_loop().run_in_executor(
+            None, execution.validating.wait, 5
+        )
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_while_validating())
+    execution.release.set()
+    asyncio.run(server.close())
+
+    assert server.executor.executed == []
+    assert server.pending_jobs == 0
+
+
+def test_cancel_before_start_interrupts_again(comfy, experimental_server):
+    nodes, _ = comfy
+    server = make_server(experimental_server, nodes)
+    posted = []
+    job = types.SimpleNamespace(
+        cancelled=True, post=lambda *message: posted.append(message)
+    )
+
+    server._send_sync(job, "execution_start", {"prompt_id": "a"})
+
+    assert nodes.interrupted == [True]
+    assert posted == [("execution_start", {"prompt_id": "a"})]
@@ -0,0 +1,94 @@
+from comfy.graph_optimizer import optimize_prompt
+from comfy.prompt_validation import NodeSchemaIndex
+
+PROMPT = {
+    "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a"}},
+    "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "x", "clip": ["1", 1]}},
+    "3": {"class_type": "CLIPTextEncode", "inputs": {"text": "x", "clip": ["1", 1]}},
+    "4": {"class_type": "CLIPTextEncode", "inputs": {"text": "y", "clip": ["1", 1]}},
+    "5": {
+        "class_type": "KSampler",
+        "inputs": {"model": ["1", 0], "positive": ["2", 0], "negative": ["3", 0]},
+    },
+    "6": {"class_type": "VAEDecode", "inputs": {"samples": ["5", 0], "vae": ["1", 2]}},
+}
+
+
+def index_of(*output_classes, **classes):
+    object_info = {
+        class_type: {"output_node": class_type in output_classes}
+        for class_type in {node["class_type"] for node in PROMPT.values()}
+    }
+    object_info.update(classes)
+    return NodeSchemaIndex.from_object_info(object_info)
+
+
+def with_output(class_type):
+    return {
+        **PROMPT,
+        "7": {"class_type": class_type, "inputs": {"images": ["6", 0]}},
+    }
+
+
+def test_prunes_and_merges_with_core_output():
+    prompt, optimization = optimize_prompt(with_output("SaveImage"), index_of())
+
+    assert optimization.pruned == ["4"]
+    # The identical encoders are merged into whichever comes first
+    assert optimization.merged in ({"3": "2"}, {"2": "3"})
+    sampler = prompt["5"]["inputs"]
+    assert sampler["positive"] == sampler["negative"]
+    assert len(prompt) == 5
+
+
+def test_custom_output_class_in_index_is_kept():
+    index = index_of(SaveVideoCustom={"output_node": True})
+
+    prompt, optimization = optimize_prompt(with_output("SaveVideoCustom"), index)
+
+    assert "7" in prompt
+    assert optimization.pruned == ["4"]
+
+
+def test_unknown_output_class_without_index_is_not_pruned():
+    original = with_output("SaveVideoCustom")
+
+    prompt, optimization = optimize_prompt(original)
+
+    assert prompt is original
+    assert optimization.removed == 0
+
+
+def test_class_missing_from_index_is_not_pruned():
+    original = with_output("SaveVideoCustom")
+
+    prompt, optimization = optimize_prompt(original, index_of())
+
+    assert prompt is original
+    assert optimization.removed == 0
+
+
+def test_classes_that_must_run_separately_are_not_merged():
+    original = {
+        **with_output("SaveImage"),
+        "3": {"class_type": "RandomPrompt", "inputs": {"clip": ["1", 1]}},
+        "4": {"class_type": "RandomPrompt", "inputs": {"clip": ["1", 1]}},
+        "5": {
+            "class_type": "KSampler",
+            "inputs": {"model": ["1", 0], "positive": ["3", 0], "negative": ["4", 0]},
+        },
+    }
+    index = index_of(RandomPrompt={"output_node": False})
+
+    prompt, optimization = optimize_prompt(original, index)
+
+    # Each draws its own prompt, so "2", unused, is the only one removed
+    assert optimization.pruned == ["2"]
+    assert optimization.merged == {}
+    assert prompt["5"]["inputs"]["negative"] == ["4", 0]
+
+    prompt, optimization = optimize_prompt(
+        original, index, mergeable_classes={"RandomPrompt"}
+    )
+
+    assert optimization.merged in ({"4": "3"}, {"3": "4"})
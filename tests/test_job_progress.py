@@ -0,0 +1,214 @@
+import asyncio
+import time
+
+from comfy.job_progress import (
+    DEFAULT_NODE_MS,
+    DEFAULT_STEP_MS,
+    ComfyJobProgress,
+    ComfyStatusLog,
+    ProgressEmitter,
+)
+from comfy.models import NodeSpan
+from comfy.timeline import NodeLatencyHistograms
+
+PROMPT = {
+    "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a"}},
+    "3": {"class_type": "KSampler", "inputs": {"steps": 20, "model": ["4", 0]}},
+    "9": {"class_type": "SaveImageWebsocket", "inputs": {"images": ["3", 0]}},
+}
+
+
+class FakeJob:
+    def __init__(self):
+        self.percentage = 0.0
+        self.finished = False
+
+    def get_percentage(self):
+        return 100 if self.finished else self.percentage
+
+    def get_eta(self):
+        return 0 if self.finished else 1.0
+
+
+def emitter(interval=0.05, delta=1.0):
+    emitted = []
+    progress = ProgressEmitter(
+        lambda event, data, sid: emitted.append(data["progress"]), interval, delta
+    )
+    return progress, emitted
+
+
+def move(progress, job, *percentages):
+    for percentage in percentages:
+        job.percentage = percentage
+        progress.update(job)
+
+
+def test_updates_within_the_interval_are_coalesced():
+    async def run():
+        progress, emitted = emitter()
+        job = FakeJob()
+        move(progress, job, 0, 10, 20, 30)
+        first = list(emitted)
+        await asyncio.sleep(0.1)
+        return first, emitted, progress
+
+    first, emitted, progress = asyncio.run(run())
+
+    # The first update goes out at once, the others once, with the latest value
+    assert first == [0]
+    assert emitted == [0, 30]
+    assert progress.merged == 3
+
+
+def test_updates_after_the_interval_are_emitted_at_once():
+    async def run():
+        progress, emitted = emitter(interval=0.01)
+        job = FakeJob()
+        move(progress, job, 0)
+        await asyncio.sleep(0.02)
+        move(progress, job, 10)
+        return emitted
+
+    assert asyncio.run(run()) == [0, 10]
+
+
+def test_small_moves_are_flushed_after_the_interval():
+    async def run():
+        progress, emitted = emitter(interval=0.02, delta=1.0)
+        job = FakeJob()
+        move(progress, job, 99)
+        await asyncio.sleep(0.03)
+        move(progress, job, 99.5)
+        immediate = list(emitted)
+        await asyncio.sleep(0.05)
+        return immediate, emitted
+
+    immediate, emitted = asyncio.run(run())
+
+    # Below min_delta nothing goes out right away, the value isn't lost either
+    assert immediate == [99]
+    assert emitted == [99, 99.5]
+
+
+def test_unchanged_progress_is_not_emitted_again():
+    async def run():
+        progress, emitted = emitter(interval=0.01)
+        job = FakeJob()
+        move(progress, job, 50, 50, 50)
+        await asyncio.sleep(0.05)
+        return emitted
+
+    assert asyncio.run(run()) == [50]
+
+
+def test_end_of_job_is_emitted_at_once():
+    async def run():
+        progress, emitted = emitter(interval=10)
+        job = FakeJob()
+        move(progress, job, 0, 40)
+        job.finished = True
+        progress.update(job)
+        await asyncio.sleep(0.01)
+        return emitted
+
+    assert asyncio.run(run()) == [0, 100]
+
+
+def test_close_drops_the_pending_update():
+    async def run():
+        progress, emitted = emitter(interval=0.01)
+        job = FakeJob()
+        move(progress, job, 0, 40)
+        progress.close()
+        await asyncio.sleep(0.03)
+        return emitted
+
+    assert asyncio.run(run()) == [0]
+
+
+def executing(job, node, value=1, max=1):
+    job.add_status_log(ComfyStatusLog("p", node=node, value=value, max=max))
+
+
+def history(*spans):
+    latencies = NodeLatencyHistograms()
+    latencies.add_timeline([NodeSpan(node="n", start=0, **span) for span in spans])
+    return latencies
+
+
+def test_nodes_are_weighted_by_their_expected_duration():
+    job = ComfyJobProgress(PROMPT)
+
+    assert job.weights == {
+        "4": DEFAULT_NODE_MS,
+        "3": 20 * DEFAULT_STEP_MS,
+        "9": DEFAULT_NODE_MS,
+    }
+    executing(job, "4")
+    executing(job, "3")
+    # The loader is done, the sampler weighs 40 times more
+    assert job.get_percentage() == round(100 / 4200 * 100, 2)
+    executing(job, "3", value=10, max=20)
+    assert job.get_percentage() == round(2100 / 4200 * 100, 2)
+
+
+def test_history_scales_samplers_by_their_steps():
+    latencies = history(
+        {"class_type": "KSampler", "duration": 1000, "steps": 10},
+        {"class_type": "CheckpointLoaderSimple", "duration": 3000},
+    )
+
+    job = ComfyJobProgress(PROMPT, latencies)
+
+    assert job.weights == {"4": 3000, "3": 2000, "9": DEFAULT_NODE_MS}
+
+
+def test_history_falls_back_to_the_latencies_of_other_workers():
+    latencies = history({"class_type": "CheckpointLoaderSimple", "duration": 3000})
+    latencies.prior = history(
+        {"class_type": "KSampler", "duration": 1000, "steps": 10},
+        {"class_type": "CheckpointLoaderSimple", "duration": 50},
+    )
+
+    job = ComfyJobProgress(PROMPT, latencies)
+
+    # Samples of this container come first
+    assert job.weights == {"4": 3000, "3": 2000, "9": DEFAULT_NODE_MS}
+    assert "KSampler" not in latencies.summary()
+
+
+def test_eta_is_calibrated_by_the_speed_so_far(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "perf_counter", lambda: now[0])
+    job = ComfyJobProgress(PROMPT)
+    executing(job, "4")
+    executing(job, "3", value=0, max=20)
+
+    # Below the calibration share the estimates are used as they are
+    assert job.get_eta() == round((4200 - 100) / 1000, 2)
+
+    # Half of the work done in 4.2 s, twice as slow as estimated
+    now[0] += 4.2
+    executing(job, "3", value=10, max=20)
+    assert job.get_eta() == round(2100 * 2 / 1000, 2)
+
+    # The speed is bounded, a stall doesn't make the ETA explode
+    now[0] += 1000
+    assert job.get_eta() == round(2100 * 5 / 1000, 2)
+
+    job.finish()
+    assert job.get_eta() == 0
+
+
+def test_status_log_is_bounded():
+    job = ComfyJobProgress(PROMPT, max_status_logs=5)
+
+    executing(job, "4")
+    for step in range(1, 21):
+        executing(job, "3", value=step, max=20)
+
+    assert job.message_count == 21
+    assert [log.value for log in job.get_status_logs()] == [16, 17, 18, 19, 20]
+    assert job.summary()["retained_messages"] == 5
+    assert job.get_percentage() == round(4100 / 4200 * 100, 2)
@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from comfy.config import ComfyConfig
+from comfy.media_ingest import MediaIngest, is_public_address
+from comfy.models import MediaInput
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def png(color=(255, 0, 0)) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(output, format="PNG")
+    return output.getvalue()
+
+
+@pytest.fixture
+def ingest(tmp_path, monkeypatch):
+    # Temporary files of the spool end up here, to check that none is left
+    spool_dir = tmp_path / "tmp"
+    spool_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(spool_dir))
+    (tmp_path / "staging").mkdir()
+    config = ComfyConfig(
+        COMFYUI_PATH=str(tmp_path / "comfy"),
+        INPUT_STAGING_DIR=str(tmp_path / "staging"),
+        INPUT_MAX_BYTES=1024 * 1024,
+    )
+    return MediaIngest(config)
+
+
+def run(ingest, *coroutines, return_exceptions=False):
+    async def main():
+        try:
+            return await asyncio.gather(
+                *coroutines, return_exceptions=return_exceptions
+            )
+        finally:
+            await ingest.close()
+
+    return asyncio.run(main())
+
+
+def test_files_are_named_after_their_content(ingest):
+    data = png()
+
+    (name,) = run(ingest, ingest.ingest(MediaInput(data=data)))
+
+    assert name == f"{hashlib.sha256(data).hexdigest()[:32]}.png"
+    with open(os.path.join(ingest.input_dir, name), "rb") as file:
+        assert file.read() == data
+
+
+def test_concurrent_inputs_with_the_same_content_are_stored_once(ingest):
+    inputs = [MediaInput(data=png()) for _ in range(3)] + [
+        MediaInput(data=png((0, 0, 255)))
+    ]
+
+    names = run(ingest, *(ingest.ingest(media) for media in inputs))
+
+    assert len(set(names[:3])) == 1 and names[3] != names[0]
+    assert ingest.ingested == 2
+    assert ingest.deduplicated == 2
+    assert [media.name for media in inputs] == names
+    assert sorted(os.listdir(ingest.input_dir)) == sorted(set(names))
+
+
+def test_staged_file_is_streamed_and_the_spool_removed(ingest, tmp_path):
+    data = png()
+    staged = tmp_path / "staging" / "upload"
+    staged.write_bytes(data)
+
+    (name,) = run(ingest, ingest.ingest(MediaInput(path=str(staged))))
+
+    assert name == f"{hashlib.sha256(data).hexdigest()[:32]}.png"
+    assert os.listdir(tmp_path / "tmp") == []
+    # The staged file belongs to the gateway
+    assert staged.exists()
+
+
+def test_spool_is_removed_when_the_input_is_rejected(ingest, tmp_path):
+    not_an_image = tmp_path / "staging" / "text"
+    not_an_image.write_bytes(b"not an image")
+    too_large = tmp_path / "staging" / "large"
+    too_large.write_bytes(b"0" * (ingest.config.INPUT_MAX_BYTES + 1))
+
+    errors = run(
+        ingest,
+        *(
+            ingest.ingest(MediaInput(path=str(path)))
+            for path in (not_an_image, too_large)
+        ),
+        return_exceptions=True,
+    )
+
+    assert [type(error) for error in errors] == [ValueError, ValueError]
+
+    assert os.listdir(tmp_path / "tmp") == []
+    assert not os.path.exists(ingest.input_dir)
+
+
+def test_paths_outside_the_staging_dir_are_rejected(ingest, tmp_path):
+    outside = tmp_path / "secret.png"
+    outside.write_bytes(png())
+
+    errors = run(
+        ingest,
+        *(
+            ingest.ingest(MediaInput(path=str(path)))
+            for path in (outside, tmp_path / "staging" / ".." / "secret.png")
+        ),
+        return_exceptions=True,
+    )
+
+    for error in errors:
+        assert isinstance(error, ValueError)
+        assert "INPUT_STAGING_DIR" in str(error)
+
+
+def test_only_public_addresses_are_public():
+    assert is_public_address("93.184.216.34")
+    assert is_public_address("2606:4700::1111")
+    for address in ("127.0.0.1", "10.0.0.1", "169.254.169.254", "100.64.0.1"):
+        assert not is_public_address(address)
+    assert not is_public_address("::1")
+    assert not is_public_address("::ffff:127.0.0.1")
+    assert not is_public_address("fe80::1%eth0")
+
+
+def test_urls_of_other_schemes_or_private_addresses_are_rejected(ingest):
+    urls = [
+        "file:///etc/passwd",
+        "ftp://93.184.216.34/image.png",
+        "http://127.0.0.1:8188/view",
+        "http://169.254.169.254/latest/meta-data/",
+        "http://[::1]/image.png",
+    ]
+
+    errors = run(
+        ingest,
+        *(ingest.ingest(MediaInput(url=url)) for url in urls),
+        ingest.ingest(MediaInput(url="http://localhost:8188/view")),
+        return_exceptions=True,
+    )
+
+    assert [type(error) for error in errors[:-1]] == [ValueError] * len(urls)
+    # Host names are checked once resolved, before connecting
+    assert isinstance(errors[-1], aiohttp.ClientConnectorError)
+    assert "no public address" in str(errors[-1].os_error)
+
+
+def test_downloads_follow_checked_redirects_and_are_capped(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    data = png()
+
+    async def large(request):
+        # Without Content-Length, the size is only known while reading
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for _ in range(3):
+            await response.write(b"0" * 1024)
+        return response
+
+    def redirect(location):
+        async def handler(request):
+            raise web.HTTPFound(location)
+
+        return handler
+
+    async def image(request):
+        return web.Response(body=data)
+
+    app = web.Application()
+    app.router.add_get("/image", image)
+    app.router.add_get("/large", large)
+    app.router.add_get("/redirect", redirect("/image"))
+    app.router.add_get("/loop", redirect("/loop"))
+    app.router.add_get("/to-file", redirect("file:///etc/passwd"))
+
+    async def main():
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        base = f"http://127.0.0.1:{runner.addresses[0][1]}"
+        ingest = MediaIngest(
+            ComfyConfig(
+                COMFYUI_PATH=str(tmp_path / "comfy"),
+                INPUT_MAX_BYTES=2048,
+                INPUT_ALLOW_PRIVATE_URLS=True,
+            )
+        )
+        try:
+            return await asyncio.gather(
+                *(
+                    ingest.ingest(MediaInput(url=f"{base}/{path}"))
+                    for path in ("redirect", "large", "loop", "to-file")
+                ),
+                return_exceptions=True,
+            )
+        finally:
+            await ingest.close()
+            await runner.cleanup()
+
+    name, *errors = asyncio.run(main())
+
+    assert name == f"{hashlib.sha256(data).hexdigest()[:32]}.png"
+    assert [str(error).split()[-1] for error in errors[:2]] == ["2048", "times"]
+    # Redirects are checked like the URL sent
+    assert "isn't an http or https URL" in str(errors[2])
+    assert [path.name for path in tmp_path.iterdir()] == ["comfy"]
@@ -0,0 +1,115 @@
+import os
+
+from comfy.model_cache import ModelCache
+
+
+def model_files(tmp_path, *names):
+    paths = []
+    for name in names:
+        path = tmp_path / name
+        path.write_bytes(name.encode())
+        paths.append(str(path))
+    return paths
+
+
+def test_lru_evicts_the_least_recently_used_within_the_budget(tmp_path):
+    a, b, c = model_files(tmp_path, "a", "b", "c")
+    cache = ModelCache(max_bytes=10, policy="lru")
+    cache.put(a, "A", size=4)
+    cache.put(b, "B", size=4)
+    # Using a makes b the oldest
+    cache.get(a)
+
+    assert cache.put(c, "C", size=4)
+
+    assert (cache.get(a), cache.get(b), cache.get(c)) == ("A", None, "C")
+    assert cache.resident_bytes == 8
+    assert cache.evictions == 1
+
+
+def test_lfu_evicts_the_least_used_within_the_budget(tmp_path):
+    a, b, c = model_files(tmp_path, "a", "b", "c")
+    cache = ModelCache(max_bytes=10, policy="lfu")
+    cache.put(a, "A", size=4)
+    cache.put(b, "B", size=4)
+    for _ in range(3):
+        cache.get(a)
+    cache.get(b)
+    # Used last but less often than a
+    cache.get(b)
+    cache.get(a)
+
+    cache.put(c, "C", size=6)
+
+    assert (cache.get(a), cache.get(b), cache.get(c)) == ("A", None, "C")
+    assert cache.resident_bytes == 10
+
+
+def test_eviction_frees_as_many_entries_as_needed(tmp_path):
+    a, b, c, d = model_files(tmp_path, "a", "b", "c", "d")
+    cache = ModelCache(max_bytes=10)
+    for path in (a, b, c):
+        cache.put(path, path, size=3)
+
+    cache.put(d, d, size=7)
+
+    assert [path in cache for path in (a, b, c, d)] == [False, False, True, True]
+    assert cache.resident_bytes == 10
+    assert cache.evictions == 2
+
+
+def test_entries_larger_than_the_budget_are_not_cached(tmp_path):
+    a, b = model_files(tmp_path, "a", "b")
+    cache = ModelCache(max_bytes=10)
+    cache.put(a, "A", size=4)
+
+    assert not cache.put(b, "B", size=11)
+
+    assert cache.get(a) == "A"
+    assert b not in cache
+    assert (cache.rejected, cache.evictions) == (1, 0)
+
+
+def test_mapped_entries_use_no_budget_and_are_not_evicted(tmp_path):
+    mapped, a, b = model_files(tmp_path, "mapped", "a", "b")
+    cache = ModelCache(max_bytes=10)
+    cache.put(mapped, "M", size=100, mapped=True)
+    cache.put(a, "A", size=6)
+
+    cache.put(b, "B", size=6)
+
+    assert (cache.get(mapped), cache.get(a), cache.get(b)) == ("M", None, "B")
+    assert (cache.resident_bytes, cache.mapped_bytes) == (6, 100)
+
+
+def test_replaced_file_drops_the_entry_of_its_previous_version(tmp_path):
+    (a,) = model_files(tmp_path, "a")
+    cache = ModelCache(max_bytes=10)
+    cache.put(a, "A", size=4)
+
+    # A new version of the same size, only the modification time changes
+    stat = os.stat(a)
+    os.utime(a, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert a not in cache
+    assert cache.get(a) is None
+    assert (len(cache), cache.resident_bytes) == (0, 0)
+
+
+def test_rewritten_file_is_a_new_entry(tmp_path):
+    (a,) = model_files(tmp_path, "a")
+    link = tmp_path / "link"
+    link.symlink_to(a)
+    cache = ModelCache(max_bytes=10)
+    cache.put(a, "A", size=4)
+    # Same file through another path
+    assert cache.get(str(link)) == "A"
+
+    # Replaced by a new file: new inode and size
+    os.remove(a)
+    with open(a, "wb") as file:
+        file.write(b"a new version")
+    cache.put(a, "A2", size=4)
+
+    assert cache.get(str(link)) == "A2"
+    assert (len(cache), cache.resident_bytes) == (1, 4)
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+from pydantic import ValidationError
+
+from lib.workflow_registry import WorkflowRegistry
+from prompt_constructor import DEFAULT_WORKFLOW, WORKFLOWS, WorkflowInput
+
+PROMPT_PATH = os.path.join(os.path.dirname(__file__), "..", "prompt.json")
+
+
+@pytest.fixture
+def workflows():
+    # The registered default workflow, with the template of the repository
+    registry = WorkflowRegistry()
+    default = WORKFLOWS.get(DEFAULT_WORKFLOW)
+    registry.register(
+        DEFAULT_WORKFLOW, PROMPT_PATH, default.input_model, default.build_values
+    )
+    return registry
+
+
+def test_invalid_inputs_are_rejected():
+    invalid = [{}, {"prompt": None}, {"prompt": "a cat", "timeout": 0}]
+
+    for payload in invalid:
+        with pytest.raises(ValidationError):
+            WorkflowInput.model_validate(payload)
+
+
+def test_input_maps_onto_the_prompt_text(workflows):
+    prompt = workflows.construct_prompt(
+        DEFAULT_WORKFLOW, {"prompt": "a cat", "timeout": 30}
+    )
+
+    # Only the text changes, the limits are for the gateway
+    template = workflows.get(DEFAULT_WORKFLOW).template.workflow
+    assert prompt["6"]["inputs"] == {**template["6"]["inputs"], "text": "a cat"}
+    assert {node_id: prompt[node_id] for node_id in prompt if node_id != "6"} == {
+        node_id: template[node_id] for node_id in template if node_id != "6"
+    }
+
+
+def test_parsed_inputs_round_trip(workflows):
+    definition = workflows.get(DEFAULT_WORKFLOW)
+    payload = WorkflowInput(prompt="a cat", deadline=1.5)
+
+    assert definition.parse_input(payload) is payload
+    assert definition.parse_input(payload.model_dump()) == payload
+    assert workflows.construct_prompt(
+        DEFAULT_WORKFLOW, payload
+    ) == workflows.construct_prompt(DEFAULT_WORKFLOW, payload.model_dump())
+    with pytest.raises(ValidationError):
+        workflows.construct_prompt(DEFAULT_WORKFLOW, {"text": "a cat"})
@@ -0,0 +1,61 @@
+import copy
+
+import pytest
+
+from lib.prompt_template import PromptTemplate
+
+
+def workflow():
+    return {
+        "3": {
+            "class_type": "KSampler",
+            "inputs": {"seed": 1, "steps": 20, "model": ["4", 0]},
+        },
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a"}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": "a cat"}},
+    }
+
+
+def test_rendering_leaves_the_template_unmodified():
+    template = PromptTemplate(workflow())
+    original = copy.deepcopy(template.workflow)
+
+    first = template.render({"3.inputs.seed": 2, "6.inputs.text": "a dog"})
+    second = template.render({"3.inputs.seed": 3, "3.inputs.steps": 30})
+
+    assert template.workflow == original
+    assert first["3"]["inputs"] == {"seed": 2, "steps": 20, "model": ["4", 0]}
+    assert first["6"]["inputs"]["text"] == "a dog"
+    assert second["3"]["inputs"] == {"seed": 3, "steps": 30, "model": ["4", 0]}
+    assert second["6"]["inputs"]["text"] == "a cat"
+
+
+def test_only_the_changed_nodes_are_copied():
+    template = PromptTemplate(workflow())
+
+    prompt = template.render({"3.inputs.seed": 2})
+
+    assert prompt["4"] is template.workflow["4"]
+    assert prompt["6"] is template.workflow["6"]
+    assert prompt["3"] is not template.workflow["3"]
+    assert prompt["3"]["inputs"] is not template.workflow["3"]["inputs"]
+    # Values next to the changed one are shared too
+    assert prompt["3"]["inputs"]["model"] is template.workflow["3"]["inputs"]["model"]
+
+
+def test_whole_nodes_can_be_replaced():
+    template = PromptTemplate(workflow())
+    node = {"class_type": "CLIPTextEncode", "inputs": {"text": "a bird"}}
+
+    prompt = template.render({"6": node})
+
+    assert prompt["6"] is node
+    assert template.workflow["6"]["inputs"]["text"] == "a cat"
+
+
+def test_invalid_paths_are_rejected():
+    template = PromptTemplate(workflow())
+
+    for path in ("5.inputs.seed", "3.missing.seed", "3.inputs.seed.value"):
+        with pytest.raises(ValueError):
+            template.render({path: 1})
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from comfy.prompt_validation import (
+    NodeSchemaIndex,
+    PromptValidator,
+    models_modified_at,
+)
+from lib.exceptions import PromptValidationError
+
+OBJECT_INFO = {
+    "CheckpointLoaderSimple": {
+        "input": {"required": {"ckpt_name": [["sd_xl_base_1.0.safetensors"]]}},
+        "output": ["MODEL", "CLIP", "VAE"],
+    },
+    "Sharpen": {
+        "input": {
+            "required": {
+                "model": ["MODEL"],
+                "mode": [["soft", "hard"]],
+            }
+        },
+        "output": ["MODEL"],
+        "output_node": True,
+    },
+}
+
+
+def prompt(ckpt_name="sd_xl_base_1.0.safetensors", mode="soft", model=("1", 0)):
+    return {
+        "1": {
+            "class_type": "CheckpointLoaderSimple",
+            "inputs": {"ckpt_name": ckpt_name},
+        },
+        "2": {"class_type": "Sharpen", "inputs": {"model": list(model), "mode": mode}},
+    }
+
+
+@pytest.fixture
+def validator():
+    return PromptValidator(NodeSchemaIndex.from_object_info(OBJECT_INFO))
+
+
+def test_valid_prompt(validator):
+    validator.check(prompt())
+
+
+def test_value_not_in_list(validator):
+    with pytest.raises(PromptValidationError):
+        validator.check(prompt(mode="medium"))
+
+
+def test_misspelled_model_is_rejected(validator):
+    with pytest.raises(PromptValidationError) as error:
+        validator.check(prompt(ckpt_name="sd_xl_base_1.O.safetensors"))
+
+    node_errors = error.value.details["node_errors"]
+    assert node_errors["1"]["errors"][0]["type"] == "value_not_in_list"
+
+
+def test_model_added_after_capture_is_left_to_comfyui(validator):
+    validator.check_models = False
+
+    validator.check(prompt(ckpt_name="added_later.safetensors"))
+    with pytest.raises(PromptValidationError):
+        validator.check(prompt(mode="medium"))
+
+
+def test_models_modified_at_skips_hidden_folders(tmp_path):
+    (tmp_path / "checkpoints").mkdir()
+    (tmp_path / ".result_cache").mkdir()
+    os.utime(tmp_path / "checkpoints", (100, 100))
+    os.utime(tmp_path / ".result_cache", (200, 200))
+
+    assert models_modified_at(str(tmp_path)) == 100
+
+    (tmp_path / "checkpoints" / "added.safetensors").touch()
+    assert models_modified_at(str(tmp_path)) > 100
+
+
+def test_unchecked_class_only_checks_links(validator):
+    validator.check(prompt(mode="medium"), unchecked_classes=["Sharpen"])
+
+    with pytest.raises(PromptValidationError):
+        validator.check(prompt(model=("1", 1)), unchecked_classes=["Sharpen"])
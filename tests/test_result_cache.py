@@ -0,0 +1,160 @@
+import asyncio
+import os
+
+from comfy.config import ComfyConfig
+from comfy.result_cache import ResultCache
+
+
+def prompt(seed=1):
+    return {
+        "3": {"class_type": "KSampler", "inputs": {"seed": seed, "model": ["4", 0]}},
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a"}},
+    }
+
+
+def cache(**config):
+    return ResultCache(ComfyConfig(**config))
+
+
+def worker_config(directory):
+    return ComfyConfig(RESULT_CACHE_TTL=60, RESULT_CACHE_DIR=str(directory))
+
+
+def disk_entries(directory):
+    return sorted(name for _, _, files in os.walk(directory) for name in files)
+
+
+def age(cache, prompt, seconds):
+    """Move the entry of a prompt back in time, in both tiers."""
+    key = cache.key(prompt)
+    if key in cache._memory:
+        value, stored_at = cache._memory[key]
+        cache._memory[key] = (value, stored_at - seconds)
+    if cache.directory:
+        stat = os.stat(cache._path(key))
+        os.utime(cache._path(key), (stat.st_atime - seconds, stat.st_mtime - seconds))
+
+
+def test_equivalent_prompts_share_an_entry():
+    async def run():
+        results = cache()
+        await results.put(prompt(), b"image")
+        reordered = dict(reversed(list(prompt().items())))
+        return await results.get(reordered), await results.get(prompt(seed=2))
+
+    assert asyncio.run(run()) == (b"image", None)
+
+
+def test_expired_entries_are_misses_in_both_tiers(tmp_path):
+    async def run():
+        results = cache(RESULT_CACHE_TTL=60, RESULT_CACHE_DIR=str(tmp_path))
+        await results.put(prompt(), b"image")
+        age(results, prompt(), 30)
+        fresh = await results.get(prompt())
+        age(results, prompt(), 60)
+        return fresh, await results.get(prompt()), results
+
+    fresh, expired, results = asyncio.run(run())
+
+    assert fresh == b"image"
+    assert expired is None
+    assert (results.hits, results.misses) == (1, 1)
+    # The expired file is removed once looked up
+    assert disk_entries(tmp_path) == []
+
+
+def test_memory_tier_evicts_the_least_recently_used_within_its_budget():
+    async def run():
+        results = cache(RESULT_CACHE_MEMORY_BYTES=10)
+        await results.put(prompt(1), b"1111")
+        await results.put(prompt(2), b"2222")
+        # Using the first makes the second the oldest
+        await results.get(prompt(1))
+        await results.put(prompt(3), b"3333")
+        # Larger than the whole budget, not cached
+        await results.put(prompt(4), b"4" * 11)
+        return [await results.get(prompt(seed)) for seed in range(1, 5)], results
+
+    values, results = asyncio.run(run())
+
+    assert values == [b"1111", None, b"3333", None]
+    assert results._memory_bytes == 8
+
+
+def test_disk_tier_evicts_the_least_recently_used_within_its_budget(tmp_path):
+    async def run():
+        results = cache(RESULT_CACHE_DISK_BYTES=10, RESULT_CACHE_DIR=str(tmp_path))
+        await results.put(prompt(1), b"1111")
+        await results.put(prompt(2), b"2222")
+        age(results, prompt(1), 20)
+        age(results, prompt(2), 10)
+        await results.put(prompt(3), b"3333")
+        return results
+
+    results = asyncio.run(run())
+
+    assert disk_entries(tmp_path) == sorted(
+        results.key(prompt(seed)) for seed in (2, 3)
+    )
+    assert results._disk_bytes == 8
+
+
+def test_gateway_hits_the_results_stored_by_a_worker(tmp_path):
+    async def run():
+        worker = cache(RESULT_CACHE_DIR=str(tmp_path))
+        gateway = cache(RESULT_CACHE_DIR=str(tmp_path))
+        miss = await gateway.get(prompt())
+        await worker.put(prompt(), b'{"output_image": "..."}')
+        hit = await gateway.get(prompt())
+        # Loaded into the memory tier, still found once the file is gone
+        os.remove(worker._path(worker.key(prompt())))
+        again = await gateway.get_by_key(gateway.key(prompt()))
+        return miss, hit, again, gateway
+
+    miss, hit, again, gateway = asyncio.run(run())
+
+    assert miss is None
+    assert hit == again == b'{"output_image": "..."}'
+    assert (gateway.hits, gateway.misses) == (2, 1)
+
+
+def test_read_only_cache_leaves_the_directory_alone(tmp_path, monkeypatch):
+    utimes = []
+
+    async def run():
+        worker = cache(RESULT_CACHE_TTL=60, RESULT_CACHE_DIR=str(tmp_path))
+        gateway = ResultCache(worker_config(tmp_path), read_only=True)
+        await worker.put(prompt(1), b"fresh")
+        await worker.put(prompt(2), b"expired")
+        age(worker, prompt(1), 30)
+        age(worker, prompt(2), 120)
+        monkeypatch.setattr(os, "utime", lambda *args: utimes.append(args))
+        results = [await gateway.get(prompt(seed)) for seed in (1, 2)]
+        await gateway.put(prompt(3), b"memory only")
+        return results, worker
+
+    results, worker = asyncio.run(run())
+
+    assert results == [b"fresh", None]
+    # Neither the hit nor the expired entry changed the directory
+    assert utimes == []
+    assert disk_entries(tmp_path) == sorted(worker.key(prompt(seed)) for seed in (1, 2))
+
+
+def test_files_being_written_are_not_counted_or_evicted(tmp_path):
+    # Left by a writer of another container
+    (tmp_path / "ab").mkdir()
+    (tmp_path / "ab" / ".abc.x1y2.tmp").write_bytes(b"0" * 100)
+
+    async def run():
+        results = cache(RESULT_CACHE_DISK_BYTES=10, RESULT_CACHE_DIR=str(tmp_path))
+        await results.put(prompt(1), b"1111")
+        await results.put(prompt(2), b"2222")
+        return results
+
+    results = asyncio.run(run())
+
+    assert results._disk_bytes == 8
+    assert disk_entries(tmp_path) == sorted(
+        [".abc.x1y2.tmp"] + [results.key(prompt(seed)) for seed in (1, 2)]
+    )
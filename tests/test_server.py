@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+from benchmarks.fake_comfy_server import FakeComfyConfig, FakeComfyServer
+from comfy.config import ComfyConfig
+from comfy.models import ExecutionData
+from comfy.server import ComfyServer
+from lib.exceptions import ExecutionError
+
+# A sampler that runs for 5 s unless interrupted, sending a progress message per step
+SLOW_PROMPT = {
+    "1": {"class_type": "KSampler", "inputs": {"seed": 1, "steps": 50}},
+    "2": {"class_type": "SaveImageWebsocket", "inputs": {"images": ["1", 0]}},
+}
+
+
+class RecordingFakeServer(FakeComfyServer):
+    """Fake ComfyUI recording the prompts /interrupt and /queue were called for."""
+
+    def __init__(self):
+        super().__init__(
+            FakeComfyConfig(node_latency_ms={"KSampler": 5000}, preview_frames=False)
+        )
+        self.interrupted = []
+        self.deleted = []
+
+    async def handle_interrupt(self, request):
+        data = await request.json() if request.can_read_body else {}
+        self.interrupted.append(data.get("prompt_id"))
+        return await super().handle_interrupt(request)
+
+    async def handle_post_queue(self, request):
+        self.deleted.extend((await request.json()).get("delete", []))
+        return await super().handle_post_queue(request)
+
+
+def run_against_fake_server(test):
+    """Run `test(fake, server)` with a ComfyServer connected to a fake ComfyUI."""
+
+    async def run():
+        fake = RecordingFakeServer()
+        runner = web.AppRunner(fake.create_app())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        port = runner.addresses[0][1]
+        server = ComfyServer(ComfyConfig(SERVER_PORT=port, CANCEL_GRACE_PERIOD=2))
+        try:
+            return await test(fake, server)
+        finally:
+            await server.close()
+            await runner.cleanup()
+
+    return asyncio.run(run())
+
+
+def slow_execution(**data):
+    return ExecutionData(prompt=SLOW_PROMPT, process_id="p", **data)
+
+
+def test_running_prompt_is_interrupted_on_timeout():
+    async def test(fake, server):
+        started = time.monotonic()
+        with pytest.raises(ExecutionError, match="timed out"):
+            await server.execute(slow_execution(timeout=0.3))
+        return time.monotonic() - started, fake
+
+    elapsed, fake = run_against_fake_server(test)
+
+    assert len(fake.interrupted) == 1
+    # Returned once the fake confirmed the interrupt, long before the 5 s sampler
+    assert elapsed < 2
+    assert fake.running is None
+    assert not fake.history
+
+
+def test_queued_prompt_is_removed_from_the_queue_on_timeout():
+    async def test(fake, server):
+        running = asyncio.create_task(server.execute(slow_execution()))
+        while fake.running is None:
+            await asyncio.sleep(0.01)
+        with pytest.raises(ExecutionError, match="timed out"):
+            await server.execute(slow_execution(timeout=0.3))
+        queue_after_timeout = list(fake.queue)
+        interrupted_after_timeout = list(fake.interrupted)
+
+        running.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await running
+        return fake, queue_after_timeout, interrupted_after_timeout
+
+    fake, queue_after_timeout, interrupted_after_timeout = run_against_fake_server(test)
+
+    # The queued prompt is deleted without interrupting the running one
+    assert queue_after_timeout == []
+    assert interrupted_after_timeout == []
+    assert len(fake.deleted) == 2
+    # Cancelling the caller interrupts the running prompt
+    assert len(fake.interrupted) == 1
+
+
+def test_expired_deadline_fails_before_queueing():
+    async def test(fake, server):
+        with pytest.raises(ExecutionError, match="Deadline"):
+            await server.execute(slow_execution(deadline=time.time() - 1))
+        return fake
+
+    fake = run_against_fake_server(test)
+
+    assert fake._number == 0
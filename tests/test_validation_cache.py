@@ -0,0 +1,143 @@
+from comfy.graph import iter_links
+from comfy.validation_cache import PromptValidationCache
+
+
+def prompt(seed=1, text="a cat", steps=20):
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a"}},
+        "2": {
+            "class_type": "CLIPTextEncode",
+            "inputs": {"text": text, "clip": ["1", 1]},
+        },
+        "3": {
+            "class_type": "KSampler",
+            "inputs": {
+                "seed": seed,
+                "steps": steps,
+                "model": ["1", 0],
+                "positive": ["2", 0],
+            },
+        },
+        "4": {"class_type": "SaveImage", "inputs": {"images": ["3", 0]}},
+    }
+
+
+class StubComfy:
+    """validate_prompt and validate_inputs of ComfyUI, rejecting negative steps."""
+
+    def __init__(self):
+        self.full_validations = 0
+        self.validated_nodes = []
+
+    def validate_prompt(self, prompt):
+        self.full_validations += 1
+        validated = {}
+        valid = self.validate_inputs(prompt, "4", validated)[0]
+        if not valid:
+            return False, {"type": "prompt_outputs_failed_validation"}, [], {"3": {}}
+        return True, None, ["4"], {}
+
+    def validate_inputs(self, prompt, item, validated):
+        if item in validated:
+            return validated[item]
+        self.validated_nodes.append(item)
+        valid = all(
+            self.validate_inputs(prompt, source, validated)[0] is True
+            for _, source, _ in iter_links(prompt[item])
+        )
+        if prompt[item]["inputs"].get("steps", 1) < 0:
+            valid = False
+        validated[item] = (valid, [], item)
+        return validated[item]
+
+
+def validate(cache, comfy, prompt):
+    return cache.validate(prompt, comfy.validate_prompt, comfy.validate_inputs)
+
+
+def test_hit_without_changes_skips_validation():
+    cache, comfy = PromptValidationCache(), StubComfy()
+    validate(cache, comfy, prompt())
+    comfy.validated_nodes.clear()
+
+    result = validate(cache, comfy, prompt())
+
+    assert result == (True, None, ["4"], {})
+    assert comfy.full_validations == 1
+    assert comfy.validated_nodes == []
+    assert cache.stats()["hits"] == 1
+
+
+def test_changed_scalar_revalidates_its_downstream_nodes_only():
+    cache, comfy = PromptValidationCache(), StubComfy()
+    validate(cache, comfy, prompt())
+    comfy.validated_nodes.clear()
+
+    result = validate(cache, comfy, prompt(seed=2))
+
+    assert result[0] is True
+    assert comfy.full_validations == 1
+    assert sorted(comfy.validated_nodes) == ["3", "4"]
+    assert cache.revalidated_nodes == 2
+
+    # The new value is remembered as valid
+    comfy.validated_nodes.clear()
+    validate(cache, comfy, prompt(seed=2))
+    assert comfy.validated_nodes == []
+
+
+def test_failed_partial_validation_falls_back_to_validate_prompt():
+    cache, comfy = PromptValidationCache(), StubComfy()
+    validate(cache, comfy, prompt())
+
+    valid, error, _, node_errors = validate(cache, comfy, prompt(steps=-1))
+
+    assert valid is False
+    assert error == {"type": "prompt_outputs_failed_validation"}
+    assert node_errors == {"3": {}}
+    assert comfy.full_validations == 2
+
+    # The invalid value isn't remembered, the valid one still is
+    comfy.validated_nodes.clear()
+    validate(cache, comfy, prompt())
+    assert comfy.validated_nodes == []
+
+
+def test_least_recently_used_structure_is_evicted():
+    cache, comfy = PromptValidationCache(max_size=2), StubComfy()
+    structures = [
+        prompt(),
+        {
+            **prompt(),
+            "5": {"class_type": "PreviewImage", "inputs": {"images": ["3", 0]}},
+        },
+        {
+            **prompt(),
+            "2": {
+                "class_type": "CLIPTextEncode",
+                "inputs": {"clip": ["1", 0], "text": ""},
+            },
+        },
+    ]
+    validate(cache, comfy, structures[0])
+    validate(cache, comfy, structures[1])
+    # Using the first structure again makes the second the oldest
+    validate(cache, comfy, structures[0])
+    validate(cache, comfy, structures[2])
+    assert comfy.full_validations == 3
+
+    validate(cache, comfy, structures[0])
+    validate(cache, comfy, structures[2])
+    assert comfy.full_validations == 3
+    validate(cache, comfy, structures[1])
+    assert comfy.full_validations == 4
+    assert cache.stats()["entries"] == 2
+
+
+def test_without_validate_inputs_every_prompt_is_validated():
+    cache, comfy = PromptValidationCache(), StubComfy()
+
+    for _ in range(2):
+        cache.validate(prompt(), comfy.validate_prompt)
+
+    assert comfy.full_validations == 2
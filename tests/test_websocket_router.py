@@ -0,0 +1,198 @@
+import asyncio
+import json
+
+import aiohttp
+import pytest
+
+from comfy import websocket_router
+from comfy.websocket_router import ComfyWebSocketRouter, extract_prompt_id
+
+
+class FakeSocket:
+    """A websocket whose messages are sent by the test, None closes it."""
+
+    def __init__(self):
+        self.messages = asyncio.Queue()
+        self.closed = False
+
+    def send(self, message_type, **data):
+        text = json.dumps({"type": message_type, "data": data})
+        self.messages.put_nowait(aiohttp.WSMessage(aiohttp.WSMsgType.TEXT, text, None))
+
+    def send_binary(self, data):
+        self.messages.put_nowait(
+            aiohttp.WSMessage(aiohttp.WSMsgType.BINARY, data, None)
+        )
+
+    async def close(self):
+        self.closed = True
+        self.messages.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.messages.get()
+        if message is None:
+            self.closed = True
+            raise StopAsyncIteration
+        return message
+
+
+class FakeSession:
+    closed = False
+
+    def __init__(self):
+        self.socket = FakeSocket()
+
+    async def ws_connect(self, url, **kwargs):
+        return self.socket
+
+
+async def connected_router():
+    session = FakeSession()
+    router = ComfyWebSocketRouter("ws://comfy/ws", session=session)
+    await router.ensure_connected()
+    return router, session.socket
+
+
+async def settle():
+    """Let the reader task consume what was sent."""
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def drain(queue):
+    messages = []
+    while not queue.empty():
+        messages.append(queue.get_nowait())
+    return messages
+
+
+def test_extract_prompt_id():
+    assert extract_prompt_id('{"data": {"prompt_id": "a"}}') == "a"
+    assert extract_prompt_id('{"data":{"prompt_id":"b"}}') == "b"
+    assert extract_prompt_id('{"type": "status", "data": {}}') is None
+
+
+def test_routes_concurrent_prompts():
+    async def run():
+        router, socket = await connected_router()
+        a, b = router.subscribe("a"), router.subscribe("b")
+        socket.send("executing", prompt_id="a", node="1")
+        socket.send("executing", prompt_id="b", node="2")
+        socket.send("status", status={})
+        socket.send("executing", prompt_id="a", node=None)
+        await settle()
+        messages = drain(a), drain(b)
+        await router.close()
+        return messages
+
+    a, b = asyncio.run(run())
+
+    assert a == [
+        ("executing", {"prompt_id": "a", "node": "1"}),
+        ("executing", {"prompt_id": "a", "node": None}),
+    ]
+    assert b == [("executing", {"prompt_id": "b", "node": "2"})]
+
+
+def test_replays_messages_received_before_subscribe():
+    async def run():
+        router, socket = await connected_router()
+        socket.send("execution_start", prompt_id="a")
+        socket.send_binary(b"image")
+        await settle()
+        queue = router.subscribe("a")
+        socket.send("executing", prompt_id="a", node=None)
+        await settle()
+        messages = drain(queue)
+        await router.close()
+        return messages
+
+    messages = asyncio.run(run())
+
+    assert messages == [
+        ("execution_start", {"prompt_id": "a"}),
+        ("binary", b"image"),
+        ("executing", {"prompt_id": "a", "node": None}),
+    ]
+
+
+def test_pending_buffer_is_bounded(monkeypatch):
+    monkeypatch.setattr(websocket_router, "MAX_PENDING_PROMPTS", 2)
+    monkeypatch.setattr(websocket_router, "MAX_PENDING_MESSAGES", 3)
+
+    async def run():
+        router, socket = await connected_router()
+        for prompt_id in ("a", "b", "c"):
+            socket.send("execution_start", prompt_id=prompt_id)
+        for step in range(5):
+            socket.send("progress", prompt_id="c", value=step)
+        await settle()
+        queues = {prompt_id: router.subscribe(prompt_id) for prompt_id in "abc"}
+        messages = {prompt_id: drain(queue) for prompt_id, queue in queues.items()}
+        await router.close()
+        return messages
+
+    messages = asyncio.run(run())
+
+    # The oldest prompt is evicted, the others keep their first messages
+    assert messages["a"] == []
+    assert messages["b"] == [("execution_start", {"prompt_id": "b"})]
+    assert [m[0] for m in messages["c"]] == ["execution_start", "progress", "progress"]
+
+
+def test_binary_frames_go_to_the_running_prompt():
+    async def run():
+        router, socket = await connected_router()
+        a, b = router.subscribe("a"), router.subscribe("b")
+        # Without a running prompt the frame has no owner and is dropped
+        socket.send_binary(b"orphan")
+        socket.send("executing", prompt_id="b", node="9")
+        socket.send_binary(b"preview")
+        await settle()
+        messages = drain(a), drain(b)
+        await router.close()
+        return messages
+
+    a, b = asyncio.run(run())
+
+    assert a == []
+    assert b == [
+        ("executing", {"prompt_id": "b", "node": "9"}),
+        ("binary", b"preview"),
+    ]
+
+
+def test_closed_socket_fails_every_subscriber():
+    async def run():
+        router, socket = await connected_router()
+        a, b = router.subscribe("a"), router.subscribe("b")
+        await socket.close()
+        await settle()
+        return router, a, b
+
+    router, a, b = asyncio.run(run())
+
+    for queue in (a, b):
+        assert drain(queue) == [
+            (
+                "websocket_closed",
+                {"exception_message": "Websocket connection to ComfyUI was closed"},
+            )
+        ]
+    assert not router.connected
+
+
+def test_connect_error_is_a_websocket_error():
+    class FailingSession(FakeSession):
+        async def ws_connect(self, url, **kwargs):
+            raise aiohttp.ClientConnectionError("refused")
+
+    async def run():
+        router = ComfyWebSocketRouter("ws://comfy/ws", session=FailingSession())
+        await router.ensure_connected()
+
+    with pytest.raises(websocket_router.WebSocketError):
+        asyncio.run(run())
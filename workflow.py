@@ -1,6 +1,8 @@
 from modal import (
+    Dict as ModalDict,
     Secret,
     enter,
+    exit,
     App,
     Volume,
     method,
@@ -10,13 +12,40 @@ from modal import (
     web_server,
 )
 from comfy.server import ComfyServer, ComfyConfig
-from comfy.models import ExecutionCallbacks, ExecutionData
+from comfy.batching import ExecutionBatcher
+from comfy.models import ExecutionCallbacks, ExecutionData, ExecutionLimits
+from comfy.result_cache import ResultCache
 from lib.image import get_comfy_image
 from lib.logger import logger
 from lib.utils import get_time_ms
-from prompt_constructor import WorkflowInput, construct_workflow_prompt
+from lib.metrics import (
+    REGISTRY,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    merge_snapshots,
+)
+from comfy.metrics import RESPONSE_BYTES
+from comfy.graph_optimizer import optimize_prompt
+from comfy.media_ingest import MediaIngest, media_inputs
+from comfy.prompt_validation import (
+    NODE_SCHEMAS_PATH,
+    NodeSchemaIndex,
+    PromptValidator,
+    load_node_schemas,
+    models_modified_at,
+    save_node_schemas,
+)
+from comfy.timeline import NodeLatencyHistograms
+from lib.exceptions import PromptValidationError
+from prompt_constructor import DEFAULT_WORKFLOW, WORKFLOWS, WorkflowInput
+import asyncio
 import os
-from fastapi import FastAPI, HTTPException
+import json
+import threading
+import time
+from fastapi import Body, FastAPI, HTTPException, Request, Response
+from pydantic import BaseModel, ValidationError
+from starlette.datastructures import UploadFile
+from typing import Any, Dict, List, Optional, Union
 from volume_updaters.individual_hf_models import HfModelsVolumeUpdater
 
 APP_NAME = "comfy-worker"
@@ -24,9 +53,45 @@ VOLUME_NAME = f"{APP_NAME}-volume"
 
 app = App(APP_NAME)
 volume = Volume.from_name(VOLUME_NAME, create_if_missing=True)
+# Stats of every running worker container by container id, aggregated by the
+# gateway, and the totals of the stopped ones (see read_worker_stats)
+worker_stats = ModalDict.from_name(f"{APP_NAME}-worker-stats", create_if_missing=True)
 
 local_snapshot_path = os.path.join(os.path.dirname(__file__), "snapshot.json")
 local_prompt_path = os.path.join(os.path.dirname(__file__), "prompt.json")
+local_workflows_dir = os.path.join(os.path.dirname(__file__), "workflows")
+
+MODELS_DIR = "/root/ComfyUI/models"
+# Results shared by the workers and the gateway through the models volume
+RESULT_CACHE_DIR = "/root/ComfyUI/models/.result_cache"
+# Seconds between reloads of the volume in the gateway, to see new results
+VOLUME_RELOAD_INTERVAL = 5.0
+# Node schemas saved by the latest worker, with the models of the volume it saw
+NODE_SCHEMAS_VOLUME_PATH = "/root/ComfyUI/models/.node_schemas.json"
+# Files sent to the multipart routes, streamed there by the gateway for the workers
+uploads_volume = Volume.from_name(f"{APP_NAME}-uploads", create_if_missing=True)
+UPLOADS_DIR = "/root/uploads"
+# Staged uploads unused for longer are removed by the gateway
+UPLOAD_MAX_AGE = 60 * 60
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+CONTAINER_ID = os.environ.get("MODAL_TASK_ID", "local")
+# Seconds between two updates of the stats of a worker in worker_stats
+STATS_PUBLISH_INTERVAL = 10.0
+# Workers that didn't update their stats for longer are taken for crashed, their
+# stats are folded like those of the stopped ones. Longer than any execution, a
+# running worker folded too early would count its totals twice
+WORKER_STATS_MAX_AGE = 60 * 60
+# Gauges of workers that didn't update their stats for longer are left out
+WORKER_GAUGES_MAX_AGE = 5 * 60
+# Node latency samples kept for the stopped workers
+NODE_LATENCY_SAMPLES = 1000
+# Seconds a request may run, counted from when the gateway received it. Hung
+# workflows are interrupted then instead of holding the GPU until Modal kills them
+EXECUTION_TIMEOUT = 600
+# Modal's timeout of an input leaves time to interrupt the prompt, see
+# ComfyConfig.CANCEL_GRACE_PERIOD, and to send the error back
+WORKER_TIMEOUT = EXECUTION_TIMEOUT + 60
 
 github_secret = Secret.from_name(
     "github-secret",
@@ -63,22 +128,41 @@ async def volume_updater():
 image = get_comfy_image(
     local_snapshot_path=local_snapshot_path,
     local_prompt_path=local_prompt_path,
+    local_workflows_dir=local_workflows_dir
+    if os.path.isdir(local_workflows_dir)
+    else None,
     github_secret=github_secret,
     volume_updater=volume_updater,
     volume=volume,
+    # Lets the gateway reject invalid prompts without starting a GPU container
+    capture_node_schemas=True,
 )
 
 
+def build_prompt(workflow_name: str, payload: Any) -> Dict:
+    """Render the prompt of a request without the nodes its outputs don't need."""
+    prompt, optimization = optimize_prompt(
+        WORKFLOWS.construct_prompt(workflow_name, payload), load_node_schemas()
+    )
+    if optimization.removed:
+        logger.info(
+            f"Optimized {workflow_name}: pruned {optimization.pruned}, "
+            f"merged {optimization.merged}"
+        )
+    return prompt
+
+
 @app.cls(
     image=image,
     # Add in your secrets
     secrets=[],
     # Add in your volumes
-    volumes={"/root/ComfyUI/models": volume},
+    volumes={"/root/ComfyUI/models": volume, UPLOADS_DIR: uploads_volume},
     gpu="l4",
-    # allow_concurrent_inputs=3,
+    # Lets concurrent requests share a prompt, see ComfyConfig.BATCH_MAX_SIZE
+    allow_concurrent_inputs=4,
     # concurrency_limit=10,
-    # timeout=38,
+    timeout=WORKER_TIMEOUT,
     container_idle_timeout=60,
     # keep_warm=1,
     retries=1,
@@ -87,32 +171,84 @@ class ComfyWorkflow:
     @enter()
     def run_this_on_container_startup(self):
         self.web_app = FastAPI()
-        self.server = ComfyServer()
+        config = ComfyConfig(
+            EXECUTION_TIMEOUT=EXECUTION_TIMEOUT,
+            # Share cached results with the gateway through the models volume
+            RESULT_CACHE_DIR=RESULT_CACHE_DIR,
+            INPUT_STAGING_DIR=UPLOADS_DIR,
+        )
+        self.server = ComfyServer(config)
         self.server.start()
+        # Parse the default template while ComfyUI boots, others load on first use
+        WORKFLOWS.get(DEFAULT_WORKFLOW).template
         self.server.wait_until_ready()
+        self.result_cache = ResultCache(config)
+        # Runs the concurrent inputs of the same workflow as one prompt
+        self.batcher = ExecutionBatcher(self.server)
+        self.media = MediaIngest(config, self.server.client)
+        self._stats_task: Optional[asyncio.Task] = None
+        self._stats_published_at = 0.0
+        # Off the startup path, /object_info takes a while with many custom nodes
+        threading.Thread(target=self.refresh_node_schemas, daemon=True).start()
+        threading.Thread(target=self.load_node_latencies, daemon=True).start()
+
+    def load_node_latencies(self):
+        """Estimate the progress and ETA of the first jobs from the node latencies
+        of every worker so far, instead of the defaults of ComfyJobProgress."""
+        try:
+            stats = dict(worker_stats.items())
+        except Exception as e:
+            logger.warning(f"Failed to load the node latencies of the workers: {e}")
+            return
+        self.server.node_latencies.prior = NodeLatencyHistograms.merge(
+            entry.get("node_latencies", {}) for entry in stats.values()
+        )
+
+    def refresh_node_schemas(self):
+        """Share the node schemas with the gateway, with the models added since the
+        image was built."""
+        try:
+            save_node_schemas(self.server, NODE_SCHEMAS_VOLUME_PATH)
+        except Exception as e:
+            logger.warning(f"Failed to save the node schemas: {e}")
 
     @method()
-    async def infer(self, payload: WorkflowInput):
+    async def infer(
+        self,
+        payload: Union[WorkflowInput, Dict[str, Any]],
+        workflow_name: str = DEFAULT_WORKFLOW,
+        limits: Optional[ExecutionLimits] = None,
+        received_at: Optional[float] = None,
+    ):
         server_ws_connection = None
         job_start_time = get_time_ms()
-        prompt = construct_workflow_prompt(payload)
+        workflow_input = WORKFLOWS.get(workflow_name).parse_input(payload)
+        if any(
+            media.path is not None and not os.path.exists(media.path)
+            for media in media_inputs(workflow_input)
+        ):
+            # Staged by the gateway since this container last saw the volume
+            await uploads_volume.reload.aio()
+        # Input images are written once per content hash, before the prompt names them
+        await self.media.ingest_all(workflow_input)
+        prompt = build_prompt(workflow_name, workflow_input)
 
         try:
-            # Initialize img_bytes in the outer scope
-            self.img_bytes = None
+            # Collected per request, several inputs can run on the same container
+            outputs = {"img_bytes": None}
             # Define callbacks for execution monitoring
             callbacks = ExecutionCallbacks(
                 on_error=lambda error_data: (logger.error(error_data),),
                 on_done=lambda msg: (
                     logger.info("Job Completed. Sending Completion Event."),
                 ),
-                # The example comfy workflow sends a binary message with the image at the last node.
-                # We need to extract the image from the binary message and set it as img_bytes.
                 on_ws_message=lambda type, msg: (
-                    logger.info(f"Received message: {type} - {msg}")
-                    if type != "binary"
-                    else None,
-                    setattr(self, "img_bytes", msg[8:]) if type == "binary" else None,
+                    logger.info(f"Received message: {type} - {msg}"),
+                ),
+                # The example comfy workflow sends the image from a SaveImageWebsocket node
+                # at the end, step previews are dropped before reaching the callbacks.
+                on_output=lambda node, image, image_format: (
+                    outputs.update(img_bytes=image),
                 ),
                 on_start=lambda msg: (
                     logger.info(
@@ -121,19 +257,35 @@ class ComfyWorkflow:
                 ),
             )
 
+            # Time spent queueing in Modal counts toward the timeout of the request
+            limits = limits or ExecutionLimits()
+            data = ExecutionData(
+                prompt=prompt,
+                process_id="123",
+                timeout=limits.timeout,
+                deadline=limits.deadline,
+                received_at=received_at or time.time(),
+            )
+
             # Execute the prompt
-            execution_result = await self.server.execute(
-                data=ExecutionData(prompt=prompt, process_id="123"), callbacks=callbacks
+            execution_result = await self.batcher.execute(
+                data=data, callbacks=callbacks
             )
 
             json_response = execution_result.model_dump()
 
-            if self.img_bytes:
+            if outputs["img_bytes"]:
                 import base64
 
                 # Convert img_bytes to base64
-                img_base64 = base64.b64encode(self.img_bytes).decode("utf-8")
+                img_base64 = base64.b64encode(outputs["img_bytes"]).decode("utf-8")
                 json_response["output_image"] = img_base64
+                RESPONSE_BYTES.inc(len(outputs["img_bytes"]))
+                # Looked up by the gateway, which can't name ingested media inputs
+                if not media_inputs(workflow_input):
+                    await self.result_cache.put(
+                        prompt, json.dumps(json_response).encode("utf-8")
+                    )
 
             return json_response
         except Exception as e:
@@ -142,15 +294,291 @@ class ComfyWorkflow:
         finally:
             if server_ws_connection:
                 server_ws_connection.close()
+            self.publish_stats_soon()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "updated_at": time.time(),
+            "metrics": REGISTRY.snapshot(),
+            "node_latencies": self.server.node_latencies.snapshot(),
+        }
+
+    def publish_stats_soon(self):
+        """Update the stats of this container in worker_stats in the background,
+        at most once per STATS_PUBLISH_INTERVAL."""
+        if self._stats_task is None or self._stats_task.done():
+            self._stats_task = asyncio.create_task(self.publish_stats())
+
+    async def publish_stats(self):
+        await asyncio.sleep(
+            self._stats_published_at + STATS_PUBLISH_INTERVAL - time.monotonic()
+        )
+        self._stats_published_at = time.monotonic()
+        try:
+            await worker_stats.put.aio(CONTAINER_ID, self.stats())
+        except Exception as e:
+            logger.warning(f"Failed to publish the worker stats: {e}")
+
+    @exit()
+    def publish_final_stats(self):
+        worker_stats.put(CONTAINER_ID, {**self.stats(), "stopped": True})
+
+    @exit()
+    async def close_media(self):
+        # Runs on the event loop of the inputs, which owns the download session
+        await self.media.close()
 
 
 web_app = FastAPI()
 
+GATEWAY_REQUESTS = REGISTRY.counter(
+    "gateway_requests_total", "Requests handled by the API gateway", ["route", "status"]
+)
+GATEWAY_SECONDS = REGISTRY.histogram(
+    "gateway_request_seconds", "Latency of the API gateway routes", ["route"]
+)
+
+
+@web_app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start_time = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template so ids in the path don't create new series
+        route = request.scope.get("route")
+        path = route.path if route else "unmatched"
+        GATEWAY_REQUESTS.labels(path, status).inc()
+        GATEWAY_SECONDS.labels(path).observe(time.perf_counter() - start_time)
+
+
+@web_app.get("/metrics")
+async def gateway_metrics():
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+def fold_worker_stats(stats: List[Dict[str, Any]], now: float) -> Dict[str, Any]:
+    """
+    One entry with the counters, histograms and node latencies of several, without
+    their gauges. Node latency samples are shared out so the entry stays bounded.
+    """
+    return {
+        "updated_at": now,
+        "metrics": merge_snapshots(
+            {str(i): entry.get("metrics", {}) for i, entry in enumerate(stats)},
+            live=(),
+        ).snapshot(),
+        "node_latencies": NodeLatencyHistograms.merge(
+            (entry.get("node_latencies", {}) for entry in stats),
+            max_samples=max(1, NODE_LATENCY_SAMPLES // max(len(stats), 1)),
+        ).snapshot(),
+    }
+
+
+async def read_worker_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Stats of the workers by container id. Workers that stopped, or crashed, are
+    folded into the entry of this gateway container and deleted, so reading takes
+    as long for the running workers only and the totals never go down.
+    """
+    now = time.time()
+    stats = {key: value async for key, value in worker_stats.items.aio()}
+    retired = [
+        container_id
+        for container_id, entry in stats.items()
+        if container_id != CONTAINER_ID
+        and (entry.get("stopped") or now - entry["updated_at"] > WORKER_STATS_MAX_AGE)
+    ]
+    if not retired:
+        return stats
+    folded = [stats[CONTAINER_ID]] if CONTAINER_ID in stats else []
+    for container_id in retired:
+        del stats[container_id]
+        try:
+            # Only one of the gateways reading at the same time gets the entry
+            folded.append(await worker_stats.pop.aio(container_id))
+        except KeyError:
+            pass
+    stats[CONTAINER_ID] = fold_worker_stats(folded, now)
+    await worker_stats.put.aio(CONTAINER_ID, stats[CONTAINER_ID])
+    return stats
+
+
+@web_app.get("/metrics/worker")
+async def worker_metrics():
+    # Counters and histograms are summed over every worker that ever ran, so they
+    # never go down, gauges have a series per running worker
+    now = time.time()
+    stats = await read_worker_stats()
+    live = [
+        container_id
+        for container_id, container_stats in stats.items()
+        if now - container_stats["updated_at"] < WORKER_GAUGES_MAX_AGE
+    ]
+    metrics = merge_snapshots(
+        {
+            container_id: container_stats.get("metrics", {})
+            for container_id, container_stats in stats.items()
+        },
+        live,
+    )
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+_prompt_validator: Optional[PromptValidator] = None
+_node_schemas_mtime: Optional[float] = None
+# Time the loaded index was saved at, and when the model folders were compared to it
+_index_saved_at = 0.0
+_models_checked_at = 0.0
+
+
+async def get_prompt_validator() -> Optional[PromptValidator]:
+    """
+    Validator of the node schemas saved by the latest worker on the volume, or of
+    the ones captured at build until a worker saved them. None if there are none.
+
+    Model names are checked while the index is newer than the model folders of the
+    volume, which are compared at most every VOLUME_RELOAD_INTERVAL seconds. The
+    folders are walked off the event loop, requests meanwhile use the last result.
+    """
+    global _prompt_validator, _node_schemas_mtime, _index_saved_at
+    global _models_checked_at
+    try:
+        mtime = os.stat(NODE_SCHEMAS_VOLUME_PATH).st_mtime
+    except OSError:
+        mtime = None
+    if mtime is not None and mtime != _node_schemas_mtime:
+        _node_schemas_mtime = mtime
+        try:
+            # Model names are left to ComfyUI until the folders were compared
+            _prompt_validator = PromptValidator(
+                NodeSchemaIndex.load(NODE_SCHEMAS_VOLUME_PATH), check_models=False
+            )
+            _index_saved_at = mtime
+            _models_checked_at = 0.0
+        except Exception as e:
+            logger.warning(f"Failed to load the node schemas of the workers: {e}")
+    if _prompt_validator is None:
+        index = load_node_schemas()
+        if index is None:
+            return None
+        _prompt_validator = PromptValidator(index, check_models=False)
+        _index_saved_at = os.stat(NODE_SCHEMAS_PATH).st_mtime
+    validator = _prompt_validator
+    if time.monotonic() - _models_checked_at > VOLUME_RELOAD_INTERVAL:
+        # Set first so the requests arriving during the walk don't start another
+        _models_checked_at = time.monotonic()
+        saved_at = _index_saved_at
+        try:
+            modified_at = await asyncio.to_thread(models_modified_at, MODELS_DIR)
+            validator.check_models = modified_at <= saved_at
+        except OSError as e:
+            logger.warning(f"Failed to read the model folders: {e}")
+            validator.check_models = False
+    return validator
+
+
+async def validate_prompt(workflow_name: str, prompt: Dict) -> None:
+    """Check the prompt of a request like ComfyUI would."""
+    workflow = WORKFLOWS.get(workflow_name)
+    if not workflow.validate_prompt:
+        return
+    validator = await get_prompt_validator()
+    if validator is None:
+        return
+    try:
+        validator.check(prompt, workflow.unchecked_classes)
+    except PromptValidationError as e:
+        raise HTTPException(status_code=400, detail=e.details)
+
+
+_result_cache: Optional[ResultCache] = None
+_volume_reloaded_at = 0.0
+# Call IDs of the async routes answered from the result cache, followed by the key
+CACHED_CALL_PREFIX = "cached-"
+
+
+async def get_result_cache() -> ResultCache:
+    """
+    The result cache of the gateway. Workers store results on the volume, which is
+    reloaded at most every VOLUME_RELOAD_INTERVAL seconds to see the ones written
+    since.
+    """
+    global _result_cache, _volume_reloaded_at
+    if _result_cache is None:
+        # Expiry and eviction are left to the workers, see ResultCache
+        _result_cache = ResultCache(
+            ComfyConfig(RESULT_CACHE_DIR=RESULT_CACHE_DIR), read_only=True
+        )
+    if time.monotonic() - _volume_reloaded_at > VOLUME_RELOAD_INTERVAL:
+        _volume_reloaded_at = time.monotonic()
+        try:
+            await volume.reload.aio()
+        except Exception as e:
+            # Fails while another request reads a file of the volume
+            logger.warning(f"Failed to reload the volume: {e}")
+    return _result_cache
+
+
+def cache_hit(cached_response: bytes) -> Dict:
+    return {**json.loads(cached_response), "cache_hit": True}
+
+
+async def cached_result(workflow_input: BaseModel, prompt: Dict) -> Optional[Dict]:
+    """Result of an identical earlier request, looked up before a GPU container is
+    called."""
+    if media_inputs(workflow_input):
+        # Media inputs are named by the hash of their content once ingested
+        return None
+    cached_response = await (await get_result_cache()).get(prompt)
+    if cached_response is None:
+        return None
+    return cache_hit(cached_response)
+
+
+async def check_request(
+    workflow_name: str, payload: Any, spawn: bool = False
+) -> Optional[Dict]:
+    """
+    Validate the prompt of a request and return the result of an identical earlier
+    request, if any. The input is parsed and the prompt rendered once for both.
+
+    With spawn, for the async routes, a hit is answered like a spawned call: its
+    call ID starts with CACHED_CALL_PREFIX and /status/{call_id} returns the result.
+    """
+    workflow_input = WORKFLOWS.get(workflow_name).parse_input(payload)
+    prompt = build_prompt(workflow_name, workflow_input)
+    await validate_prompt(workflow_name, prompt)
+    cached = await cached_result(workflow_input, prompt)
+    if cached is None or not spawn:
+        return cached
+    return {"call_id": CACHED_CALL_PREFIX + ResultCache.key(prompt)}
+
+
+def request_limits(payload: Union[BaseModel, Dict[str, Any]]) -> ExecutionLimits:
+    """Timeout and deadline sent along with the input of a workflow."""
+    if isinstance(payload, BaseModel):
+        payload = payload.model_dump()
+    try:
+        return ExecutionLimits.model_validate(payload)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+
 
 @web_app.post("/infer_sync")
 async def infer(payload: WorkflowInput):
+    received_at = time.time()
+    # Identical prompts produce identical images, skip the GPU entirely
+    cached = await check_request(DEFAULT_WORKFLOW, payload)
+    if cached is not None:
+        return cached
     try:
-        execution_result = ComfyWorkflow().infer.remote(payload)
+        execution_result = await ComfyWorkflow().infer.remote.aio(
+            payload, DEFAULT_WORKFLOW, request_limits(payload), received_at
+        )
         return execution_result
     except Exception as e:
         print("Error in infer", e)
@@ -159,8 +587,183 @@ async def infer(payload: WorkflowInput):
 
 @web_app.post("/infer_async")
 async def infer_async(payload: WorkflowInput):
+    received_at = time.time()
+    cached_call = await check_request(DEFAULT_WORKFLOW, payload, spawn=True)
+    if cached_call is not None:
+        return cached_call
     try:
-        call = ComfyWorkflow().infer.spawn(payload)
+        call = await ComfyWorkflow().infer.spawn.aio(
+            payload, DEFAULT_WORKFLOW, request_limits(payload), received_at
+        )
+        return {"call_id": call.object_id}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def validate_workflow_payload(workflow_name: str, payload: Dict[str, Any]) -> Dict:
+    """Check the payload in the gateway so bad requests never reach a GPU container."""
+    if workflow_name not in WORKFLOWS:
+        raise HTTPException(status_code=404, detail=f"Unknown workflow {workflow_name}")
+    try:
+        payload = WORKFLOWS.get(workflow_name).parse_input(payload).model_dump()
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    return payload
+
+
+@web_app.get("/workflows")
+async def list_workflows():
+    return {
+        name: WORKFLOWS.get(name).input_model.model_json_schema()
+        for name in WORKFLOWS.names()
+    }
+
+
+@web_app.post("/infer_sync/{workflow_name}")
+async def infer_workflow(workflow_name: str, payload: Dict[str, Any] = Body(...)):
+    received_at = time.time()
+    limits = request_limits(payload)
+    payload = validate_workflow_payload(workflow_name, payload)
+    cached = await check_request(workflow_name, payload)
+    if cached is not None:
+        return cached
+    try:
+        return await ComfyWorkflow().infer.remote.aio(
+            payload, workflow_name, limits, received_at
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@web_app.post("/infer_async/{workflow_name}")
+async def infer_workflow_async(workflow_name: str, payload: Dict[str, Any] = Body(...)):
+    received_at = time.time()
+    limits = request_limits(payload)
+    payload = validate_workflow_payload(workflow_name, payload)
+    cached_call = await check_request(workflow_name, payload, spawn=True)
+    if cached_call is not None:
+        return cached_call
+    try:
+        call = await ComfyWorkflow().infer.spawn.aio(
+            payload, workflow_name, limits, received_at
+        )
+        return {"call_id": call.object_id}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+_upload_ingest: Optional[MediaIngest] = None
+_uploads_pruned_at = 0.0
+
+
+async def stage_upload(upload: UploadFile) -> str:
+    """
+    Stream an uploaded file to the uploads volume in chunks, hashing it on the way
+    like MediaIngest does for URLs, and return its path. Files are named after
+    their content, an upload sent again replaces nothing.
+    """
+    global _upload_ingest
+    if _upload_ingest is None:
+        _upload_ingest = MediaIngest(ComfyConfig())
+
+    async def chunks():
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+
+    try:
+        digest, temporary = await _upload_ingest.spool(
+            chunks(), upload.filename or "upload", UPLOADS_DIR
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    path = os.path.join(UPLOADS_DIR, digest)
+    await asyncio.to_thread(_store_upload, temporary, path)
+    return path
+
+
+def _store_upload(temporary: str, path: str) -> None:
+    if os.path.exists(path):
+        os.remove(temporary)
+        # Counts as used again, see prune_uploads
+        os.utime(path)
+    else:
+        os.replace(temporary, path)
+
+
+async def prune_uploads() -> None:
+    """Remove the staged uploads unused for UPLOAD_MAX_AGE, at most every quarter
+    of it. Workers ingest them long before."""
+    global _uploads_pruned_at
+    if time.monotonic() - _uploads_pruned_at < UPLOAD_MAX_AGE / 4:
+        return
+    _uploads_pruned_at = time.monotonic()
+    await asyncio.to_thread(_remove_expired_uploads, time.time() - UPLOAD_MAX_AGE)
+
+
+def _remove_expired_uploads(expired_before: float) -> None:
+    for entry in os.scandir(UPLOADS_DIR):
+        try:
+            if entry.stat().st_mtime < expired_before:
+                os.remove(entry.path)
+        except OSError as e:
+            logger.warning(f"Failed to remove the upload {entry.name}: {e}")
+
+
+async def read_multipart_payload(request: Request) -> Dict[str, Any]:
+    """
+    Payload of a multipart request: the JSON `payload` field, with each uploaded
+    file set as the media input of the field it was sent under. Files are staged
+    on the uploads volume for the worker instead of being sent along.
+    """
+    form = await request.form()
+    try:
+        payload = json.loads(form.get("payload") or "{}")
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid payload: {e}")
+    uploads = [
+        (field, value)
+        for field, value in form.multi_items()
+        if isinstance(value, UploadFile)
+    ]
+    if not uploads:
+        return payload
+    await prune_uploads()
+    for field, value in uploads:
+        payload[field] = {"path": await stage_upload(value), "filename": value.filename}
+    await uploads_volume.commit.aio()
+    return payload
+
+
+@web_app.post("/infer_sync/{workflow_name}/multipart")
+async def infer_workflow_multipart(workflow_name: str, request: Request):
+    received_at = time.time()
+    payload = await read_multipart_payload(request)
+    limits = request_limits(payload)
+    payload = validate_workflow_payload(workflow_name, payload)
+    cached = await check_request(workflow_name, payload)
+    if cached is not None:
+        return cached
+    try:
+        return await ComfyWorkflow().infer.remote.aio(
+            payload, workflow_name, limits, received_at
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@web_app.post("/infer_async/{workflow_name}/multipart")
+async def infer_workflow_multipart_async(workflow_name: str, request: Request):
+    received_at = time.time()
+    payload = await read_multipart_payload(request)
+    limits = request_limits(payload)
+    payload = validate_workflow_payload(workflow_name, payload)
+    cached_call = await check_request(workflow_name, payload, spawn=True)
+    if cached_call is not None:
+        return cached_call
+    try:
+        call = await ComfyWorkflow().infer.spawn.aio(
+            payload, workflow_name, limits, received_at
+        )
         return {"call_id": call.object_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -168,9 +771,17 @@ async def infer_async(payload: WorkflowInput):
 
 @web_app.get("/status/{call_id}")
 async def status(call_id: str):
+    if call_id.startswith(CACHED_CALL_PREFIX):
+        result_cache = await get_result_cache()
+        cached_response = await result_cache.get_by_key(
+            call_id[len(CACHED_CALL_PREFIX) :]
+        )
+        if cached_response is None:
+            return {"result": {"result": None, "status": "expired"}}
+        return {"result": cache_hit(cached_response)}
     function_call = functions.FunctionCall.from_id(call_id)
     try:
-        result = function_call.get(timeout=5)
+        result = await function_call.get.aio(timeout=5)
     except exception.OutputExpiredError:
         result = {"result": None, "status": "expired"}
     except TimeoutError:
@@ -178,14 +789,32 @@ async def status(call_id: str):
     return {"result": result}
 
 
+@web_app.get("/metrics/nodes")
+async def node_metrics():
+    # p50/p95/p99 node durations by class_type over the samples of every worker,
+    # the stopped ones through the entries they were folded into
+    stats = await read_worker_stats()
+    return NodeLatencyHistograms.merge(
+        entry.get("node_latencies", {}) for entry in stats.values()
+    ).summary()
+
+
 @web_app.post("/cancel/{call_id}")
 async def cancel(call_id: str):
+    # Cancelling the call cancels the running `infer`, which interrupts the prompt in ComfyUI
+    if call_id.startswith(CACHED_CALL_PREFIX):
+        # Answered from the result cache, nothing runs
+        return {"call_id": call_id}
     function_call = functions.FunctionCall.from_id(call_id)
-    function_call.cancel()
+    await function_call.cancel.aio()
     return {"call_id": call_id}
 
 
-@app.function(image=image)
+# The volumes hold the results cached by the workers and the uploads for them
+@app.function(
+    image=image,
+    volumes={"/root/ComfyUI/models": volume, UPLOADS_DIR: uploads_volume},
+)
 @asgi_app()
 def asgi_app():
     return web_app